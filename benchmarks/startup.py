@@ -0,0 +1,62 @@
+'''Measures app startup time and memory with deferred imports and with the heavy modules imported up front
+(how the app started before), each in a fresh interpreter.
+
+    python benchmarks/startup.py [RUNS]
+'''
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+CHILD = '''
+import json, resource, time
+start = time.perf_counter()
+{eager}
+from webapp import create_app
+app = create_app()
+created = time.perf_counter()
+app.test_client().get('/')
+first_request = time.perf_counter()
+print(json.dumps({{
+    'create_app_ms': (created - start) * 1000,
+    'first_request_ms': (first_request - created) * 1000,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+}}))
+'''
+
+MODES = {
+    'deferred': '',
+    'eager': 'import numpy, pandas, yfinance, markdown'
+}
+
+
+def run(eager: str, env: dict) -> dict:
+    '''Starts the app in a new interpreter and returns its timings
+    '''
+    output = subprocess.run([sys.executable, '-c', CHILD.format(eager=eager)],
+                            cwd=SRC_DIR, env=env, check=True, capture_output=True, text=True).stdout
+
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(runs: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            'DB_PASSWORD': f'sqlite:///{os.path.join(tmp, "bench.sqlite")}',
+            'SCHEDULER_AUTOSTART': 'false'
+        }
+
+        for mode, eager in MODES.items():
+            results = [run(eager, env) for _ in range(runs)]
+
+            summary = ', '.join(f'{key} {statistics.median(r[key] for r in results):8.1f}' for key in results[0])
+            print(f'{mode:>9}: {summary}  (median of {runs})')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,45 @@
+'''Compares per-row timezone conversion with the vectorized market time helpers.
+
+    python benchmarks/timezones.py [ROWS]
+'''
+import sys
+import os
+import timeit
+from datetime import datetime, timedelta, timezone
+
+import pytz
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from webapp.market_calendar import format_market_times, to_epoch_seconds
+
+
+def per_row(times: list) -> list:
+    '''The previous path: a new zone and a strftime call for every row
+    '''
+    return [t.astimezone(pytz.timezone('US/Eastern')).strftime('%Y-%m-%d %H:%M') for t in times]
+
+
+def bulk(times: list) -> list:
+    '''Converts and formats all rows at once with a cached zone
+    '''
+    return format_market_times(times, '%Y-%m-%d %H:%M')
+
+
+def main(rows: int) -> None:
+    start = datetime(2024, 1, 2, 14, 30, tzinfo=timezone.utc)
+    times = [start + timedelta(minutes=30 * i) for i in range(rows)]
+
+    assert per_row(times) == bulk(times)
+
+    for name, func in [('per row', lambda: per_row(times)),
+                       ('bulk', lambda: bulk(times)),
+                       ('per row epoch', lambda: [t.timestamp() for t in times]),
+                       ('bulk epoch', lambda: to_epoch_seconds(times))]:
+        runs = 5
+        seconds = min(timeit.repeat(func, number=1, repeat=runs))
+        print(f'{name:>14}: {seconds * 1000:8.2f} ms for {rows} rows')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,30 @@
+import os
+
+# load the app once in the master, workers are forked from it and share its memory (copy on write)
+preload_app = True
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+
+# scheduler threads don't survive a fork, the scheduler is started in a worker in post_fork
+os.environ.setdefault('SCHEDULER_AUTOSTART', 'false')
+
+
+def when_ready(server):
+    # the app defers pandas, yfinance, etc. until first use, import them in the master
+    # so the workers share them instead of each importing its own copy
+    from webapp.lazy import warm_imports
+
+    server.log.info('Preloaded %s', ', '.join(warm_imports()) or 'nothing')
+
+
+def post_fork(server, worker):
+    from app import app
+    from webapp import db, start_scheduler
+
+    # connections opened by the master must not be shared by the workers
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+    # the first worker to take the lock runs the jobs
+    if start_scheduler(app):
+        server.log.info('Scheduler running in worker %s', worker.pid)
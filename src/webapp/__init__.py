@@ -2,9 +2,16 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_apscheduler import APScheduler
+from werkzeug.middleware.proxy_fix import ProxyFix
+import click
 import os
 
-db = SQLAlchemy()
+from .database import RoutingSession, get_engine_options, REPLICA_BIND
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# held by the process running the scheduler so only one gunicorn worker runs the jobs
+scheduler_lock = {'file': None}
 
 class Config:
     SCHEDULER_API_ENABLED = True
@@ -16,10 +23,52 @@ def create_app():
     app.config['SECRET_KEY'] = 'spooky secret'
 
     app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DB_PASSWORD', 'sqlite:///db.sqlite')
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = get_engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+
+    # optional read replica for read only pages
+    replica_uri = os.environ.get('DB_REPLICA_URL')
+
+    if replica_uri:
+        app.config['SQLALCHEMY_BINDS'] = {
+            REPLICA_BIND: {'url': replica_uri, **get_engine_options(replica_uri)}
+        }
+
+    # unchanged portfolio values are still recorded to history this often
+    app.config['HISTORY_HEARTBEAT_HOURS'] = int(os.environ.get('HISTORY_HEARTBEAT_HOURS', 24))
+    # months of history kept, older monthly partitions are dropped. 0 keeps everything
+    app.config['HISTORY_RETENTION_MONTHS'] = int(os.environ.get('HISTORY_RETENTION_MONTHS', 0))
+
+    # fixed exchange rates instead of the fetched ones, e.g. "CAD:0.73,EUR:1.08"
+    from .fx import parse_static_rates
+    app.config['FX_STATIC_RATES'] = parse_static_rates(os.environ.get('FX_STATIC_RATES', ''))
+
+    # token buckets for views that call yfinance, per user and per IP
+    # "memory" keeps them per worker, "database" shares them between workers
+    app.config['RATE_LIMIT_BACKEND'] = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+    app.config['RATE_LIMIT_CAPACITY'] = int(os.environ.get('RATE_LIMIT_CAPACITY', 10))
+    app.config['RATE_LIMIT_PER_MINUTE'] = int(os.environ.get('RATE_LIMIT_PER_MINUTE', 20))
+
+    # proxies in front of the app, their X-Forwarded-For hops give the client IP the rate limits use.
+    # none by default, a client could spoof its IP if a proxy that isn't there was trusted
+    app.config['PROXY_COUNT'] = int(os.environ.get('PROXY_COUNT', 0))
+
+    # start the scheduler in create_app, gunicorn.conf.py turns this off and starts it after the fork.
+    # off by default for `flask ...` commands, short lived processes like init-db and assets build
+    # must not take the scheduler lock or run jobs
+    autostart_default = 'false' if os.environ.get('FLASK_RUN_FROM_CLI') == 'true' else 'true'
+    app.config['SCHEDULER_AUTOSTART'] = os.environ.get('SCHEDULER_AUTOSTART', autostart_default).lower() == 'true'
+    app.config['SCHEDULER_LOCK_FILE'] = os.environ.get('SCHEDULER_LOCK_FILE', os.path.join(app.instance_path, 'scheduler.lock'))
+
+    # directory of markdown blog posts used by `flask blog sync`
+    app.config['BLOG_POSTS_DIR'] = os.environ.get('BLOG_POSTS_DIR', os.path.join(app.root_path, 'posts'))
 
     # Disable tracking modifications to avoid a warning
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     
+    # behind a proxy (the Heroku router, PROXY_COUNT=1 in the Procfile) use the address it forwarded
+    if app.config['PROXY_COUNT']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_COUNT'])
+
     db.init_app(app)
 
     # register blueprints 
@@ -27,38 +76,96 @@ def create_app():
     from .auth import auth
     from .portfolio_sim import portfolio_sim
     from .blog import blog
+    from .assets import assets, asset_url
 
     app.register_blueprint(views, url_prefix='/')
     app.register_blueprint(auth, url_prefix='/')
     app.register_blueprint(portfolio_sim, url_prefix='/')
     app.register_blueprint(blog, url_prefix='/')
+    app.register_blueprint(assets, url_prefix='/')
+
+    # fingerprinted urls of the static files built by `flask assets build`
+    app.add_template_global(asset_url)
 
     # initiate scheduler
     scheduler = APScheduler()
     scheduler.init_app(app)
 
-    # define jobs
+    # define jobs, the cron triggers only wake the jobs up and the market calendar
+    # decides if there is a session (holidays, early closes, before open/after close)
     def update_prices():
-        from .scheduler_functions import update_prices, update_portfolio_value, save_history
+        from .scheduler_functions import update_prices, update_portfolio_value, save_history, refresh_fx_rates
+        from .aggregates import revalue_aggregates
+        from .market_calendar import is_session_tick
+
+        if not is_session_tick():
+            return
 
         with app.app_context():
-            update_prices()
-            update_portfolio_value()
+            changed_currencies = refresh_fx_rates()
+            changed_tickers = update_prices()
+            update_portfolio_value(changed_tickers, changed_currencies)
+            revalue_aggregates(changed_tickers, changed_currencies)
             save_history()
 
     def update_open():
         from .scheduler_functions import update_opening_prices
+        from .market_calendar import is_session_tick
+
+        if not is_session_tick():
+            return
 
         with app.app_context():
             update_opening_prices()
 
     def update_close():
         from .scheduler_functions import update_last_close_value
+        from .market_calendar import get_market_time, is_trading_day
+
+        # nothing traded since the last close on holidays
+        if not is_trading_day(get_market_time().date()):
+            return
 
         with app.app_context():
             update_last_close_value()
     
-    # run every 30 minutes between 9am and 4pm
+    def refresh_securities():
+        from .scheduler_functions import refresh_securities
+
+        with app.app_context():
+            refresh_securities()
+    
+    def prefetch_news():
+        from .news import prefetch_news
+
+        with app.app_context():
+            prefetch_news()
+
+    def checkpoint_ledger():
+        from .ledger import save_checkpoints
+
+        with app.app_context():
+            save_checkpoints()
+
+    def rebuild_aggregates():
+        from .aggregates import rebuild_aggregates
+
+        with app.app_context():
+            mismatches = rebuild_aggregates()
+
+        # drift means a trade or a tick missed the incremental update, keep a record before it is overwritten
+        for m in mismatches:
+            app.logger.warning(f"aggregate drift, {m['aggregate']} {m['field']}: stored {m['stored']}, rebuilt {m['rebuilt']}")
+
+        app.logger.info(f'Aggregates rebuilt, {len(mismatches)} mismatches found')
+
+    def maintain_history():
+        from .scheduler_functions import maintain_history
+
+        with app.app_context():
+            maintain_history()
+    
+    # run every 30 minutes from the 9:30am open to the close
     scheduler.add_job(id='update_prices',
                       func=update_prices,
                       trigger='cron',
@@ -66,7 +173,7 @@ def create_app():
                       hour='9-16', 
                       minute='0, 30',
                       second='10',
-                      timezone='EST')
+                      timezone='US/Eastern')
     
     # run once at 9:30am
     scheduler.add_job(id='update_open',
@@ -76,7 +183,7 @@ def create_app():
                       hour='9', 
                       minute='30',
                       second='10',
-                      timezone='EST')
+                      timezone='US/Eastern')
     
     # run once at 6:00am
     scheduler.add_job(id='update_close',
@@ -86,13 +193,72 @@ def create_app():
                       hour='6', 
                       minute='0',
                       second='10',
-                      timezone='EST')
+                      timezone='US/Eastern')
+    
+    # company data rarely changes, run once a week on saturday at 3:00am
+    scheduler.add_job(id='refresh_securities',
+                      func=refresh_securities,
+                      trigger='cron',
+                      day_of_week='sat',
+                      hour='3',
+                      minute='0',
+                      second='10',
+                      timezone='US/Eastern')
     
-    scheduler.start()
+    # keep the news of popular tickers warm
+    scheduler.add_job(id='prefetch_news',
+                      func=prefetch_news,
+                      trigger='interval',
+                      minutes=20)
+
+    # checkpoint the day's transactions once trading is over, at 5:00pm
+    scheduler.add_job(id='checkpoint_ledger',
+                      func=checkpoint_ledger,
+                      trigger='cron',
+                      day_of_week='mon-fri',
+                      hour='17',
+                      minute='0',
+                      second='10',
+                      timezone='US/Eastern')
+    
+    # catch any drift of the market wide aggregates by rebuilding them from the holdings, daily at 2:00am
+    scheduler.add_job(id='rebuild_aggregates',
+                      func=rebuild_aggregates,
+                      trigger='cron',
+                      hour='2',
+                      minute='0',
+                      second='10',
+                      timezone='US/Eastern')
     
-    # create db if not already created
-    with app.app_context():
-        db.create_all()
+    # create next month's history partition well before it is needed, daily at 1:00am
+    scheduler.add_job(id='maintain_history',
+                      func=maintain_history,
+                      trigger='cron',
+                      hour='1',
+                      minute='0',
+                      second='10',
+                      timezone='US/Eastern')
+
+    if app.config['SCHEDULER_AUTOSTART']:
+        start_scheduler(app)
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        '''Creates the database tables that don't exist yet'''
+        from .data_models import History
+        from .history_store import create_history_table, ensure_partitions
+
+        # history is created by the history store, partitioned on postgresql
+        db.metadata.create_all(db.engine, tables=[t for t in db.metadata.sorted_tables if t is not History.__table__])
+
+        try:
+            create_history_table()
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+
+        ensure_partitions()
+
+        click.echo('Database initialised')
 
     from .data_models import User
 
@@ -104,4 +270,35 @@ def create_app():
     def load_user(id):
         return User.query.get(int(id))
 
-    return app
\ No newline at end of file
+    return app
+
+
+def start_scheduler(app) -> bool:
+    '''Starts the scheduled jobs unless another process on this machine already runs them
+        args:
+            app: Flask - the app
+        returns:
+            bool - True if this process runs the scheduler
+    '''
+    try:
+        import fcntl
+    except ImportError:
+        # no file locks (windows), run the jobs in this process
+        app.apscheduler.start()
+        return True
+
+    lock_file = app.config['SCHEDULER_LOCK_FILE']
+    os.makedirs(os.path.dirname(lock_file), exist_ok=True)
+    file = open(lock_file, 'w')
+
+    try:
+        fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        file.close()
+        return False
+
+    # the lock is released when this process exits, the next worker to start takes over
+    scheduler_lock['file'] = file
+    app.apscheduler.start()
+
+    return True
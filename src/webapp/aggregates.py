@@ -0,0 +1,226 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .data_models import Holdings, Portfolio, Security, Quote, TickerAggregate, SectorAggregate
+from .fx import convert_amount
+
+# currency of the market wide values, aggregates mix portfolios of every base currency
+AGGREGATE_CURRENCY = 'USD'
+# largest market value difference accepted by the verification, increments add up float errors
+VALUE_TOLERANCE = 0.05
+
+
+def get_unit_value(price: float, currency: str) -> float:
+    '''Gets the value of one share in the aggregate currency
+    '''
+    return convert_amount(price, currency, AGGREGATE_CURRENCY)
+
+
+def get_sector(ticker: str) -> str:
+    security = db.session.get(Security, ticker)
+
+    return security.sector if security and security.sector else 'Unknown'
+
+
+def add_to_aggregate(model, key: dict, changes: dict, new_row: dict) -> None:
+    '''Adds to the counters of an aggregate row in one UPDATE, so concurrent trades add up instead
+    of overwriting each other. Creates the row when it doesn't exist yet and drops it once nothing holds it.
+    Does not commit the session
+        args:
+            model: db.Model - TickerAggregate or SectorAggregate
+            key: dict - primary key of the row
+            changes: dict - column to amount added
+            new_row: dict - other columns of a new row
+    '''
+    now = datetime.now(timezone.utc)
+    values = {getattr(model, column): getattr(model, column) + amount for column, amount in changes.items()}
+
+    if not model.query.filter_by(**key).update({**values, model.updated_time: now}, synchronize_session=False):
+        try:
+            with db.session.begin_nested():
+                db.session.add(model(**key, **changes, **new_row, updated_time=now))
+        except IntegrityError:
+            # a concurrent trade created the row first
+            model.query.filter_by(**key).update({**values, model.updated_time: now}, synchronize_session=False)
+
+    model.query.filter_by(**key).filter(model.holdings <= 0).delete(synchronize_session=False)
+
+
+def apply_trade(ticker: str, shares: int, currency: str, holdings: int) -> None:
+    '''Applies a trade to the aggregates of its ticker and sector, in the trade's unit of work.
+    Called by update_holding before it commits. Does not commit the session
+        args:
+            ticker: str - stock ticker
+            shares: int - shares bought, negative when sold
+            currency: str - currency of the stock
+            holdings: int - 1 when a portfolio opens the position, -1 when it closes it, 0 otherwise
+    '''
+    # shares are valued at the quote the ticks revalue the aggregates with, not the trade price
+    value = shares * get_unit_value(db.session.get(Quote, ticker).last_price, currency)
+    sector = get_sector(ticker)
+    changes = {'total_shares': shares, 'holdings': holdings, 'market_value': value}
+
+    add_to_aggregate(TickerAggregate, {'ticker': ticker}, changes, {'sector': sector, 'currency': currency})
+    add_to_aggregate(SectorAggregate, {'sector': sector}, changes, {})
+
+
+def revalue_aggregates(tickers=None, currencies=None) -> int:
+    '''Revalues the aggregates after a price tick, only the tickers whose price or exchange rate moved
+        args:
+            tickers: set - tickers whose price changed
+            currencies: set - currencies whose rate changed
+                every ticker is revalued if both are None
+        returns:
+            int - number of tickers revalued
+    '''
+    query = db.session.query(TickerAggregate.ticker, TickerAggregate.currency, TickerAggregate.sector, Quote.last_price)\
+                      .join(Quote, Quote.ticker == TickerAggregate.ticker)
+
+    if tickers is not None or currencies is not None:
+        if not tickers and not currencies:
+            return 0
+
+        query = query.filter(TickerAggregate.ticker.in_(tickers or set()) | TickerAggregate.currency.in_(currencies or set()))
+
+    rows = query.all()
+    now = datetime.now(timezone.utc)
+
+    # computed from the stored shares in the UPDATE so a trade committed meanwhile is not lost
+    for ticker, currency, _, price in rows:
+        TickerAggregate.query.filter_by(ticker=ticker)\
+                             .update({TickerAggregate.market_value: TickerAggregate.total_shares * get_unit_value(price, currency),
+                                      TickerAggregate.updated_time: now}, synchronize_session=False)
+
+    # a sector is the sum of its tickers
+    for sector in {row.sector for row in rows}:
+        sector_value = db.session.query(func.sum(TickerAggregate.market_value))\
+                                 .filter(TickerAggregate.sector == sector)\
+                                 .scalar_subquery()
+
+        SectorAggregate.query.filter_by(sector=sector)\
+                             .update({SectorAggregate.market_value: sector_value,
+                                      SectorAggregate.updated_time: now}, synchronize_session=False)
+
+    db.session.commit()
+
+    return len(rows)
+
+
+def compute_aggregates() -> tuple:
+    '''Computes the ticker and sector aggregates from scratch by scanning every holding
+        returns:
+            tuple - (ticker to aggregate values, sector to aggregate values)
+    '''
+    rows = db.session.query(Holdings.ticker,
+                            func.max(Holdings.currency),
+                            func.sum(Holdings.number_of_shares),
+                            func.count(Holdings.id),
+                            func.max(Quote.last_price),
+                            func.max(Security.sector))\
+                     .join(Quote, Quote.ticker == Holdings.ticker)\
+                     .outerjoin(Security, Security.ticker == Holdings.ticker)\
+                     .group_by(Holdings.ticker)\
+                     .all()
+
+    tickers = {}
+    sectors = {}
+
+    for ticker, currency, shares, holdings, price, sector in rows:
+        sector = sector or 'Unknown'
+        value = shares * get_unit_value(price, currency)
+
+        tickers[ticker] = {'sector': sector, 'currency': currency, 'total_shares': shares, 'holdings': holdings, 'market_value': value}
+
+        totals = sectors.setdefault(sector, {'total_shares': 0, 'holdings': 0, 'market_value': 0})
+        totals['total_shares'] += shares
+        totals['holdings'] += holdings
+        totals['market_value'] += value
+
+    return tickers, sectors
+
+
+def diff_aggregates(stored: dict, rebuilt: dict, kind: str, tolerance: float) -> list:
+    '''Lists the differences between the stored and rebuilt aggregates of one kind
+    '''
+    mismatches = []
+
+    for key in sorted(set(stored) | set(rebuilt)):
+        old, new = stored.get(key, {}), rebuilt.get(key, {})
+
+        for field in ['total_shares', 'holdings', 'market_value']:
+            old_value, new_value = old.get(field), new.get(field)
+
+            if old_value is None or new_value is None:
+                matches = old_value == new_value
+            elif field == 'market_value':
+                matches = abs(old_value - new_value) <= tolerance
+            else:
+                matches = old_value == new_value
+
+            if not matches:
+                mismatches.append({'aggregate': f'{kind} {key}', 'field': field, 'stored': old_value, 'rebuilt': new_value})
+
+    return mismatches
+
+
+def rebuild_aggregates(tolerance=VALUE_TOLERANCE) -> list:
+    '''Rebuilds the aggregates from the holdings and replaces the stored ones,
+    reporting where the incrementally maintained values had drifted
+        args:
+            tolerance: float - largest accepted market value difference
+        returns:
+            list - mismatches between the stored and rebuilt aggregates, empty if they agreed
+    '''
+    tickers, sectors = compute_aggregates()
+
+    stored_tickers = {a.ticker: {'total_shares': a.total_shares, 'holdings': a.holdings, 'market_value': a.market_value}
+                      for a in TickerAggregate.query.all()}
+    stored_sectors = {a.sector: {'total_shares': a.total_shares, 'holdings': a.holdings, 'market_value': a.market_value}
+                      for a in SectorAggregate.query.all()}
+
+    mismatches = diff_aggregates(stored_tickers, tickers, 'ticker', tolerance) + diff_aggregates(stored_sectors, sectors, 'sector', tolerance)
+
+    now = datetime.now(timezone.utc)
+
+    TickerAggregate.query.delete()
+    SectorAggregate.query.delete()
+
+    db.session.add_all([TickerAggregate(ticker=ticker, updated_time=now, **values) for ticker, values in tickers.items()])
+    db.session.add_all([SectorAggregate(sector=sector, updated_time=now, **values) for sector, values in sectors.items()])
+    db.session.commit()
+
+    return mismatches
+
+
+def get_market_overview(limit=10) -> dict:
+    '''Gets the most held tickers, the sector allocation of all portfolios and the total assets
+        args:
+            limit: int - number of most held tickers
+        returns:
+            dict - most held tickers, sectors and total assets, values in AGGREGATE_CURRENCY
+    '''
+    most_held = TickerAggregate.query.order_by(TickerAggregate.holdings.desc(), TickerAggregate.market_value.desc())\
+                                     .limit(limit)\
+                                     .all()
+    sectors = SectorAggregate.query.order_by(SectorAggregate.market_value.desc()).all()
+    invested = sum(s.market_value for s in sectors)
+
+    # cash is summed per base currency, one row per currency
+    cash = db.session.query(Portfolio.base_currency, func.sum(Portfolio.available_cash))\
+                     .group_by(Portfolio.base_currency)\
+                     .all()
+    total_cash = sum(convert_amount(amount, currency, AGGREGATE_CURRENCY) for currency, amount in cash)
+
+    return {
+        'currency': AGGREGATE_CURRENCY,
+        'most_held': [{'Ticker': a.ticker, 'Holders': a.holdings, 'Shares': a.total_shares, 'Market Value': round(a.market_value, 2)} for a in most_held],
+        'sectors': [{'Sector': s.sector,
+                     'Holdings': s.holdings,
+                     'Market Value': round(s.market_value, 2),
+                     'Allocation (%)': round(s.market_value / invested * 100, 2) if invested else 0} for s in sectors],
+        'invested': round(invested, 2),
+        'total_assets': round(invested + total_cash, 2)
+    }
@@ -0,0 +1,50 @@
+import mimetypes
+import os
+
+import click
+from flask import Blueprint, current_app, request, send_from_directory, abort
+from werkzeug.security import safe_join
+
+from .assets_functions import *
+
+assets = Blueprint('assets', __name__)
+
+# built assets never change under the same name, browsers can keep them for a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+# routes
+@assets.route('/assets/<path:filename>', methods=['GET'])
+def built_asset(filename):
+    build_dir = os.path.join(current_app.static_folder, BUILD_DIR)
+    build_path = safe_join(build_dir, filename)
+
+    if build_path is None or filename == MANIFEST_FILE or not os.path.isfile(build_path):
+        abort(404)
+
+    encoding = get_encoding(request.accept_encodings, build_path)
+    # the type of the asset itself, not of its .gz or .br sidecar
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    response = send_from_directory(build_dir,
+                                   filename + ENCODINGS[encoding] if encoding else filename,
+                                   mimetype=mimetype,
+                                   max_age=IMMUTABLE_MAX_AGE)
+
+    if encoding:
+        response.content_encoding = encoding
+
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.vary.add('Accept-Encoding')
+
+    return response
+
+
+# commands
+@assets.cli.command('build')
+def build_command():
+    '''Minifies, fingerprints and precompresses the static files into static/dist'''
+    manifest = build_assets(current_app.static_folder)
+
+    click.echo(f'Built {len(manifest)} assets')
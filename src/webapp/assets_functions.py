@@ -0,0 +1,237 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+
+from flask import current_app, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# built assets go in static/dist, named <name>.<content hash><extension>
+BUILD_DIR = 'dist'
+MANIFEST_FILE = 'manifest.json'
+HASH_LENGTH = 12
+# only text assets are worth precompressing, images are already compressed
+COMPRESSED_EXTENSIONS = ('.js', '.css', '.svg')
+# precompressed sidecars, preferred encoding first
+ENCODINGS = {
+    'br': '.br',
+    'gzip': '.gz'
+}
+
+# manifest of the built assets, reloaded when the file changes
+manifest_cache = {
+    'mtime': None,
+    'assets': {}
+}
+
+
+def strip_leading_comments(line: str, in_comment: bool) -> tuple:
+    '''Removes the comment spans at the start of a line, keeping the code after a closing */
+        args:
+            line: str - line of javascript
+            in_comment: bool - whether the line starts inside a block comment
+        returns:
+            tuple - (code left on the line, whether the line ends inside a block comment)
+    '''
+    while True:
+        if in_comment:
+            end = line.find('*/')
+
+            if end == -1:
+                return '', True
+
+            line, in_comment = line[end + 2:], False
+
+        line = line.strip()
+
+        if line.startswith('//'):
+            return '', False
+
+        if not line.startswith('/*'):
+            return line, False
+
+        line, in_comment = line[2:], True
+
+
+def minify_js(source: str) -> str:
+    '''Removes comments, indentation and blank lines from a script.
+    Line breaks are kept since the scripts rely on automatic semicolon insertion,
+    lines inside multi-line template literals are kept as they are
+        args:
+            source: str - javascript
+        returns:
+            str - minified javascript
+    '''
+    lines = []
+    in_template = False
+    in_comment = False
+
+    for line in source.splitlines():
+        if in_template:
+            lines.append(line)
+        else:
+            # comments are only stripped where they start a line, "/*" later on may be in a string
+            line, in_comment = strip_leading_comments(line, in_comment)
+
+            if not line:
+                continue
+
+            lines.append(line)
+
+        # an odd number of backticks opens or closes a template literal
+        if len(re.findall(r'(?<!\\)`', line)) % 2:
+            in_template = not in_template
+
+    return '\n'.join(lines) + '\n'
+
+
+def minify_css(source: str) -> str:
+    '''Removes comments and whitespace from a stylesheet
+        args:
+            source: str - css
+        returns:
+            str - minified css
+    '''
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    source = re.sub(r'\s+', ' ', source)
+    # spaces before ":" are left alone, in selectors they matter ("a :hover")
+    source = re.sub(r'\s*([{};,>])\s*', r'\1', source)
+    source = re.sub(r':\s+', ':', source)
+
+    return source.replace(';}', '}').strip()
+
+
+MINIFIERS = {
+    '.js': minify_js,
+    '.css': minify_css
+}
+
+
+def get_hashed_name(path: str, content: bytes) -> str:
+    '''Adds the content hash to a file name, e.g. scripts/index.js -> scripts/index.3f2a9c1b7d04.js
+    '''
+    root, extension = os.path.splitext(path)
+
+    return f'{root}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{extension}'
+
+
+def write_compressed(path: str, content: bytes) -> None:
+    '''Writes the gzip and brotli (if installed) sidecars of a built asset
+    '''
+    # mtime=0 so rebuilding the same content gives the same bytes
+    with open(path + ENCODINGS['gzip'], 'wb') as f:
+        f.write(gzip.compress(content, compresslevel=9, mtime=0))
+
+    if brotli is not None:
+        with open(path + ENCODINGS['br'], 'wb') as f:
+            f.write(brotli.compress(content, quality=11))
+
+
+def build_assets(static_dir: str) -> dict:
+    '''Minifies the static files, names them by content hash and precompresses them into static/dist.
+    The manifest maps each source path to its built path and is written last
+        args:
+            static_dir: str - static folder of the app
+        returns:
+            dict - source path to built path
+    '''
+    build_dir = os.path.join(static_dir, BUILD_DIR)
+    manifest = {}
+
+    # rebuild from scratch so renamed or deleted assets don't linger
+    shutil.rmtree(build_dir, ignore_errors=True)
+
+    for root, dirs, files in os.walk(static_dir):
+        if os.path.abspath(root) == os.path.abspath(static_dir):
+            dirs[:] = [d for d in dirs if d != BUILD_DIR]
+
+        for file_name in sorted(files):
+            source_path = os.path.join(root, file_name)
+            relative_path = os.path.relpath(source_path, static_dir).replace(os.sep, '/')
+            extension = os.path.splitext(file_name)[1].lower()
+
+            with open(source_path, 'rb') as f:
+                content = f.read()
+
+            if extension in MINIFIERS:
+                content = MINIFIERS[extension](content.decode('utf-8')).encode('utf-8')
+
+            hashed_path = get_hashed_name(relative_path, content)
+            build_path = os.path.join(build_dir, *hashed_path.split('/'))
+
+            os.makedirs(os.path.dirname(build_path), exist_ok=True)
+
+            with open(build_path, 'wb') as f:
+                f.write(content)
+
+            if extension in COMPRESSED_EXTENSIONS:
+                write_compressed(build_path, content)
+
+            manifest[relative_path] = hashed_path
+
+    path = os.path.join(build_dir, MANIFEST_FILE)
+
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    os.replace(path + '.tmp', path)
+
+    return manifest
+
+
+def get_manifest() -> dict:
+    '''Gets the manifest of the built assets, empty if they were not built
+        returns:
+            dict - source path to built path
+    '''
+    path = os.path.join(current_app.static_folder, BUILD_DIR, MANIFEST_FILE)
+
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        return {}
+
+    if manifest_cache['mtime'] != mtime:
+        with open(path) as f:
+            manifest_cache['assets'] = json.load(f)
+
+        manifest_cache['mtime'] = mtime
+
+    return manifest_cache['assets']
+
+
+def asset_url(path: str) -> str:
+    '''Gets the url of a static file, its fingerprinted build when the assets were built.
+    Available in templates, e.g. {{ asset_url('scripts/index.js') }}
+        args:
+            path: str - path in the static folder
+        returns:
+            str - url of the file
+    '''
+    hashed_path = get_manifest().get(path)
+
+    if hashed_path is None:
+        return url_for('static', filename=path)
+
+    return url_for('assets.built_asset', filename=hashed_path)
+
+
+def get_encoding(accepted, build_path: str) -> str:
+    '''Picks the precompressed variant of a built asset to send
+        args:
+            accepted: Accept - request.accept_encodings
+            build_path: str - path of the built asset
+        returns:
+            str - content encoding, None for the uncompressed file
+    '''
+    for encoding, suffix in ENCODINGS.items():
+        if accepted[encoding] and os.path.isfile(build_path + suffix):
+            return encoding
+
+    return None
@@ -1,59 +1,87 @@
-from flask import Blueprint, render_template
+import click
+from flask import Blueprint, render_template, make_response, abort, request, current_app
 from flask_login import current_user
-from markdown import markdown
 
-from . import db
-from .data_models import Blog
+from .blog_functions import *
+from .database import read_only
 
 blog = Blueprint('blog', __name__)
 
+
+def cache_headers(response, etag: str, last_modified):
+    '''Adds the validators so browsers can revalidate instead of re-downloading
+    '''
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+
+    return response
+
+
 # routes
 @blog.route('/blog', methods=['GET'])
+@read_only
 def blog_list():
-    blogs = Blog.query.all()
-    sorted_blogs = sorted(blogs, key=lambda x: x.updated_date, reverse=True)
+    blog_info = get_blog_catalog()
+
+    etag, last_modified = get_validators(f"list|{catalog_cache['version']}", blog_info)
 
-    blog_info = []
+    if is_not_modified(etag, last_modified):
+        return cache_headers(make_response('', 304), etag, last_modified)
 
-    for blog in sorted_blogs:
-        blog_info.append({
-            'title': blog.title,
-            'date': blog.updated_date.strftime('%b %d, %Y'),
-            'description': blog.description,
-            'file_name': blog.file_name
-        })
+    response = make_response(render_template('blog_list.html',
+                                             blog_info=blog_info,
+                                             user=current_user,
+                                             active_page='blog_list'))
+
+    return cache_headers(response, etag, last_modified)
+
+
+@blog.route('/blog/search', methods=['GET'])
+@read_only
+def blog_search():
+    query = request.args.get('q', '').strip()
 
     return render_template('blog_list.html',
-                           blog_info=blog_info,
+                           blog_info=search_posts(query),
+                           query=query,
                            user=current_user,
                            active_page='blog_list')
 
 
 @blog.route('/blog/<file_name>', methods=['GET'])
+@read_only
 def blog_view(file_name):
-    columns = db.session.query(Blog.file_name, Blog.title).all()
-
-    blog_catalog = []
-
-    for column in columns:
-        blog_catalog.append({
-            'title': column.title,
-            'file_name': column.file_name
-        })
-
-    blog = Blog.query.filter_by(file_name=file_name).first()
-
-    blog_data = {
-        'title': blog.title,
-        'creation_date': blog.creation_date.strftime('%b %d, %Y'),
-        'update_date': blog.updated_date.strftime('%b %d, %Y'),
-        'description': blog.description,
-        'content': markdown(blog.content),
-        'file_name': blog.file_name
-    }
-
-    return render_template('blog_view.html',
-                           blog=blog_data,
-                           blog_catalog=blog_catalog,
-                           user=current_user,
-                           active_page='blog_view')
\ No newline at end of file
+    blog_catalog = get_blog_catalog()
+
+    post = next((p for p in blog_catalog if p['file_name'] == file_name), None)
+
+    if post is None:
+        abort(404)
+
+    # the page lists the other posts too
+    etag, last_modified = get_validators(f"view|{file_name}|{catalog_cache['version']}", blog_catalog)
+
+    if is_not_modified(etag, last_modified):
+        return cache_headers(make_response('', 304), etag, last_modified)
+
+    blog_data = get_rendered_post(file_name, post['version'])
+
+    response = make_response(render_template('blog_view.html',
+                                             blog=blog_data,
+                                             blog_catalog=blog_catalog,
+                                             user=current_user,
+                                             active_page='blog_view'))
+
+    return cache_headers(response, etag, last_modified)
+
+
+# commands
+@blog.cli.command('sync')
+@click.argument('posts_dir', required=False)
+def sync_command(posts_dir):
+    '''Syncs blog posts from the markdown files in POSTS_DIR'''
+    summary = sync_posts(posts_dir or current_app.config['BLOG_POSTS_DIR'])
+
+    click.echo(', '.join(f'{count} {status}' for status, count in summary.items()))
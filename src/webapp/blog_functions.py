@@ -0,0 +1,302 @@
+import hashlib
+import os
+import re
+from collections import Counter
+from datetime import date, datetime, timezone
+
+from flask import request, session
+from flask_login import current_user
+from sqlalchemy import func
+from sqlalchemy.orm import defer
+from werkzeug.http import is_resource_modified
+
+from . import db
+from .data_models import Blog, BlogTerm
+from .lazy import lazy_import
+
+markdown = lazy_import('markdown')
+
+# words left out of the search index
+STOP_WORDS = {'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is', 'it',
+              'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'with'}
+
+# catalog of all blog posts (no content), rebuilt when the blog table changes
+catalog_cache = {
+    'version': None,
+    'posts': []
+}
+
+# rendered html of each blog post, keyed by file name
+rendered_posts = {}
+
+
+def get_post_version(content_hash: str, updated_date) -> str:
+    '''Gets the version of a post's content, its content hash.
+    Posts added by hand have no hash and fall back to their update date
+    '''
+    return content_hash or f'date:{updated_date}'
+
+
+def get_catalog_version() -> str:
+    '''Gets a fingerprint of the blog table from the version of every post,
+    so an edit shows even when the post's update date stays the same
+        returns:
+            str - fingerprint of the blog table
+    '''
+    rows = db.session.query(Blog.file_name, Blog.content_hash, Blog.updated_date).order_by(Blog.file_name).all()
+    versions = '|'.join(f'{r.file_name}:{get_post_version(r.content_hash, r.updated_date)}' for r in rows)
+
+    return hashlib.md5(versions.encode()).hexdigest()
+
+
+def get_blog_catalog() -> list:
+    '''Gets the catalog of all blog posts ordered by update date.
+    Only rebuilt when a post is added, removed or its content changes
+        returns:
+            list - title, description, dates and file name of every post
+    '''
+    version = get_catalog_version()
+
+    if catalog_cache['version'] != version:
+        # content column is not needed to list posts
+        blogs = Blog.query.options(defer(Blog.content)).order_by(Blog.updated_date.desc()).all()
+
+        catalog_cache['posts'] = [{
+            'title': blog.title,
+            'date': blog.updated_date.strftime('%b %d, %Y'),
+            'description': blog.description,
+            'file_name': blog.file_name,
+            'updated_date': blog.updated_date,
+            'version': get_post_version(blog.content_hash, blog.updated_date),
+            # set by the sync each time the file changes, unlike the front-matter date
+            'modified_time': datetime.fromtimestamp(blog.file_mtime, timezone.utc) if blog.file_mtime else None
+        } for blog in blogs]
+        catalog_cache['version'] = version
+
+    return catalog_cache['posts']
+
+
+def get_rendered_post(file_name: str, version: str) -> dict:
+    '''Gets the rendered html of a blog post.
+    The cached copy is reused until the post's version (content hash) changes
+        args:
+            file_name: str - file name of the post
+            version: str - version of the post from the catalog
+        returns:
+            dict - blog post data with rendered content
+    '''
+    cached = rendered_posts.get(file_name)
+
+    if cached and cached['version'] == version:
+        return cached['blog']
+
+    blog = Blog.query.filter_by(file_name=file_name).first()
+
+    blog_data = {
+        'title': blog.title,
+        'creation_date': blog.creation_date.strftime('%b %d, %Y'),
+        'update_date': blog.updated_date.strftime('%b %d, %Y'),
+        'description': blog.description,
+        'content': blog.html if blog.html is not None else markdown.markdown(blog.content),
+        'file_name': blog.file_name
+    }
+
+    rendered_posts[file_name] = {
+        'version': get_post_version(blog.content_hash, blog.updated_date),
+        'blog': blog_data
+    }
+
+    return blog_data
+
+
+def get_validators(key: str, posts: list) -> tuple:
+    '''Builds the ETag and Last-Modified validators for a blog page.
+    Pages differ for each signed in user (navigation bar), so the user is part of the tag.
+    Last-Modified is the latest modification time of the posts shown, it is left out when
+    a post added by hand has none, since a date alone would hide edits made the same day
+        args:
+            key: str - identifies the page content, includes the version of the content shown
+            posts: list - catalog entries of the posts shown on the page
+        returns:
+            tuple - (etag, last modified datetime)
+    '''
+    etag = hashlib.md5(f'{key}|{current_user.get_id()}'.encode()).hexdigest()
+    modified_times = [post['modified_time'] for post in posts]
+    last_modified = None
+
+    if modified_times and None not in modified_times:
+        last_modified = max(modified_times)
+
+    return etag, last_modified
+
+
+def is_not_modified(etag: str, last_modified: datetime) -> bool:
+    '''Checks whether the client already has the current version of a page.
+    Pages with pending flash messages are always rendered
+        args:
+            etag: str - etag of the page
+            last_modified: datetime - last modified time of the page
+        returns:
+            bool - True if a 304 response can be sent
+    '''
+    if session.get('_flashes'):
+        return False
+
+    return not is_resource_modified(request.environ, etag=etag, last_modified=last_modified)
+
+
+def parse_post(text: str) -> tuple:
+    '''Splits a markdown post into its front-matter and body.
+    Front-matter is a block of "key: value" lines between two "---" lines at the top of the file
+        args:
+            text: str - contents of the markdown file
+        returns:
+            tuple - (front-matter dict, markdown body)
+    '''
+    front_matter = {}
+    lines = text.splitlines()
+
+    if not lines or lines[0].strip() != '---':
+        return front_matter, text
+
+    for i, line in enumerate(lines[1:], start=1):
+        if line.strip() == '---':
+            return front_matter, '\n'.join(lines[i+1:]).lstrip('\n')
+
+        if ':' in line:
+            key, value = line.split(':', 1)
+            front_matter[key.strip().lower()] = value.strip().strip('"\'')
+
+    # no closing line, treat the whole file as the body
+    return {}, text
+
+
+def tokenize(text: str) -> list:
+    '''Splits text into lowercase search terms
+        args:
+            text: str - text to split
+        returns:
+            list - search terms
+    '''
+    return [t for t in re.findall(r'[a-z0-9]+', text.lower()) if len(t) > 1 and len(t) <= 50 and t not in STOP_WORDS]
+
+
+def index_post(blog: Blog) -> None:
+    '''Rebuilds the search index entries of a blog post
+        args:
+            blog: Blog - blog post to index
+    '''
+    counts = Counter(tokenize(f'{blog.title} {blog.description} {blog.content}'))
+
+    blog.terms = [BlogTerm(term=term, count=count) for term, count in counts.items()]
+
+
+def parse_date(value: str, default: date) -> date:
+    '''Parses a YYYY-MM-DD front-matter date
+        args:
+            value: str - date string, may be None
+            default: date - date used when the value is missing or invalid
+        returns:
+            date - parsed date
+    '''
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return default
+
+
+def sync_posts(posts_dir: str) -> dict:
+    '''Syncs the blog table with the markdown files in a directory.
+    Only files whose modification time and content hash changed are parsed, rendered and reindexed.
+    Synced posts whose file was removed are deleted
+        args:
+            posts_dir: str - directory containing the markdown posts
+        returns:
+            dict - number of added, updated, unchanged and deleted posts
+    '''
+    summary = {'added': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0}
+    synced = {blog.file_name: blog for blog in Blog.query.options(defer(Blog.content), defer(Blog.html)).all()}
+    seen = set()
+
+    for entry in sorted(os.scandir(posts_dir), key=lambda e: e.name):
+        if not entry.is_file() or not entry.name.endswith('.md'):
+            continue
+
+        file_name = entry.name[:-3]
+        mtime = entry.stat().st_mtime
+        blog = synced.get(file_name)
+        seen.add(file_name)
+
+        if blog and blog.file_mtime == mtime:
+            summary['unchanged'] += 1
+            continue
+
+        with open(entry.path, 'rb') as f:
+            raw = f.read()
+
+        content_hash = hashlib.sha256(raw).hexdigest()
+
+        if blog and blog.content_hash == content_hash:
+            # touched but not edited
+            blog.file_mtime = mtime
+            summary['unchanged'] += 1
+            continue
+
+        front_matter, body = parse_post(raw.decode('utf-8'))
+        modified = datetime.fromtimestamp(mtime).date()
+
+        if blog is None:
+            blog = Blog(file_name=file_name)
+            db.session.add(blog)
+            summary['added'] += 1
+        else:
+            summary['updated'] += 1
+
+        blog.title = front_matter.get('title', blog.title or file_name.replace('_', ' ').title())
+        blog.description = front_matter.get('description', blog.description or '')
+        blog.content = body
+        blog.html = markdown.markdown(body)
+        blog.creation_date = parse_date(front_matter.get('created'), blog.creation_date or modified)
+        blog.updated_date = parse_date(front_matter.get('updated'), modified)
+        blog.content_hash = content_hash
+        # the Last-Modified time of the blog pages, the front-matter date can stay the same across edits
+        blog.file_mtime = mtime
+
+        index_post(blog)
+
+    for file_name, blog in synced.items():
+        # posts added by hand have no hash and are left alone
+        if file_name not in seen and blog.content_hash is not None:
+            db.session.delete(blog)
+            summary['deleted'] += 1
+
+    db.session.commit()
+
+    return summary
+
+
+def search_posts(query: str) -> list:
+    '''Searches blog posts using the term index.
+    Posts matching more of the query terms rank first, then by term frequency
+        args:
+            query: str - search query
+        returns:
+            list - catalog entries of matching posts
+    '''
+    terms = set(tokenize(query))
+
+    if not terms:
+        return []
+
+    matches = db.session.query(BlogTerm.blog_id,
+                               func.count(BlogTerm.term).label('matched'),
+                               func.sum(BlogTerm.count).label('frequency'))\
+                        .filter(BlogTerm.term.in_(terms))\
+                        .group_by(BlogTerm.blog_id)\
+                        .all()
+
+    ranked = sorted(matches, key=lambda m: (m.matched, m.frequency), reverse=True)
+    file_names = dict(db.session.query(Blog.id, Blog.file_name).filter(Blog.id.in_([m.blog_id for m in ranked])).all())
+    catalog = {post['file_name']: post for post in get_blog_catalog()}
+
+    return [catalog[file_names[m.blog_id]] for m in ranked if file_names.get(m.blog_id) in catalog]
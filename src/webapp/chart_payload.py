@@ -0,0 +1,121 @@
+import gzip
+import hashlib
+import json
+from flask import request, make_response
+
+from .lazy import lazy_import
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+np = lazy_import('numpy')
+
+MARKET_TZ_NAME = 'America/New_York'
+
+
+def encode_times(times, unit=60) -> dict:
+    '''Encodes sorted epoch times as a base timestamp and delta-encoded offsets
+        args:
+            times: array like - epoch seconds
+            unit: int - resolution of the offsets in seconds
+        returns:
+            dict - t0 (epoch seconds), unit and delta-encoded offsets
+    '''
+    times = np.asarray(times, dtype=np.int64)
+
+    if len(times) == 0:
+        return {'t0': 0, 'unit': unit, 't': []}
+
+    # align the base to the unit so offsets never round a time into the previous unit
+    t0 = times[0] - times[0] % unit
+    offsets = (times - t0) // unit
+
+    return {
+        't0': int(t0),
+        'unit': unit,
+        't': np.diff(offsets, prepend=0).tolist()
+    }
+
+
+def encode_values(values, precision=2) -> dict:
+    '''Encodes a value series as delta-encoded fixed-precision integers.
+    Leading missing values (NaN/None) are stored as a count, missing values after the first
+    value repeat the previous one so every delta is between two real values
+        args:
+            values: array like - values of the series
+            precision: int - number of decimals kept
+        returns:
+            dict - number of leading missing values and the deltas
+    '''
+    values = np.asarray([np.nan if v is None else v for v in values], dtype=float)
+    present = np.flatnonzero(~np.isnan(values))
+    skip = int(present[0]) if len(present) else len(values)
+    values = values[skip:]
+
+    # forward fill the gaps, each position takes the index of the last value present
+    last = np.maximum.accumulate(np.where(np.isnan(values), 0, np.arange(len(values))))
+    scaled = np.rint(values[last] * 10**precision).astype(np.int64)
+
+    return {
+        'skip': skip,
+        'd': np.diff(scaled, prepend=0).tolist()
+    }
+
+
+def encode_chart(times, series: dict, unit=60, precision=2, tz=MARKET_TZ_NAME) -> dict:
+    '''Builds a compact chart payload: one shared time axis and any number of value series.
+    Decoded by decodeChart in static/scripts/index.js
+        args:
+            times: array like - sorted epoch seconds
+            series: dict - name to values of each series, in display order
+            unit: int - resolution of the time offsets in seconds
+            precision: int - number of decimals kept in the values
+            tz: str - timezone used to label the times
+        returns:
+            dict - chart payload
+    '''
+    return {
+        **encode_times(times, unit),
+        'tz': tz,
+        'scale': 10**precision,
+        'series': [{'name': name, **encode_values(values, precision)} for name, values in series.items()]
+    }
+
+
+def dumps(payload: dict) -> str:
+    '''Serializes a payload without whitespace
+    '''
+    return json.dumps(payload, separators=(',', ':'))
+
+
+def compressed_json_response(payload: dict, max_age: int):
+    '''Builds a cacheable JSON response, compressed with brotli or gzip when the client accepts it
+        args:
+            payload: dict - json payload
+            max_age: int - seconds the response can be cached for
+        returns:
+            Response - json response
+    '''
+    body = dumps(payload).encode()
+    etag = hashlib.md5(body).hexdigest()
+    accepted = request.accept_encodings
+    encoding = None
+
+    if brotli is not None and accepted['br']:
+        body, encoding = brotli.compress(body), 'br'
+    elif accepted['gzip']:
+        body, encoding = gzip.compress(body), 'gzip'
+
+    response = make_response(body)
+    response.mimetype = 'application/json'
+    response.set_etag(f'{etag}-{encoding}' if encoding else etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = max_age
+    response.vary.add('Accept-Encoding')
+
+    if encoding:
+        response.content_encoding = encoding
+
+    return response.make_conditional(request)
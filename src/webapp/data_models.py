@@ -10,48 +10,141 @@ class User(db.Model, UserMixin):
     password = db.Column(db.String(255), nullable=False)
     username = db.Column(db.String(50), unique=True, nullable=False)
     creation_date = db.Column(db.Date, nullable=False)
-    # one to one
-    portfolio = db.relationship('Portfolio', back_populates='user', uselist=False, cascade='all, delete-orphan')
+    # one to one, the global game
+    portfolio = db.relationship('Portfolio', primaryjoin='and_(User.id == Portfolio.user_id, Portfolio.league_id == None)', uselist=False, viewonly=True)
+    # one to many, the global game and one portfolio per league joined
+    portfolios = db.relationship('Portfolio', back_populates='user', lazy=True, cascade='all, delete-orphan')
+    watchlist = db.relationship('WatchlistItem', backref='user', lazy=True, cascade='all, delete-orphan')
 
 
 # user's investment portfolio
 class Portfolio(db.Model):
     id = db.Column(db.Integer, primary_key=True, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, unique=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # None for the global game
+    league_id = db.Column(db.Integer, db.ForeignKey('league.id'), nullable=True)
     available_cash = db.Column(db.Float, nullable=False)
     creation_date = db.Column(db.Date, nullable=False)
     updated_value = db.Column(db.Float, nullable=False)
     updated_time = db.Column(db.DateTime(timezone=True), nullable=False)
     last_close_value = db.Column(db.Float, nullable=False)
+    base_currency = db.Column(db.String(5), nullable=False, default='USD')
 
-    # one to one
-    user = db.relationship('User', back_populates='portfolio')
+    # many to one
+    user = db.relationship('User', back_populates='portfolios')
+    league = db.relationship('League', back_populates='portfolios', lazy='joined')
 
     # one to many
     holdings = db.relationship('Holdings', backref='portfolio', lazy=True)
     transactions = db.relationship('Transactions', backref='portfolio', lazy=True)
-    history = db.relationship('History', backref='portfolio', lazy=True)
 
+    __table_args__ = (db.UniqueConstraint('user_id', 'league_id', name='uq_portfolio_user_league'),
+                      # the unique constraint doesn't compare NULL leagues, one global game per user
+                      db.Index('uq_portfolio_user_global', 'user_id', unique=True,
+                               sqlite_where=db.text('league_id IS NULL'), postgresql_where=db.text('league_id IS NULL')),
+                      # league leaderboards read their portfolios in rank order
+                      db.Index('ix_portfolio_league_value', 'league_id', 'updated_value'))
 
-# individual stock holdings in portfolios
-class Holdings(db.Model):
+
+# competitions with their own start date and funds, users join with a new portfolio
+class League(db.Model):
     id = db.Column(db.Integer, primary_key=True, nullable=False)
-    portfolio_id = db.Column(db.Integer, db.ForeignKey('portfolio.id'), nullable=False)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    start_date = db.Column(db.Date, nullable=False)
+    starting_funds = db.Column(db.Float, nullable=False)
+    # every portfolio of a league uses it, so they rank on their stored values
+    base_currency = db.Column(db.String(5), nullable=False, default='USD')
+    creation_date = db.Column(db.Date, nullable=False)
+
+    # one to many
+    portfolios = db.relationship('Portfolio', back_populates='league', lazy=True)
+
+
+# static company reference data, shared by all holdings of a ticker
+class Security(db.Model):
+    ticker = db.Column(db.String(10), primary_key=True, nullable=False)
     company_name = db.Column(db.String(150), nullable=False)
-    ticker = db.Column(db.String(10), nullable=False)
     industry = db.Column(db.String(150), nullable=False)
     sector = db.Column(db.String(150), nullable=False)
+    currency = db.Column(db.String(5), nullable=False)
+    company_summary = db.Column(db.Text, nullable=False)
+    updated_time = db.Column(db.DateTime(timezone=True), nullable=False)
+
+    # one to many
+    holdings = db.relationship('Holdings', back_populates='security', lazy=True)
+
+
+# individual stock holdings in portfolios
+class Holdings(db.Model):
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    portfolio_id = db.Column(db.Integer, db.ForeignKey('portfolio.id'), nullable=False)
+    ticker = db.Column(db.String(10), db.ForeignKey('security.ticker'), nullable=False)
     number_of_shares = db.Column(db.Integer, nullable=False)
     average_price = db.Column(db.Float, nullable=False)
-    updated_price = db.Column(db.Float, nullable=False)
     currency = db.Column(db.String(5), nullable=False)
-    opening_price = db.Column(db.Float, nullable=False)
+
+    # many to one
+    security = db.relationship('Security', back_populates='holdings', lazy='joined')
+    quote = db.relationship('Quote', primaryjoin='foreign(Holdings.ticker) == Quote.ticker', viewonly=True, lazy='joined')
+
+
+# latest prices of each held ticker, shared by all holdings of the ticker
+class Quote(db.Model):
+    ticker = db.Column(db.String(10), db.ForeignKey('security.ticker'), primary_key=True, nullable=False)
+    last_price = db.Column(db.Float, nullable=False)
+    open_price = db.Column(db.Float, nullable=False)
+    previous_close = db.Column(db.Float, nullable=False)
+    updated_time = db.Column(db.DateTime(timezone=True), nullable=False)
+
+
+# market wide totals of each held ticker, updated with every trade and revalued every price tick
+class TickerAggregate(db.Model):
+    ticker = db.Column(db.String(10), db.ForeignKey('security.ticker'), primary_key=True, nullable=False)
+    sector = db.Column(db.String(150), nullable=False)
+    currency = db.Column(db.String(5), nullable=False)
+    total_shares = db.Column(db.Integer, nullable=False)
+    # number of portfolios holding the ticker
+    holdings = db.Column(db.Integer, nullable=False, index=True)
+    # in USD
+    market_value = db.Column(db.Float, nullable=False)
+    updated_time = db.Column(db.DateTime(timezone=True), nullable=False)
+
+
+# market wide totals of each sector, the sum of its tickers' aggregates
+class SectorAggregate(db.Model):
+    sector = db.Column(db.String(150), primary_key=True, nullable=False)
+    total_shares = db.Column(db.Integer, nullable=False)
+    # number of holdings in the sector across all portfolios
+    holdings = db.Column(db.Integer, nullable=False)
+    # in USD
+    market_value = db.Column(db.Float, nullable=False)
+    updated_time = db.Column(db.DateTime(timezone=True), nullable=False)
+
+
+# tickers a user follows on their watchlist
+class WatchlistItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    ticker = db.Column(db.String(10), nullable=False)
+    added_time = db.Column(db.DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'ticker', name='uq_watchlist_item_user_ticker'),)
+
+
+# recent daily bars of watched tickers, shared by all watchlists
+class PriceBar(db.Model):
+    ticker = db.Column(db.String(10), primary_key=True, nullable=False)
+    bar_date = db.Column(db.Date, primary_key=True, nullable=False)
+    open_price = db.Column(db.Float, nullable=False)
+    close_price = db.Column(db.Float, nullable=False)
+    # time the ticker's bars were downloaded, the latest bar is the last finished session
+    fetched_time = db.Column(db.DateTime(timezone=True), nullable=False)
 
 
 # transactions history
 class Transactions(db.Model):
     id = db.Column(db.Integer, primary_key=True, nullable=False)
-    portfolio_id = db.Column(db.Integer, db.ForeignKey('portfolio.id'), nullable=False)
+    portfolio_id = db.Column(db.Integer, db.ForeignKey('portfolio.id'), nullable=False, index=True)
     transaction_date = db.Column(db.DateTime(timezone=True), nullable=False)
     status = db.Column(db.String(10), nullable=False)
     company_name = db.Column(db.String(150), nullable=False)
@@ -60,15 +153,32 @@ class Transactions(db.Model):
     number_of_shares = db.Column(db.Integer, nullable=False)
     price_per_share = db.Column(db.Float, nullable=False)
     total_value = db.Column(db.Float, nullable=False)
+    # rate from the transaction currency to the portfolio's base currency when it was made
+    fx_rate = db.Column(db.Float, nullable=True)
 
 
 # history of portfolio values
+# partitioned by month on postgresql and sharded by month on sqlite, use history_store to read and write it
 class History(db.Model):
     id = db.Column(db.Integer, primary_key=True, nullable=False)
     portfolio_id = db.Column(db.Integer, db.ForeignKey('portfolio.id'), nullable=False)
     record_time = db.Column(db.DateTime(timezone=True), nullable=False)
     portfolio_value = db.Column(db.Float, nullable=False)
 
+    __table_args__ = (db.Index('ix_history_portfolio_time', 'portfolio_id', 'record_time'),)
+
+
+# state of a portfolio after replaying its transactions up to transaction_id
+class LedgerCheckpoint(db.Model):
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    portfolio_id = db.Column(db.Integer, db.ForeignKey('portfolio.id'), nullable=False, index=True)
+    transaction_id = db.Column(db.Integer, nullable=False)
+    transaction_date = db.Column(db.DateTime(timezone=True), nullable=False)
+    cash = db.Column(db.Float, nullable=False)
+    # json of ticker to shares, average price and currency
+    holdings = db.Column(db.Text, nullable=False)
+
+
 # blog posts data
 class Blog(db.Model):
     id = db.Column(db.Integer, primary_key=True, nullable=False)
@@ -78,3 +188,65 @@ class Blog(db.Model):
     content = db.Column(db.Text, nullable=False)
     creation_date = db.Column(db.Date, nullable=False)
     updated_date = db.Column(db.Date, nullable=False)
+    # filled in by the content sync
+    html = db.Column(db.Text, nullable=True)
+    content_hash = db.Column(db.String(64), nullable=True)
+    file_mtime = db.Column(db.Float, nullable=True)
+
+    # one to many
+    terms = db.relationship('BlogTerm', backref='blog', lazy=True, cascade='all, delete-orphan')
+
+
+# inverted index of the terms in blog posts
+class BlogTerm(db.Model):
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    term = db.Column(db.String(50), nullable=False, index=True)
+    blog_id = db.Column(db.Integer, db.ForeignKey('blog.id'), nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+
+
+# listed securities used to validate and autocomplete tickers
+class Symbol(db.Model):
+    ticker = db.Column(db.String(10), primary_key=True, nullable=False)
+    name = db.Column(db.String(150), nullable=False)
+    exchange = db.Column(db.String(20), nullable=True)
+    sector = db.Column(db.String(150), nullable=True)
+
+
+# checksum of the symbol table, written by load-symbols so every worker can tell its index is out of date
+class SymbolVersion(db.Model):
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    checksum = db.Column(db.String(64), nullable=False)
+    loaded_time = db.Column(db.DateTime(timezone=True), nullable=False)
+
+
+# cached news feed of a ticker and how often it is searched
+class NewsFeed(db.Model):
+    ticker = db.Column(db.String(10), primary_key=True, nullable=False)
+    fetched_time = db.Column(db.DateTime(timezone=True), nullable=True)
+    search_count = db.Column(db.Integer, nullable=False, default=0)
+
+    # one to many
+    articles = db.relationship('NewsArticle', backref='feed', lazy=True, cascade='all, delete-orphan', order_by='NewsArticle.id')
+
+
+# cached news articles
+class NewsArticle(db.Model):
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    ticker = db.Column(db.String(10), db.ForeignKey('news_feed.ticker'), nullable=False, index=True)
+    name = db.Column(db.String(500), nullable=False)
+    url = db.Column(db.String(1000), nullable=False)
+
+
+# latest exchange rates, value of one unit of the currency in USD
+class FxRate(db.Model):
+    currency = db.Column(db.String(5), primary_key=True, nullable=False)
+    usd_rate = db.Column(db.Float, nullable=False)
+    updated_time = db.Column(db.DateTime(timezone=True), nullable=False)
+
+
+# token buckets of the rate limiter when it is shared through the database
+class RateLimitBucket(db.Model):
+    key = db.Column(db.String(100), primary_key=True, nullable=False)
+    tokens = db.Column(db.Float, nullable=False)
+    updated = db.Column(db.Float, nullable=False)
@@ -0,0 +1,103 @@
+import os
+from contextlib import contextmanager
+from functools import wraps
+
+from flask_sqlalchemy.session import Session
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+REPLICA_BIND = 'replica'
+
+
+def get_env_int(name: str, default: int) -> int:
+    '''Reads an integer environment variable
+        args:
+            name: str - name of the variable
+            default: int - value used when the variable is not set
+        returns:
+            int - value of the variable
+    '''
+    return int(os.environ.get(name, default))
+
+
+def get_engine_options(database_uri: str) -> dict:
+    '''Builds the SQLAlchemy engine options from environment variables.
+    Pool and timeout settings only apply to PostgreSQL, SQLite keeps its defaults
+        args:
+            database_uri: str - database connection url
+        returns:
+            dict - keyword arguments for create_engine
+    '''
+    options = {
+        # check connections before use so dropped connections don't fail a request
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true',
+        # compiled statement cache, reused across connections
+        'query_cache_size': get_env_int('DB_QUERY_CACHE_SIZE', 1200)
+    }
+
+    if database_uri.startswith('postgres'):
+        options.update({
+            'pool_size': get_env_int('DB_POOL_SIZE', 5),
+            'max_overflow': get_env_int('DB_MAX_OVERFLOW', 10),
+            'pool_timeout': get_env_int('DB_POOL_TIMEOUT', 30),
+            'pool_recycle': get_env_int('DB_POOL_RECYCLE', 1800),
+            'connect_args': {
+                'options': f"-c statement_timeout={get_env_int('DB_STATEMENT_TIMEOUT_MS', 30000)}"
+                           f" -c idle_in_transaction_session_timeout={get_env_int('DB_IDLE_TRANSACTION_TIMEOUT_MS', 60000)}"
+            }
+        })
+
+    return options
+
+
+def get_upsert(table):
+    '''Gets an INSERT for the primary database's dialect, it supports ON CONFLICT on PostgreSQL and SQLite
+        args:
+            table: Table or model to insert into
+        returns:
+            Insert - dialect specific insert
+    '''
+    from . import db
+
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql_insert(table)
+
+    return sqlite_insert(table)
+
+
+class RoutingSession(Session):
+    '''Session that sends reads to the replica database while read only mode is on.
+    Flushes (writes) always go to the primary database
+    '''
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('read_only') and not self._flushing and REPLICA_BIND in self._db.engines:
+            return self._db.engines[REPLICA_BIND]
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@contextmanager
+def read_replica():
+    '''Routes the queries inside the block to the read replica, if one is configured
+    '''
+    from . import db
+
+    previous = db.session.info.get('read_only', False)
+    db.session.info['read_only'] = True
+
+    try:
+        yield
+    finally:
+        db.session.info['read_only'] = previous
+
+
+def read_only(view):
+    '''Decorator for views that only read, so their queries can be served by the read replica
+    '''
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with read_replica():
+            return view(*args, **kwargs)
+
+    return wrapper
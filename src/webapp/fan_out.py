@@ -0,0 +1,48 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# threads running the upstream calls of async views. A call that timed out keeps its thread
+# until yfinance returns, its result still lands in the caches
+upstream_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='upstream')
+
+
+class FanOut:
+    '''Independent blocking upstream calls running concurrently, each with its own timeout.
+    The calls start as soon as the fan out is created, so the view can query the database
+    while they run. They run outside the request so they must not use the database session
+    '''
+
+    def __init__(self, calls: dict, timeouts: dict):
+        '''
+            args:
+                calls: dict - name to zero argument callable
+                timeouts: dict - name to seconds the call may take
+        '''
+        self.started = time.monotonic()
+        self.timeouts = timeouts
+        self.futures = {name: upstream_executor.submit(call) for name, call in calls.items()}
+
+    async def get(self, name: str):
+        '''Waits for one call, until its timeout counted from the start of the fan out
+            args:
+                name: str - name of the call
+            returns:
+                result of the call, None if it timed out or failed
+        '''
+        remaining = self.timeouts[name] - (time.monotonic() - self.started)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(self.futures[name]), max(remaining, 0))
+        except Exception:
+            # timed out or failed, the page renders without it
+            return None
+
+    async def results(self) -> dict:
+        '''Waits for every call, the wait is as long as the slowest call or its timeout
+            returns:
+                dict - name to result, None for calls that timed out or failed
+        '''
+        values = await asyncio.gather(*[self.get(name) for name in self.futures])
+
+        return dict(zip(self.futures, values))
@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+
+from . import db
+from .data_models import FxRate
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+yf = lazy_import('yfinance')
+
+BASE_CURRENCY = 'USD'
+# how long the in-memory rate matrix is used before it is reloaded from the database
+FX_TTL = timedelta(minutes=30)
+
+# exchange rates between all known currencies, matrix[i, j] converts currency i to currency j
+rate_matrix = {
+    'loaded_time': None,
+    'currencies': [],
+    'index': {},
+    'usd_rates': None,
+    'matrix': None
+}
+
+
+def parse_static_rates(value: str) -> dict:
+    '''Parses a fixed rate table such as "CAD:0.73,EUR:1.08" (value of one unit in USD)
+        args:
+            value: str - comma separated currency:rate pairs
+        returns:
+            dict - USD rate of each currency
+    '''
+    rates = {}
+
+    for pair in filter(None, (p.strip() for p in value.split(','))):
+        currency, rate = pair.split(':')
+        rates[currency.strip().upper()] = float(rate)
+
+    return rates
+
+
+def build_rate_matrix(usd_rates: dict) -> None:
+    '''Builds the in-memory rate matrix from the USD rate of each currency
+        args:
+            usd_rates: dict - value of one unit of each currency in USD
+    '''
+    usd_rates = {**usd_rates, BASE_CURRENCY: 1.0}
+    currencies = sorted(usd_rates)
+    rates = np.array([usd_rates[c] for c in currencies], dtype=float)
+
+    rate_matrix['currencies'] = currencies
+    rate_matrix['index'] = {c: i for i, c in enumerate(currencies)}
+    rate_matrix['usd_rates'] = rates
+    rate_matrix['matrix'] = rates[:, None] / rates[None, :]
+    rate_matrix['loaded_time'] = datetime.now(timezone.utc)
+
+
+def load_rates() -> None:
+    '''Loads the rate matrix, from the FX_STATIC_RATES config when set (tests, offline use)
+    or from the rates saved by the scheduler
+    '''
+    static_rates = current_app.config.get('FX_STATIC_RATES')
+
+    if static_rates:
+        build_rate_matrix(static_rates)
+    else:
+        build_rate_matrix({r.currency: r.usd_rate for r in FxRate.query.all()})
+
+
+def get_rate_matrix() -> dict:
+    '''Gets the rate matrix, reloading it when older than FX_TTL
+        returns:
+            dict - currencies, their index and the conversion matrix
+    '''
+    loaded_time = rate_matrix['loaded_time']
+
+    if loaded_time is None or datetime.now(timezone.utc) - loaded_time > FX_TTL:
+        load_rates()
+
+    return rate_matrix
+
+
+class UnknownCurrencyError(ValueError):
+    '''A currency has no exchange rate, such as a code yfinance reports in sub units ("GBp")
+    or a currency whose rate was never fetched
+    '''
+
+
+def get_currency_index(currencies, unknown_index=None) -> np.ndarray:
+    '''Gets the matrix index of each currency.
+    Rates saved since the matrix was loaded are picked up before giving up on a currency
+        args:
+            currencies: iterable - currency codes
+            unknown_index: int - index given to currencies without a rate, which are logged, raises if None
+        returns:
+            np.ndarray - index of each currency
+        raises:
+            UnknownCurrencyError - a currency has no rate and unknown_index is None
+    '''
+    currencies = list(currencies)
+    index = get_rate_matrix()['index']
+
+    if any(c not in index for c in currencies):
+        load_rates()
+        index = rate_matrix['index']
+        unknown = sorted({str(c) for c in currencies if c not in index})
+
+        if unknown and unknown_index is None:
+            raise UnknownCurrencyError(f"No exchange rate for {', '.join(unknown)}")
+
+        if unknown:
+            current_app.logger.warning('No exchange rate for %s, amounts in it are skipped', ', '.join(unknown))
+
+    return np.array([index.get(c, unknown_index) for c in currencies], dtype=int)
+
+
+def get_missing_rates(currencies) -> set:
+    '''Fetches the rates of currencies that don't have one yet, so a stock in a new currency can be traded
+        args:
+            currencies: iterable - currency codes
+        returns:
+            set - currencies still without a rate
+    '''
+    missing = {c for c in currencies if c not in get_rate_matrix()['index']}
+
+    if missing:
+        try:
+            refresh_rates(missing)
+        except:
+            db.session.rollback()
+
+        load_rates()
+
+    return {c for c in missing if c not in rate_matrix['index']}
+
+
+def convert(amounts, from_currencies, to_currencies, skip_unknown=False) -> np.ndarray:
+    '''Converts amounts between currencies in one vectorized step
+        args:
+            amounts: array like - amounts to convert
+            from_currencies: iterable - currency of each amount
+            to_currencies: iterable or str - target currency of each amount, or one for all
+            skip_unknown: bool - NaN for the amounts from or to a currency without a rate instead of raising,
+                so one bad row (a legacy 'n/a' or yfinance's 'GBp') doesn't fail the whole batch
+        returns:
+            np.ndarray - converted amounts
+    '''
+    amounts = np.asarray(amounts, dtype=float)
+
+    if isinstance(to_currencies, str):
+        to_currencies = [to_currencies] * len(amounts)
+
+    matrix = get_rate_matrix()['matrix']
+
+    if not skip_unknown:
+        return amounts * matrix[get_currency_index(from_currencies), get_currency_index(to_currencies)]
+
+    from_index = get_currency_index(from_currencies, unknown_index=-1)
+    to_index = get_currency_index(to_currencies, unknown_index=-1)
+    known = (from_index >= 0) & (to_index >= 0)
+    converted = np.full(len(amounts), np.nan)
+    converted[known] = amounts[known] * matrix[from_index[known], to_index[known]]
+
+    return converted
+
+
+def convert_amount(amount: float, from_currency: str, to_currency: str) -> float:
+    '''Converts a single amount between currencies
+        args:
+            amount: float - amount to convert
+            from_currency: str - currency of the amount
+            to_currency: str - target currency
+        returns:
+            float - converted amount
+    '''
+    return float(convert([amount], [from_currency], to_currency)[0])
+
+
+def refresh_rates(currencies) -> set:
+    '''Fetches the USD rate of currencies from yfinance in one batch and saves them
+        args:
+            currencies: iterable - currency codes to refresh
+        returns:
+            set - currencies whose rate changed
+    '''
+    currencies = sorted({c for c in currencies if c and len(c) == 3 and c.isalpha() and c.isupper() and c != BASE_CURRENCY})
+    changed_currencies = set()
+
+    if not currencies or current_app.config.get('FX_STATIC_RATES'):
+        return changed_currencies
+
+    tickers = [f'{c}{BASE_CURRENCY}=X' for c in currencies]
+    closes = yf.download(tickers, period='5d', progress=False)['Close']
+
+    if len(tickers) == 1:
+        closes = closes.to_frame(tickers[0]) if closes.ndim == 1 else closes
+
+    latest = closes.ffill().iloc[-1]
+    now = datetime.now(timezone.utc)
+
+    for currency, ticker in zip(currencies, tickers):
+        rate = latest.get(ticker)
+
+        if rate is None or np.isnan(rate):
+            continue
+
+        fx_rate = db.session.get(FxRate, currency) or FxRate(currency=currency)
+
+        if fx_rate.usd_rate != float(rate):
+            changed_currencies.add(currency)
+
+        fx_rate.usd_rate = float(rate)
+        fx_rate.updated_time = now
+
+        db.session.add(fx_rate)
+
+    db.session.commit()
+
+    load_rates()
+
+    return changed_currencies
@@ -0,0 +1,381 @@
+import re
+from datetime import date, datetime, timezone
+
+from sqlalchemy import Table, Column, Integer, Float, DateTime, Index, MetaData, inspect, select, func, insert, text, union_all
+
+from . import db
+from .data_models import History
+
+# monthly partitions (postgresql) or shard tables (sqlite) are named history_YYYY_MM
+PARTITION_PATTERN = re.compile(r'^history_(\d{4})_(\d{2})$')
+# sqlite shards take ids from their own range so ids stay unique and grow over time
+SHARD_ID_RANGE = 10**9
+
+# sqlite shard tables, kept out of the models' metadata so create_all doesn't touch them
+shard_metadata = MetaData()
+# seconds a new postgresql partition waits for the lock on history
+PARTITION_LOCK_TIMEOUT = 10
+
+HISTORY_DDL = ('CREATE TABLE IF NOT EXISTS history ('
+               'id BIGINT GENERATED BY DEFAULT AS IDENTITY, '
+               'portfolio_id INTEGER NOT NULL REFERENCES portfolio (id), '
+               'record_time TIMESTAMP WITH TIME ZONE NOT NULL, '
+               'portfolio_value DOUBLE PRECISION NOT NULL, '
+               'PRIMARY KEY (id, record_time)'
+               ') PARTITION BY RANGE (record_time)')
+
+
+def is_postgres() -> bool:
+    '''Checks if history is stored in a partitioned postgresql table
+    '''
+    return db.engine.dialect.name == 'postgresql'
+
+
+def to_utc(time: datetime) -> datetime:
+    '''Makes a time UTC aware, naive times are UTC
+    '''
+    if time.tzinfo is None:
+        return time.replace(tzinfo=timezone.utc)
+
+    return time.astimezone(timezone.utc)
+
+
+def to_column_time(time: datetime) -> datetime:
+    '''Converts a time to the form stored in the database: aware on postgresql, naive UTC on sqlite
+    '''
+    time = to_utc(time)
+
+    return time if is_postgres() else time.replace(tzinfo=None)
+
+
+def month_start(day) -> date:
+    '''Gets the first day of the month of a date or datetime
+    '''
+    return date(day.year, day.month, 1)
+
+
+def add_months(day: date, months: int) -> date:
+    '''Moves the first day of a month by a number of months
+    '''
+    index = day.year * 12 + day.month - 1 + months
+
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def get_partition_name(month: date) -> str:
+    return f'history_{month.year:04d}_{month.month:02d}'
+
+
+def get_partitions() -> list:
+    '''Lists the monthly partitions (postgresql) or shard tables (sqlite) of history
+        returns:
+            list - (first day of the month, table name) sorted oldest first
+    '''
+    if is_postgres():
+        names = db.session.execute(text('SELECT c.relname FROM pg_inherits i '
+                                        'JOIN pg_class c ON c.oid = i.inhrelid '
+                                        'JOIN pg_class p ON p.oid = i.inhparent '
+                                        "WHERE p.relname = 'history'")).scalars().all()
+    else:
+        names = inspect(db.session.connection()).get_table_names()
+
+    partitions = []
+
+    for name in names:
+        match = PARTITION_PATTERN.match(name)
+
+        if match:
+            partitions.append((date(int(match.group(1)), int(match.group(2)), 1), name))
+
+    return sorted(partitions)
+
+
+def get_shard_table(name: str) -> Table:
+    '''Gets the table object of a sqlite shard or postgresql partition
+    '''
+    if name not in shard_metadata.tables:
+        Table(name, shard_metadata,
+              Column('id', Integer, primary_key=True),
+              Column('portfolio_id', Integer, nullable=False),
+              Column('record_time', DateTime(timezone=True), nullable=False),
+              Column('portfolio_value', Float, nullable=False),
+              Index(f'ix_{name}_portfolio_time', 'portfolio_id', 'record_time'),
+              sqlite_autoincrement=True)
+
+    return shard_metadata.tables[name]
+
+
+def get_partition_ddl(name: str, month: date) -> str:
+    '''Gets the statement creating the postgresql partition of a month
+    '''
+    # bounds in UTC, record_time is timestamptz
+    return (f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF history "
+            f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') TO ('{add_months(month, 1).isoformat()} 00:00:00+00')")
+
+
+def get_history_kind(connection) -> str:
+    '''Gets the kind of the postgresql history table
+        returns:
+            str - 'p' if partitioned, 'r' if a plain table, None if it doesn't exist
+    '''
+    return connection.execute(text("SELECT relkind FROM pg_class "
+                                   "WHERE relname = 'history' AND pg_table_is_visible(oid)")).scalar()
+
+
+def partition_history_table(connection) -> int:
+    '''Moves a plain postgresql history table, from before history was partitioned, into a partitioned one.
+    The old table is renamed, the partitioned table and the partitions of its months are created,
+    the rows are copied and the old table is dropped, all in the connection's transaction
+        args:
+            connection: Connection - connection in a transaction
+        returns:
+            int - number of rows moved
+    '''
+    connection.execute(text('LOCK TABLE history IN ACCESS EXCLUSIVE MODE'))
+    connection.execute(text('ALTER TABLE history RENAME TO history_unpartitioned'))
+    # the index and sequence names are taken again by the partitioned table
+    connection.execute(text('ALTER INDEX IF EXISTS history_pkey RENAME TO history_unpartitioned_pkey'))
+    connection.execute(text('ALTER INDEX IF EXISTS ix_history_portfolio_time RENAME TO ix_history_unpartitioned_portfolio_time'))
+    connection.execute(text('ALTER SEQUENCE IF EXISTS history_id_seq RENAME TO history_unpartitioned_id_seq'))
+    connection.execute(text(HISTORY_DDL))
+
+    months = connection.execute(text("SELECT DISTINCT date_trunc('month', record_time AT TIME ZONE 'UTC')::date "
+                                     "FROM history_unpartitioned")).scalars().all()
+
+    for month in months:
+        connection.execute(text(get_partition_ddl(get_partition_name(month), month)))
+
+    moved = connection.execute(text('INSERT INTO history (id, portfolio_id, record_time, portfolio_value) '
+                                    'SELECT id, portfolio_id, record_time, portfolio_value FROM history_unpartitioned')).rowcount
+    connection.execute(text("SELECT setval(pg_get_serial_sequence('history', 'id'), "
+                            "(SELECT COALESCE(MAX(id), 0) + 1 FROM history), false)"))
+    connection.execute(text('DROP TABLE history_unpartitioned'))
+
+    return moved
+
+
+def create_history_table() -> None:
+    '''Creates the history table. On postgresql it is partitioned by month of record_time,
+    the primary key has to include the partition key. A plain history table left by an older
+    version is migrated, raises RuntimeError if history still isn't partitioned afterwards
+    '''
+    if not is_postgres():
+        History.__table__.create(db.session.connection(), checkfirst=True)
+        return
+
+    with db.engine.begin() as connection:
+        kind = get_history_kind(connection)
+
+        if kind == 'r':
+            partition_history_table(connection)
+        elif kind is None:
+            connection.execute(text(HISTORY_DDL))
+
+        connection.execute(text('CREATE INDEX IF NOT EXISTS ix_history_portfolio_time ON history (portfolio_id, record_time)'))
+
+        if get_history_kind(connection) != 'p':
+            raise RuntimeError('history is not a partitioned table, it has to be migrated before partitions can be created')
+
+
+def create_partition(month: date) -> bool:
+    '''Creates the partition or shard of a month if it doesn't exist yet, without committing the session.
+    On postgresql it runs on its own connection so the caller's unit of work isn't committed early
+    and the lock on history is released right away
+        args:
+            month: date - first day of the month
+        returns:
+            bool - True if it was created
+    '''
+    name = get_partition_name(month)
+
+    if name in [n for _, n in get_partitions()]:
+        return False
+
+    if is_postgres():
+        with db.engine.begin() as connection:
+            # fail instead of waiting for a transaction that holds history, such as the caller's own
+            connection.execute(text(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}s'"))
+            connection.execute(text(get_partition_ddl(name, month)))
+    else:
+        # sqlite has a single writer, another connection would wait for the caller's transaction.
+        # the shard is created in the caller's transaction, it is committed or rolled back with its rows
+        connection = db.session.connection()
+        get_shard_table(name).create(connection, checkfirst=True)
+        # start the shard's ids at its own range
+        connection.execute(text('INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)'),
+                           {'name': name, 'seq': (month.year * 12 + month.month - 1) * SHARD_ID_RANGE})
+
+    return True
+
+
+def ensure_partitions(months_ahead=1, now=None) -> list:
+    '''Creates the partitions of the current month and the next ones, run by the scheduler
+        args:
+            months_ahead: int - number of future months to create
+            now: datetime - current time, defaults to now
+        returns:
+            list - names of the partitions created
+    '''
+    current = month_start(to_utc(now or datetime.now(timezone.utc)))
+    created = [get_partition_name(add_months(current, i)) for i in range(months_ahead + 1) if create_partition(add_months(current, i))]
+
+    db.session.commit()
+
+    return created
+
+
+def drop_partitions(before: date) -> list:
+    '''Drops the partitions of the months before a date, this is how old history is deleted
+        args:
+            before: date - partitions of earlier months are dropped
+        returns:
+            list - names of the dropped partitions
+    '''
+    dropped = []
+
+    for month, name in get_partitions():
+        if month >= month_start(before):
+            break
+
+        db.session.execute(text(f'DROP TABLE {name}'))
+        dropped.append(name)
+
+        if name in shard_metadata.tables:
+            shard_metadata.remove(shard_metadata.tables[name])
+
+    db.session.commit()
+
+    return dropped
+
+
+def get_tables(start=None, end=None) -> list:
+    '''Gets the tables to read history from, only the months overlapping the time range (partition pruning).
+    On postgresql the partitioned table prunes by itself
+        args:
+            start: datetime - earliest record time
+            end: datetime - latest record time
+        returns:
+            list - tables
+    '''
+    if is_postgres():
+        return [History.__table__]
+
+    first = month_start(to_utc(start)) if start else date.min
+    last = month_start(to_utc(end)) if end else date.max
+    shards = [get_shard_table(name) for month, name in get_partitions() if first <= month <= last]
+
+    # rows recorded before the history was sharded
+    return [History.__table__] + shards
+
+
+def get_record_select(table: Table, portfolio_ids=None, start=None, end=None, after_id=None):
+    '''Builds the select of the history records of one table
+    '''
+    query = select(table.c.id, table.c.portfolio_id, table.c.record_time, table.c.portfolio_value)
+
+    if portfolio_ids is not None:
+        query = query.where(table.c.portfolio_id.in_(portfolio_ids))
+    if start is not None:
+        query = query.where(table.c.record_time >= to_column_time(start))
+    if end is not None:
+        query = query.where(table.c.record_time <= to_column_time(end))
+    if after_id is not None:
+        query = query.where(table.c.id > after_id)
+
+    return query
+
+
+def get_records(portfolio_ids=None, start=None, end=None) -> list:
+    '''Gets history records, only reading the partitions of the time range
+        args:
+            portfolio_ids: list - portfolios to get, all if None
+            start: datetime - earliest record time, naive times are UTC
+            end: datetime - latest record time, naive times are UTC
+        returns:
+            list - rows (id, portfolio_id, record_time, portfolio_value) ordered by portfolio and time
+    '''
+    query = union_all(*[get_record_select(t, portfolio_ids, start, end) for t in get_tables(start, end)]).subquery()
+
+    return db.session.execute(select(query).order_by(query.c.portfolio_id, query.c.record_time, query.c.id)).all()
+
+
+def get_records_after(last_id: int, limit: int) -> list:
+    '''Gets the next records by id, for exports that resume from the last id they read
+        args:
+            last_id: int - last id read
+            limit: int - maximum number of rows
+        returns:
+            list - rows (id, portfolio_id, record_time, portfolio_value) ordered by id
+    '''
+    query = union_all(*[get_record_select(t, after_id=last_id) for t in get_tables()]).subquery()
+
+    return db.session.execute(select(query).order_by(query.c.id).limit(limit)).all()
+
+
+def get_last_records(portfolio_ids: list, before=None) -> dict:
+    '''Gets the latest record of each portfolio, reading the newest partitions first
+    and stopping once every portfolio is found
+        args:
+            portfolio_ids: list - portfolios to get
+            before: datetime - only records before this time, naive times are UTC
+        returns:
+            dict - portfolio id to row (id, portfolio_id, record_time, portfolio_value)
+    '''
+    remaining = set(portfolio_ids)
+    last_records = {}
+
+    # postgresql partitions are read directly so each step only scans one month
+    tables = [get_shard_table(name) for _, name in reversed(get_partitions())]
+
+    if not is_postgres():
+        tables.append(History.__table__)
+
+    for table in tables:
+        if not remaining:
+            break
+
+        latest = select(table.c.portfolio_id, func.max(table.c.record_time).label('record_time'))\
+                    .where(table.c.portfolio_id.in_(remaining))
+
+        if before is not None:
+            latest = latest.where(table.c.record_time < to_column_time(before))
+
+        latest = latest.group_by(table.c.portfolio_id).subquery()
+        rows = db.session.execute(select(table.c.id, table.c.portfolio_id, table.c.record_time, table.c.portfolio_value)
+                                  .join(latest, (latest.c.portfolio_id == table.c.portfolio_id) & (latest.c.record_time == table.c.record_time))
+                                  .order_by(table.c.id)).all()
+
+        for row in rows:
+            last_records[row.portfolio_id] = row
+
+        remaining -= {row.portfolio_id for row in rows}
+
+    return last_records
+
+
+def add_records(records: list) -> None:
+    '''Adds history records, on sqlite each record goes to the shard of its month.
+    The partition or shard of a month is created when missing, so records can be saved
+    when the scheduler's maintain_history has not run. Doesn't commit
+        args:
+            records: list - dicts with portfolio_id, record_time and portfolio_value
+    '''
+    if not records:
+        return
+
+    records = [{**r, 'record_time': to_column_time(r['record_time'])} for r in records]
+    by_month = {}
+
+    for record in records:
+        by_month.setdefault(month_start(record['record_time']), []).append(record)
+
+    partitions = {name for _, name in get_partitions()}
+
+    for month, month_records in by_month.items():
+        name = get_partition_name(month)
+
+        if name not in partitions:
+            create_partition(month)
+
+        # postgresql routes the rows of the partitioned table to their partition
+        db.session.execute(insert(History.__table__ if is_postgres() else get_shard_table(name)), month_records)
@@ -0,0 +1,50 @@
+import importlib
+import sys
+import types
+
+# stand-ins of the modules deferred with lazy_import, keyed by module name
+deferred_modules = {}
+
+
+class LazyModule(types.ModuleType):
+    '''Stand-in for a module that is only imported when one of its attributes is first used
+    '''
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self.__name__), attr)
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    '''Defers importing a heavy module until it is used, e.g. np = lazy_import('numpy')
+        args:
+            name: str - full module name
+        returns:
+            module - the module if it is already imported, a stand-in otherwise
+    '''
+    if name in sys.modules:
+        return sys.modules[name]
+
+    return deferred_modules.setdefault(name, LazyModule(name))
+
+
+def warm_imports() -> list:
+    '''Imports every deferred module now, e.g. in the gunicorn master before it forks the workers
+    so they share the imported modules' memory
+        returns:
+            list - names of the modules imported
+    '''
+    names = []
+
+    for name in deferred_modules:
+        if name in sys.modules:
+            continue
+
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            # optional dependency that is not installed
+            continue
+
+        names.append(name)
+
+    return names
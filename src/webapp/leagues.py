@@ -0,0 +1,128 @@
+from datetime import datetime
+
+from flask import session
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+
+from . import db
+from .data_models import League, Portfolio
+from .portfolio_sim_functions import create_portfolio, get_portfolio, rank_performers
+
+# longest league name
+LEAGUE_NAME_LENGTH = 50
+
+
+def get_leagues() -> list:
+    '''Gets every league with its number of players, the newest first
+        returns:
+            list - (League, players)
+    '''
+    return db.session.query(League, func.count(Portfolio.id))\
+                     .outerjoin(Portfolio, Portfolio.league_id == League.id)\
+                     .group_by(League.id)\
+                     .order_by(League.start_date.desc(), League.id.desc())\
+                     .all()
+
+
+def get_league(league_id: int) -> League:
+    '''Gets a league, None if it doesn't exist
+    '''
+    return db.session.get(League, league_id)
+
+
+def parse_league_id(value: str) -> int:
+    '''Parses a league id posted by a form
+        args:
+            value: str - form value
+        returns:
+            int - league id, None if the value is not an id
+    '''
+    try:
+        league_id = int(value)
+    except (TypeError, ValueError):
+        return None
+
+    return league_id if league_id > 0 else None
+
+
+def is_league_name_taken(name: str) -> bool:
+    return League.query.filter_by(name=name).first() is not None
+
+
+def create_league(name: str, start_date, starting_funds: float) -> League:
+    '''Creates a league
+        args:
+            name: str - unique name of the league
+            start_date: date - first day portfolios of the league can trade
+            starting_funds: float - cash each portfolio of the league starts with
+        returns:
+            League - new league
+    '''
+    league = League(name=name,
+                    start_date=start_date,
+                    starting_funds=starting_funds,
+                    creation_date=datetime.today().date())
+
+    db.session.add(league)
+    db.session.commit()
+
+    return league
+
+
+def join_league(user_id: int, league: League) -> Portfolio:
+    '''Creates the user's portfolio in a league
+        args:
+            user_id: int - database id of the user
+            league: League - league joined
+        returns:
+            Portfolio - the user's portfolio in the league, the existing one if they already joined
+    '''
+    return get_portfolio(user_id, league.id) or create_portfolio(user_id, league)
+
+
+def set_active_league(league_id=None) -> None:
+    '''Picks the game the dashboard, buy and sell pages play in for this session
+        args:
+            league_id: int - database id of the league, the global game if None
+    '''
+    if league_id is None:
+        session.pop('league_id', None)
+    else:
+        session['league_id'] = league_id
+
+
+def get_active_portfolio(user_id: int) -> Portfolio:
+    '''Gets the portfolio of the game picked for this session, the global game by default
+        args:
+            user_id: int - database id of the user
+        returns:
+            Portfolio - the portfolio, None if the user has no global portfolio yet
+    '''
+    league_id = session.get('league_id')
+
+    if league_id is not None:
+        portfolio = get_portfolio(user_id, league_id)
+
+        if portfolio:
+            return portfolio
+
+        set_active_league(None)
+
+    return get_portfolio(user_id)
+
+
+def get_league_performers(league_id: int) -> list:
+    '''Ranks the portfolios of a league.
+    Portfolios of a league share its base currency, so they are read in rank order
+    from the (league_id, updated_value) index instead of converting every portfolio
+        args:
+            league_id: int - database id of the league
+        returns:
+            list - rank, value and performance of each portfolio
+    '''
+    portfolios = Portfolio.query.filter(Portfolio.league_id == league_id)\
+                                .order_by(Portfolio.updated_value.desc())\
+                                .options(joinedload(Portfolio.user))\
+                                .all()
+
+    return rank_performers(portfolios)
@@ -0,0 +1,287 @@
+import json
+from datetime import datetime
+
+from sqlalchemy import func
+
+from . import db
+from .data_models import Portfolio, Holdings, Transactions, LedgerCheckpoint
+from .fx import convert_amount
+from .market_calendar import to_epoch_seconds
+from .portfolio_sim_functions import STARTING_FUNDS, get_starting_funds
+
+# transactions replayed between two checkpoints of a portfolio
+CHECKPOINT_INTERVAL = 50
+# largest cash difference accepted by the verification, cash is rounded after every transaction
+CASH_TOLERANCE = 0.05
+
+
+class Ledger:
+    '''Cash and positions of a portfolio rebuilt by replaying its transactions in order.
+    Applies the same rules as update_holding and update_portfolio_cash
+    '''
+
+    def __init__(self, base_currency: str, cash=STARTING_FUNDS, positions=None, transaction_id=0, transaction_date=None):
+        self.base_currency = base_currency
+        self.cash = cash
+        # ticker to [shares, average price, currency]
+        self.positions = positions or {}
+        self.transaction_id = transaction_id
+        self.transaction_date = transaction_date
+        # sells of more shares than the replay holds, such as rows from before the ledger
+        self.anomalies = []
+
+    @classmethod
+    def from_checkpoint(cls, checkpoint: LedgerCheckpoint, base_currency: str):
+        return cls(base_currency,
+                   cash=checkpoint.cash,
+                   positions=json.loads(checkpoint.holdings),
+                   transaction_id=checkpoint.transaction_id,
+                   transaction_date=checkpoint.transaction_date)
+
+    def apply(self, transaction: Transactions) -> None:
+        '''Applies one transaction
+            args:
+                transaction: Transactions - next transaction of the portfolio
+        '''
+        ticker = transaction.ticker
+        shares = transaction.number_of_shares
+        price = transaction.price_per_share
+        # older transactions did not record their rate, use today's
+        rate = transaction.fx_rate or convert_amount(1, transaction.currency, self.base_currency)
+
+        if transaction.status == 'sell':
+            position = self.positions.get(ticker)
+            held = position[0] if position else 0
+
+            if held < shares:
+                # the cash still moved, the position is closed
+                self.anomalies.append({
+                    'transaction_id': transaction.id,
+                    'ticker': ticker,
+                    'sold': shares,
+                    'held': held
+                })
+
+            if held <= shares:
+                self.positions.pop(ticker, None)
+            else:
+                position[0] -= shares
+
+            self.cash = round(self.cash + transaction.total_value * rate, 2)
+        else:
+            position = self.positions.get(ticker)
+
+            if position:
+                position[1] = round((position[1] * position[0] + price * shares) / (position[0] + shares), 2)
+                position[0] += shares
+            else:
+                self.positions[ticker] = [shares, round(price, 2), transaction.currency]
+
+            self.cash = round(self.cash - transaction.total_value * rate, 2)
+
+        self.transaction_id = transaction.id
+        self.transaction_date = transaction.transaction_date
+
+    def to_checkpoint(self, portfolio_id: int) -> LedgerCheckpoint:
+        return LedgerCheckpoint(portfolio_id=portfolio_id,
+                                transaction_id=self.transaction_id,
+                                transaction_date=self.transaction_date,
+                                cash=self.cash,
+                                holdings=json.dumps(self.positions))
+
+    def to_dict(self) -> dict:
+        '''Gets the cash and holdings with their cost basis
+        '''
+        return {
+            'cash': self.cash,
+            'transaction_id': self.transaction_id,
+            'anomalies': self.anomalies,
+            'holdings': {
+                ticker: {
+                    'shares': shares,
+                    'average_price': average_price,
+                    'currency': currency,
+                    'cost_basis': round(shares * average_price, 2)
+                }
+                for ticker, (shares, average_price, currency) in sorted(self.positions.items())
+            }
+        }
+
+
+def to_timestamp(time: datetime) -> float:
+    '''Gets the epoch seconds of a time, naive times are UTC
+    '''
+    return float(to_epoch_seconds([time])[0])
+
+
+def get_latest_checkpoint(portfolio_id: int, at=None) -> LedgerCheckpoint:
+    '''Gets the newest checkpoint of a portfolio taken at or before a time
+        args:
+            portfolio_id: int - database id of the portfolio
+            at: datetime - latest time, any time if None
+        returns:
+            LedgerCheckpoint - checkpoint, None if there is none
+    '''
+    checkpoints = LedgerCheckpoint.query.filter_by(portfolio_id=portfolio_id)\
+                                        .order_by(LedgerCheckpoint.transaction_id.desc())\
+                                        .all()
+
+    for checkpoint in checkpoints:
+        if at is None or to_timestamp(checkpoint.transaction_date) <= to_timestamp(at):
+            return checkpoint
+
+    return None
+
+
+def reconstruct_portfolio(portfolio_id: int, at=None) -> dict:
+    '''Rebuilds the cash, holdings and cost basis of a portfolio at a point in time.
+    Replay starts from the newest checkpoint before that time
+        args:
+            portfolio_id: int - database id of the portfolio
+            at: datetime - time to rebuild the portfolio at, naive times are UTC. Now if None
+        returns:
+            dict - cash, holdings and the last transaction applied
+    '''
+    portfolio = db.session.get(Portfolio, portfolio_id)
+    checkpoint = get_latest_checkpoint(portfolio_id, at)
+    ledger = Ledger.from_checkpoint(checkpoint, portfolio.base_currency) if checkpoint else Ledger(portfolio.base_currency, cash=get_starting_funds(portfolio))
+    limit = None if at is None else to_timestamp(at)
+
+    transactions = Transactions.query.filter(Transactions.portfolio_id == portfolio_id,
+                                             Transactions.id > ledger.transaction_id)\
+                                     .order_by(Transactions.id)\
+                                     .yield_per(500)
+
+    for transaction in transactions:
+        if limit is not None and to_timestamp(transaction.transaction_date) > limit:
+            break
+
+        ledger.apply(transaction)
+
+    return ledger.to_dict()
+
+
+def get_replay_start(portfolios: list) -> dict:
+    '''Gets the ledger every portfolio resumes from, its newest checkpoint or an empty ledger
+        args:
+            portfolios: list - portfolios to replay
+        returns:
+            dict - portfolio id to Ledger
+    '''
+    latest = db.session.query(func.max(LedgerCheckpoint.id))\
+                       .group_by(LedgerCheckpoint.portfolio_id)
+    checkpoints = {c.portfolio_id: c for c in LedgerCheckpoint.query.filter(LedgerCheckpoint.id.in_(latest)).all()}
+    ledgers = {}
+
+    for portfolio in portfolios:
+        checkpoint = checkpoints.get(portfolio.id)
+
+        if checkpoint:
+            ledgers[portfolio.id] = Ledger.from_checkpoint(checkpoint, portfolio.base_currency)
+        else:
+            ledgers[portfolio.id] = Ledger(portfolio.base_currency, cash=get_starting_funds(portfolio))
+
+    return ledgers
+
+
+def replay_all(ledgers: dict, on_transaction=None) -> None:
+    '''Replays the transactions after each ledger's start in one pass over the transactions table
+        args:
+            ledgers: dict - portfolio id to Ledger
+            on_transaction: callable - called with (portfolio id, ledger, transactions since start) after each transaction
+    '''
+    start_ids = {portfolio_id: ledger.transaction_id for portfolio_id, ledger in ledgers.items()}
+    replayed = {portfolio_id: 0 for portfolio_id in ledgers}
+
+    # skip the rows before the oldest start, the other portfolios skip theirs below
+    transactions = Transactions.query.filter(Transactions.id > min(start_ids.values(), default=0))\
+                                     .order_by(Transactions.id)\
+                                     .yield_per(1000)
+
+    for transaction in transactions:
+        ledger = ledgers.get(transaction.portfolio_id)
+
+        if ledger is None or transaction.id <= start_ids[transaction.portfolio_id]:
+            continue
+
+        ledger.apply(transaction)
+        replayed[transaction.portfolio_id] += 1
+
+        if on_transaction:
+            on_transaction(transaction.portfolio_id, ledger, replayed[transaction.portfolio_id])
+
+
+def save_checkpoints(interval=CHECKPOINT_INTERVAL) -> int:
+    '''Adds a checkpoint every `interval` transactions of each portfolio since its last checkpoint
+        args:
+            interval: int - transactions between two checkpoints
+        returns:
+            int - number of checkpoints saved
+    '''
+    ledgers = get_replay_start(Portfolio.query.all())
+    checkpoints = []
+
+    def add_checkpoint(portfolio_id, ledger, replayed):
+        if replayed % interval == 0:
+            checkpoints.append(ledger.to_checkpoint(portfolio_id))
+
+    replay_all(ledgers, add_checkpoint)
+
+    db.session.add_all(checkpoints)
+    db.session.commit()
+
+    return len(checkpoints)
+
+
+def verify_ledger(tolerance=CASH_TOLERANCE) -> list:
+    '''Checks that the holdings and cash of every portfolio agree with their transactions.
+    All portfolios are replayed in one pass from their latest checkpoint, a sell of shares
+    the replay doesn't hold is reported and the replay goes on
+        args:
+            tolerance: float - largest accepted cash difference
+        returns:
+            list - mismatches, empty if everything agrees
+    '''
+    portfolios = Portfolio.query.all()
+    ledgers = get_replay_start(portfolios)
+
+    replay_all(ledgers)
+
+    holdings = {}
+
+    for holding in Holdings.query.with_entities(Holdings.portfolio_id, Holdings.ticker, Holdings.number_of_shares, Holdings.average_price):
+        holdings.setdefault(holding.portfolio_id, {})[holding.ticker] = (holding.number_of_shares, holding.average_price)
+
+    mismatches = []
+
+    for portfolio in portfolios:
+        ledger = ledgers[portfolio.id]
+        stored = holdings.get(portfolio.id, {})
+        replayed = {ticker: (shares, average_price) for ticker, (shares, average_price, _) in ledger.positions.items()}
+
+        for anomaly in ledger.anomalies:
+            mismatches.append({
+                'portfolio_id': portfolio.id,
+                'field': f"transaction {anomaly['transaction_id']}",
+                'stored': f"sell of {anomaly['sold']} {anomaly['ticker']}",
+                'ledger': f"{anomaly['held']} held"
+            })
+
+        if abs(portfolio.available_cash - ledger.cash) > tolerance:
+            mismatches.append({
+                'portfolio_id': portfolio.id,
+                'field': 'available_cash',
+                'stored': portfolio.available_cash,
+                'ledger': ledger.cash
+            })
+
+        for ticker in sorted(set(stored) | set(replayed)):
+            if stored.get(ticker) != replayed.get(ticker):
+                mismatches.append({
+                    'portfolio_id': portfolio.id,
+                    'field': f'holding {ticker}',
+                    'stored': stored.get(ticker),
+                    'ledger': replayed.get(ticker)
+                })
+
+    return mismatches
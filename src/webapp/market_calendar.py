@@ -0,0 +1,277 @@
+from __future__ import annotations
+
+from datetime import date, datetime, time, timedelta
+import pytz
+
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+MARKET_TIMEZONE = pytz.timezone('US/Eastern')
+MARKET_OPEN = time(9, 30)
+MARKET_CLOSE = time(16, 0)
+EARLY_CLOSE = time(13, 0)
+
+# NYSE full day closures
+HOLIDAYS = {
+    date(2024, 1, 1): "New Year's Day",
+    date(2024, 1, 15): 'Martin Luther King Jr. Day',
+    date(2024, 2, 19): "Washington's Birthday",
+    date(2024, 3, 29): 'Good Friday',
+    date(2024, 5, 27): 'Memorial Day',
+    date(2024, 6, 19): 'Juneteenth',
+    date(2024, 7, 4): 'Independence Day',
+    date(2024, 9, 2): 'Labor Day',
+    date(2024, 11, 28): 'Thanksgiving Day',
+    date(2024, 12, 25): 'Christmas Day',
+    date(2025, 1, 1): "New Year's Day",
+    date(2025, 1, 9): 'National Day of Mourning',
+    date(2025, 1, 20): 'Martin Luther King Jr. Day',
+    date(2025, 2, 17): "Washington's Birthday",
+    date(2025, 4, 18): 'Good Friday',
+    date(2025, 5, 26): 'Memorial Day',
+    date(2025, 6, 19): 'Juneteenth',
+    date(2025, 7, 4): 'Independence Day',
+    date(2025, 9, 1): 'Labor Day',
+    date(2025, 11, 27): 'Thanksgiving Day',
+    date(2025, 12, 25): 'Christmas Day',
+    date(2026, 1, 1): "New Year's Day",
+    date(2026, 1, 19): 'Martin Luther King Jr. Day',
+    date(2026, 2, 16): "Washington's Birthday",
+    date(2026, 4, 3): 'Good Friday',
+    date(2026, 5, 25): 'Memorial Day',
+    date(2026, 6, 19): 'Juneteenth',
+    date(2026, 7, 3): 'Independence Day (observed)',
+    date(2026, 9, 7): 'Labor Day',
+    date(2026, 11, 26): 'Thanksgiving Day',
+    date(2026, 12, 25): 'Christmas Day',
+    date(2027, 1, 1): "New Year's Day",
+    date(2027, 1, 18): 'Martin Luther King Jr. Day',
+    date(2027, 2, 15): "Washington's Birthday",
+    date(2027, 3, 26): 'Good Friday',
+    date(2027, 5, 31): 'Memorial Day',
+    date(2027, 6, 18): 'Juneteenth (observed)',
+    date(2027, 7, 5): 'Independence Day (observed)',
+    date(2027, 9, 6): 'Labor Day',
+    date(2027, 11, 25): 'Thanksgiving Day',
+    date(2027, 12, 24): 'Christmas Day (observed)',
+}
+
+# NYSE 1:00pm closes
+EARLY_CLOSES = {
+    date(2024, 7, 3),
+    date(2024, 11, 29),
+    date(2024, 12, 24),
+    date(2025, 7, 3),
+    date(2025, 11, 28),
+    date(2025, 12, 24),
+    date(2026, 11, 27),
+    date(2026, 12, 24),
+    date(2027, 11, 26),
+}
+
+# character positions of strftime fields in a numpy ISO time string (YYYY-MM-DDTHH:MM:SS)
+ISO_FIELDS = {
+    'Y': range(0, 4),
+    'm': range(5, 7),
+    'd': range(8, 10),
+    'H': range(11, 13),
+    'M': range(14, 16),
+    'S': range(17, 19)
+}
+
+
+def get_market_time() -> datetime:
+    '''Gets the current time in the market's timezone
+        returns:
+            datetime - current time in US/Eastern
+    '''
+    return datetime.now(MARKET_TIMEZONE)
+
+
+def is_trading_day(day: date) -> bool:
+    '''Checks if the market has a session on a day
+        args:
+            day: date - day to check
+        returns:
+            bool - True on weekdays that are not holidays
+    '''
+    return day.weekday() < 5 and day not in HOLIDAYS
+
+
+def get_session(day: date) -> tuple:
+    '''Gets the open and close times of the market on a day
+        args:
+            day: date - day of the session
+        returns:
+            tuple - (open datetime, close datetime), None if the market is closed all day
+    '''
+    if not is_trading_day(day):
+        return None
+
+    close = EARLY_CLOSE if day in EARLY_CLOSES else MARKET_CLOSE
+
+    return (MARKET_TIMEZONE.localize(datetime.combine(day, MARKET_OPEN)),
+            MARKET_TIMEZONE.localize(datetime.combine(day, close)))
+
+
+def is_market_open(now=None) -> bool:
+    '''Checks if the market is in session
+        args:
+            now: datetime - time to check, defaults to the current time
+        returns:
+            bool - True between the open and close of a session
+    '''
+    now = (now or get_market_time()).astimezone(MARKET_TIMEZONE)
+    session = get_session(now.date())
+
+    return session is not None and session[0] <= now <= session[1]
+
+
+def is_session_tick(now=None) -> bool:
+    '''Checks if a scheduled job firing now falls inside a session.
+    Seconds are ignored so a job fired at 4:00:10pm still counts as the close
+        args:
+            now: datetime - time the job fired, defaults to the current time
+        returns:
+            bool - True if the job should run
+    '''
+    now = (now or get_market_time()).astimezone(MARKET_TIMEZONE)
+
+    return is_market_open(now.replace(second=0, microsecond=0))
+
+
+def get_last_close(now=None) -> datetime:
+    '''Gets the close time of the most recent finished session
+        args:
+            now: datetime - reference time, defaults to the current time
+        returns:
+            datetime - close time of the last session
+    '''
+    now = (now or get_market_time()).astimezone(MARKET_TIMEZONE)
+    day = now.date()
+
+    while True:
+        session = get_session(day)
+
+        if session is not None and session[1] <= now:
+            return session[1]
+
+        day -= timedelta(days=1)
+
+
+def get_session_ticks(start: datetime, end: datetime, minutes=30) -> list:
+    '''Gets the times the price update job runs between two times.
+    Ticks fall on the open, every `minutes` after it and on the close
+        args:
+            start: datetime - first possible tick
+            end: datetime - last possible tick
+            minutes: int - time between ticks
+        returns:
+            list - tick times in US/Eastern
+    '''
+    start = start.astimezone(MARKET_TIMEZONE)
+    end = end.astimezone(MARKET_TIMEZONE)
+    step = timedelta(minutes=minutes)
+    ticks = []
+    day = start.date()
+
+    while day <= end.date():
+        session = get_session(day)
+
+        if session is not None:
+            tick = session[0]
+
+            while tick <= session[1]:
+                if start <= tick <= end:
+                    ticks.append(tick)
+                # stepping on the wall clock is safe, sessions never span a DST change
+                tick = MARKET_TIMEZONE.normalize(tick + step)
+
+        day += timedelta(days=1)
+
+    return ticks
+
+
+def to_market_times(times) -> pd.DatetimeIndex:
+    '''Converts many times to the market's timezone in one vectorized step
+        args:
+            times: iterable - datetimes, naive times are UTC
+        returns:
+            pd.DatetimeIndex - times in US/Eastern
+    '''
+    return pd.DatetimeIndex(pd.to_datetime(list(times), utc=True)).tz_convert(MARKET_TIMEZONE.zone)
+
+
+def get_format_columns(fmt: str) -> list:
+    '''Maps a strftime format onto the characters of an ISO time string
+        args:
+            fmt: str - strftime format
+        returns:
+            list - ISO string position or literal character of each output character,
+                   None if the format uses a field that is not in the ISO string
+    '''
+    columns = []
+    i = 0
+
+    while i < len(fmt):
+        if fmt[i] == '%' and i + 1 < len(fmt) and fmt[i + 1] != '%':
+            field = ISO_FIELDS.get(fmt[i + 1])
+
+            if field is None:
+                return None
+
+            columns.extend(field)
+            i += 2
+        else:
+            if not fmt[i].isascii():
+                return None
+
+            columns.append(fmt[i])
+            i += 2 if fmt[i:i + 2] == '%%' else 1
+
+    return columns
+
+
+def format_market_times(times, fmt: str) -> list:
+    '''Converts many times to the market's timezone and formats them.
+    Numeric formats are cut out of numpy's ISO strings as a byte matrix instead of calling strftime per row
+        args:
+            times: iterable - datetimes, naive times are UTC
+            fmt: str - strftime format
+        returns:
+            list - formatted US/Eastern times
+    '''
+    if not len(times):
+        return []
+
+    market_times = to_market_times(times)
+    columns = get_format_columns(fmt)
+
+    if columns is None:
+        return list(market_times.strftime(fmt))
+
+    wall_times = market_times.tz_localize(None).to_numpy().astype('datetime64[s]')
+    iso = np.datetime_as_string(wall_times).astype('S19').view(np.uint8).reshape(len(wall_times), 19)
+    chars = np.empty((len(wall_times), len(columns)), dtype=np.uint8)
+
+    for i, column in enumerate(columns):
+        chars[:, i] = iso[:, column] if isinstance(column, int) else ord(column)
+
+    return chars.view(f'S{len(columns)}').ravel().astype(str).tolist()
+
+
+def to_epoch_seconds(times) -> np.ndarray:
+    '''Converts many times to epoch seconds in one vectorized step
+        args:
+            times: iterable - datetimes, naive times are UTC
+        returns:
+            np.ndarray - epoch seconds
+    '''
+    if not len(times):
+        return np.zeros(0)
+
+    index = pd.DatetimeIndex(pd.to_datetime(list(times), utc=True))
+
+    return ((index - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(microseconds=1)).to_numpy() / 1e6
@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func
+
+from . import db
+from .data_models import NewsFeed, NewsArticle, Holdings
+from .database import get_upsert
+from .portfolio_sim_functions import get_ticker_news, is_stale
+
+# how long cached news is shown before it is fetched again
+NEWS_TTL = timedelta(minutes=30)
+# number of most searched and most held tickers kept warm by the scheduler
+PREFETCH_TICKERS = 20
+
+
+def get_cached_news(ticker: str) -> list:
+    '''Gets the cached news articles of a ticker
+        args:
+            ticker: str - stock ticker
+        returns:
+            list - news articles, None if not cached or stale
+    '''
+    feed = db.session.get(NewsFeed, ticker)
+
+    if feed is None or feed.fetched_time is None or is_stale(feed.fetched_time, NEWS_TTL):
+        return None
+
+    return [{'name': a.name, 'url': a.url} for a in feed.articles]
+
+
+def refresh_news(ticker: str, articles=None) -> list:
+    '''Fetches the news articles of a ticker from yfinance and caches them
+        args:
+            ticker: str - stock ticker
+            articles: list - articles already fetched, fetched here if None
+        returns:
+            list - news articles
+    '''
+    if articles is None:
+        articles = get_ticker_news(ticker)
+    feed = db.session.get(NewsFeed, ticker) or NewsFeed(ticker=ticker, search_count=0)
+
+    feed.articles = [NewsArticle(name=a['name'][:500], url=a['url'][:1000]) for a in articles]
+    feed.fetched_time = datetime.now(timezone.utc)
+
+    db.session.add(feed)
+    db.session.commit()
+
+    return articles
+
+
+def get_news(ticker: str) -> list:
+    '''Gets the news articles of a ticker, from the cache when fresh
+        args:
+            ticker: str - stock ticker
+        returns:
+            list - news articles
+    '''
+    articles = get_cached_news(ticker)
+
+    if articles is None:
+        articles = refresh_news(ticker)
+
+    return articles
+
+
+def record_search(ticker: str) -> None:
+    '''Counts a search of a ticker, used to pick the tickers to prefetch.
+    One upsert, so concurrent searches all count and the first searches of a ticker don't collide
+        args:
+            ticker: str - stock ticker
+    '''
+    statement = get_upsert(NewsFeed).values(ticker=ticker, search_count=1)
+
+    db.session.execute(statement.on_conflict_do_update(index_elements=['ticker'],
+                                                       set_={'search_count': NewsFeed.search_count + 1}))
+    db.session.commit()
+
+
+def get_prefetch_tickers(limit=PREFETCH_TICKERS) -> list:
+    '''Gets the most searched and most held tickers
+        args:
+            limit: int - number of tickers of each kind
+        returns:
+            list - tickers to keep warm
+    '''
+    searched = db.session.query(NewsFeed.ticker)\
+                         .filter(NewsFeed.search_count > 0)\
+                         .order_by(NewsFeed.search_count.desc())\
+                         .limit(limit)\
+                         .all()
+    held = db.session.query(Holdings.ticker)\
+                     .group_by(Holdings.ticker)\
+                     .order_by(func.count(Holdings.id).desc())\
+                     .limit(limit)\
+                     .all()
+
+    return list(dict.fromkeys([t for t, in searched] + [t for t, in held]))
+
+
+def prefetch_news() -> None:
+    '''Refreshes the news of the most searched and most held tickers that are stale
+    '''
+    for ticker in get_prefetch_tickers():
+        if get_cached_news(ticker) is None:
+            try:
+                refresh_news(ticker)
+            except:
+                db.session.rollback()
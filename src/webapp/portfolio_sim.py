@@ -1,9 +1,23 @@
-from flask import Blueprint, render_template, request, url_for, redirect, flash
+import json
+import math
+import click
+from flask import Blueprint, render_template, request, url_for, redirect, flash, jsonify
 from flask_login import current_user, login_required
 
-import yfinance as yf
-
 from .portfolio_sim_functions import *
+from .symbol_directory import symbol_directory, load_symbols_csv
+from .news import get_cached_news, get_news, refresh_news, record_search
+from .database import read_only, read_replica
+from .rate_limit import rate_limited
+from .chart_payload import compressed_json_response
+from .ledger import reconstruct_portfolio, save_checkpoints, verify_ledger
+from .aggregates import get_market_overview, rebuild_aggregates
+from .leagues import get_leagues, get_league, parse_league_id, is_league_name_taken, create_league, join_league, set_active_league, get_active_portfolio, get_league_performers, LEAGUE_NAME_LENGTH
+from .watchlist import get_watchlist, get_watchlist_tickers, add_to_watchlist, remove_from_watchlist, WATCHLIST_SIZE, SPARKLINE_WIDTH, SPARKLINE_HEIGHT
+from .snapshot import export_snapshot, load_snapshot, FORMATS, EXPORT_CHUNK_SIZE
+
+# periods the stock history endpoint serves, daily bars
+HISTORY_PERIODS = {'1mo', '3mo', '6mo', '1y', '2y', '5y'}
 
 portfolio_sim = Blueprint('portfolio_sim', __name__)
 
@@ -11,22 +25,22 @@ portfolio_sim = Blueprint('portfolio_sim', __name__)
 # routes
 @portfolio_sim.route('/dashboard', methods=['GET', 'POST'])
 @login_required
+@rate_limited(methods=['POST'])
 def dashboard():
     if request.method == 'POST':
         # create portfolio form
         if 'create_portfolio' in request.form:
-            create_portfolio(current_user.id)
+            if not get_portfolio(current_user.id):
+                create_portfolio(current_user.id)
+
+            set_active_league(None)
         # buy stock form
         elif 'ticker' in request.form:
             ticker = request.form['ticker'].upper()
-            try:
-                ticker_info = yf.Ticker(ticker).info
-                
-                if 'currentPrice' in ticker_info:
-                    return redirect(url_for('portfolio_sim.buy_stock', ticker=ticker))
-                else:
-                    flash(f'Cannot find ticker {ticker}', category='error')
-            except:
+
+            if is_valid_ticker(ticker):
+                return redirect(url_for('portfolio_sim.buy_stock', ticker=ticker))
+            else:
                 flash(f'Cannot find ticker {ticker}', category='error')
         # sell stock form
         elif 'sellDropdown' in request.form:
@@ -38,37 +52,36 @@ def dashboard():
         # search stock form
         elif 'searchTicker' in request.form:
             ticker = request.form['searchTicker'].upper()
-            try:
-                ticker_info = yf.Ticker(ticker).info
-                
-                if 'currentPrice' in ticker_info:
-                    return redirect(url_for('portfolio_sim.search_stock', ticker=ticker))
-                else:
-                    flash(f'Cannot find ticker {ticker}', category='error')
-            except:
+
+            if is_valid_ticker(ticker):
+                return redirect(url_for('portfolio_sim.search_stock', ticker=ticker))
+            else:
                 flash(f'Cannot find ticker {ticker}', category='error')
 
-    portfolio_exists = current_user.portfolio
+    portfolio = get_active_portfolio(current_user.id)
+    portfolio_exists = portfolio is not None
 
     if portfolio_exists:
-        has_holdings = current_user.portfolio.holdings
-        has_transactions = current_user.portfolio.transactions
+        has_holdings = portfolio.holdings
+        has_transactions = portfolio.transactions
         transactions, holdings = [], []
         holdings_breakdown, sector_breakdown = None, None
-        history = get_portfolio_history(current_user.portfolio.id)
-        portfolio_value = current_user.portfolio.updated_value
-        change = round((portfolio_value/STARTING_FUNDS - 1) * 100, 2)
-        profit = round(portfolio_value - STARTING_FUNDS, 2)
-        update_time = utc_to_est(current_user.portfolio.updated_time).strftime('%a, %b %d. %Y %I:%M%p') + ' EST'
+        with read_replica():
+            history = get_portfolio_history(portfolio.id)
+        portfolio_value = portfolio.updated_value
+        starting_funds = get_starting_funds(portfolio)
+        change = round((portfolio_value/starting_funds - 1) * 100, 2)
+        profit = round(portfolio_value - starting_funds, 2)
+        update_time = utc_to_est(portfolio.updated_time).strftime('%a, %b %d. %Y %I:%M%p') + ' EST'
 
         if has_holdings:
-            holdings = get_portfolio_holdings(current_user.portfolio.id)
-            holdings_breakdown = get_holdings_breakdown(current_user.portfolio.id)
-            sector_breakdown = get_sector_breakdown(current_user.portfolio.id)
+            holdings = get_portfolio_holdings(portfolio.id)
+            holdings_breakdown = get_holdings_breakdown(portfolio.id)
+            sector_breakdown = get_sector_breakdown(portfolio.id)
 
 
         if has_transactions:
-            transactions = get_portfolio_transactions(current_user.portfolio.id)
+            transactions = get_portfolio_transactions(portfolio.id)
 
         return render_template("portfolio_sim/dashboard.html", 
                         user=current_user, 
@@ -81,7 +94,9 @@ def dashboard():
                         transactions=transactions,
                         holdings=holdings,
                         history=history,
-                        cash_available=current_user.portfolio.available_cash,
+                        cash_available=portfolio.available_cash,
+                        base_currency=portfolio.base_currency,
+                        league=portfolio.league,
                         holdings_breakdown=holdings_breakdown,
                         sector_breakdown=sector_breakdown,
                         change=change,
@@ -95,6 +110,47 @@ def dashboard():
                         active_page='dashboard')
 
 
+@portfolio_sim.route('/dashboard/history', methods=['GET'])
+@login_required
+@read_only
+def portfolio_history():
+    portfolio = get_active_portfolio(current_user.id)
+
+    if not portfolio:
+        return jsonify({'date': [], 'value': []})
+
+    try:
+        start, end = [datetime.fromisoformat(request.args[k]) if request.args.get(k) else None for k in ('start', 'end')]
+    except ValueError:
+        return jsonify({'error': 'Invalid start or end, use ISO 8601'}), 400
+
+    history = get_history_series(portfolio.id, start, end)
+
+    return jsonify({
+        'date': format_market_times(history.index, '%Y-%m-%d %H:%M'),
+        'value': [None if np.isnan(v) else v for v in history.to_numpy()]
+    })
+
+
+@portfolio_sim.route('/dashboard/ledger', methods=['GET'])
+@login_required
+@read_only
+def portfolio_ledger():
+    portfolio = get_active_portfolio(current_user.id)
+
+    if not portfolio:
+        return jsonify({'error': 'No portfolio'}), 404
+
+    at = request.args.get('at')
+
+    try:
+        at = datetime.fromisoformat(at) if at else None
+    except ValueError:
+        return jsonify({'error': f'Invalid time {at}, use ISO 8601'}), 400
+
+    return jsonify(reconstruct_portfolio(portfolio.id, at))
+
+
 @portfolio_sim.route('/rules', methods=['GET'])
 def rules():
 
@@ -106,25 +162,48 @@ def rules():
 
 @portfolio_sim.route('/buy_stock/<ticker>', methods=['GET', 'POST'])
 @login_required
-def buy_stock(ticker: str):
+@rate_limited(methods=['GET'])
+async def buy_stock(ticker: str):
+    portfolio = get_active_portfolio(current_user.id)
+
+    if not portfolio:
+        return redirect(url_for('portfolio_sim.dashboard'))
+
+    if not can_trade(portfolio):
+        flash(f'{portfolio.league.name} starts on {portfolio.league.start_date}, you can trade from then', category='error')
+        return redirect(url_for('portfolio_sim.dashboard'))
+
     if request.method == 'POST':
         ticker = request.form['ticker']
         shares = int(request.form['shares'])
-        name = request.form['name']
         price = float(request.form['price'])
         currency = request.form['currency']
-        industry = request.form['industry']
-        sector = request.form['sector']
+
+        if get_missing_rates([currency]):
+            flash(f'Cannot buy {ticker} in {currency}, please try again', category='error')
+            return redirect(url_for('portfolio_sim.dashboard'))
         
-        update_holding(current_user.portfolio.id, ticker, name, shares, price, currency, industry, sector)
-        record_transaction(current_user.portfolio.id, ticker, 'buy', name, shares, price, currency)
-        update_portfolio_cash(current_user.portfolio.id, shares*price)
+        update_holding(portfolio.id, ticker, shares, price, currency)
+        record_transaction(portfolio.id, ticker, 'buy', get_security(ticker).company_name, shares, price, currency)
+        update_portfolio_cash(portfolio.id, shares*price, currency)
 
         flash(f'Transaction complete!', category='success')
 
         return redirect(url_for('portfolio_sim.dashboard'))
 
-    info = get_stock_info(ticker)
+    # the cash lookup runs while the quote and history are fetched
+    page = await load_stock_page(ticker, history_period='1mo', while_loading=lambda: get_available_cash(portfolio.id))
+    info = page['info']
+
+    # shares can't be priced without a quote, nor valued without the stock's currency
+    if info['price'] is None or info['currency'] is None:
+        flash(f'The price of {ticker} is not available right now, please try again', category='error')
+        return redirect(url_for('portfolio_sim.dashboard'))
+
+    # a position is valued in its currency, it can't be bought without a rate
+    if get_missing_rates([info['currency'], portfolio.base_currency]):
+        flash(f"{ticker} trades in {info['currency']}, which cannot be converted right now, please try again", category='error')
+        return redirect(url_for('portfolio_sim.dashboard'))
 
     stock_info = {
         'price': info['price'],
@@ -136,21 +215,12 @@ def buy_stock(ticker: str):
         'open': info['open']
     }
 
-    performance = {
-        'Current Price': f"${info['price']}",
-        'Open Price': f"${info['open']}",
-        'Day Change': f"${info['day_change']}",
-        'Day Change (%)': f"{info['%_day_change']}%",
-        '52 Week Returns': f"{info['52_week_returns']}%",
-        '52 Week High': f"${info['52_week_high']}",
-        '52 Week Low': f"${info['52_week_low']}"
-    }
-
-    history = get_stock_history(ticker, '1mo', True)
+    # a history that timed out is loaded by the page
+    history = dumps(page['history']) if page['history'] else None
 
     est_time = get_est_time().strftime('%a, %b %d. %Y %I:%M%p') + ' EST'
-    available_cash = get_available_cash(current_user.id)
-    max_shares = int(available_cash / stock_info['price'])
+    available_cash = page['loaded']
+    max_shares = int(available_cash / convert_amount(stock_info['price'], stock_info['currency'], portfolio.base_currency))
 
     return render_template("portfolio_sim/buy.html",
                             user=current_user, 
@@ -160,13 +230,23 @@ def buy_stock(ticker: str):
                             available_cash=available_cash,
                             max_shares=max_shares,
                             history=history,
-                            performance=performance,
+                            performance=get_performance_summary(info),
                             active_page='buy')
 
 
 @portfolio_sim.route('/sell_stock/<ticker>', methods=['GET', 'POST'])
 @login_required
+@rate_limited(methods=['GET'])
 def sell_stock(ticker: str):
+    portfolio = get_active_portfolio(current_user.id)
+
+    if not portfolio:
+        return redirect(url_for('portfolio_sim.dashboard'))
+
+    if not can_trade(portfolio):
+        flash(f'{portfolio.league.name} starts on {portfolio.league.start_date}, you can trade from then', category='error')
+        return redirect(url_for('portfolio_sim.dashboard'))
+
     if request.method == 'POST':
         ticker = request.form['ticker']
         shares = int(request.form['shares'])
@@ -174,16 +254,16 @@ def sell_stock(ticker: str):
         price = float(request.form['price'])
         currency = request.form['currency']
 
-        update_holding(current_user.portfolio.id, ticker, name, -1*shares, price, currency)
-        record_transaction(current_user.portfolio.id, ticker, 'sell', name, shares, price, currency)
-        update_portfolio_cash(current_user.portfolio.id, -1*shares*price)
+        update_holding(portfolio.id, ticker, -1*shares, price, currency)
+        record_transaction(portfolio.id, ticker, 'sell', name, shares, price, currency)
+        update_portfolio_cash(portfolio.id, -1*shares*price, currency)
 
         flash(f'Transaction complete!', category='success')
 
         return redirect(url_for('portfolio_sim.dashboard'))
 
     current_price = get_current_price(ticker)
-    info = get_holding(current_user.portfolio.id, ticker)
+    info = get_holding(portfolio.id, ticker)
     details = calculate_holding_value(info['average_price'], current_price, info['shares'], info['open'])
 
     return render_template("portfolio_sim/sell.html", 
@@ -197,28 +277,30 @@ def sell_stock(ticker: str):
 
 @portfolio_sim.route('/search_stock/<ticker>', methods=['GET', 'POST'])
 @login_required
-def search_stock(ticker: str):
+@rate_limited()
+async def search_stock(ticker: str):
     if request.method == 'POST':
         if 'searchTicker' in request.form:
             ticker = request.form['searchTicker'].upper()
             og_ticker = request.form['originalTicker'].upper()
-            try:
-                ticker_info = yf.Ticker(ticker).info
-                
-                if 'currentPrice' in ticker_info:
-                    return redirect(url_for('portfolio_sim.search_stock', ticker=ticker))
-                else:
-                    flash(f'Cannot find ticker {ticker}', category='error')
-                    return redirect(url_for('portfolio_sim.search_stock', ticker=og_ticker))
-
-            except:
+
+            if is_valid_ticker(ticker):
+                return redirect(url_for('portfolio_sim.search_stock', ticker=ticker))
+            else:
                 flash(f'Cannot find ticker {ticker}', category='error')
                 return redirect(url_for('portfolio_sim.search_stock', ticker=og_ticker))
         elif 'buyTicker' in request.form:
             ticker = request.form['buyTicker']
             return redirect(url_for('portfolio_sim.buy_stock', ticker=ticker))
     
-    info = get_stock_info(ticker)
+    # cache misses are fetched with the quote, or loaded by the page from search_news if that times out
+    news = get_cached_news(ticker)
+    page = await load_stock_page(ticker, news=news is None, while_loading=lambda: record_search(ticker))
+    info = page['info']
+
+    if page['news'] is not None:
+        news = refresh_news(ticker, page['news'])
+
     stock_info = {
         'price': info['price'],
         'sector': info['sector'],
@@ -227,38 +309,96 @@ def search_stock(ticker: str):
         'currency': info['currency'],
         'company_name': info['company_name'],
     }
-    performance = {
-        'Current Price': f"${info['price']}",
-        'Open Price': f"${info['open']}",
-        'Day Change': f"${info['day_change']}",
-        'Day Change (%)': f"{info['%_day_change']}%",
-        '52 Week Returns': f"{info['52_week_returns']}%",
-        '52 Week High': f"${info['52_week_high']}",
-        '52 Week Low': f"${info['52_week_low']}"
-    }
-
-    history = get_stock_history(ticker)
-
-    news = get_ticker_news(ticker)
 
     return render_template("portfolio_sim/search.html", 
                            user=current_user, 
                            info=stock_info, 
-                           performance=performance,
+                           performance=get_performance_summary(info),
                            ticker=ticker, 
                            time=get_est_time().strftime('%a, %b %d. %Y %I:%M%p') + ' EST',
-                           history=history,
                            news=news,
                            active_page='search')
 
 
+@portfolio_sim.route('/search_stock/<ticker>/news', methods=['GET'])
+@login_required
+@rate_limited()
+def search_news(ticker: str):
+    try:
+        news = get_news(ticker)
+    except:
+        # the page shows the fragment as is, leave it without articles
+        db.session.rollback()
+        news = []
+
+    return render_template("portfolio_sim/news.html",
+                           news=news)
+
+
+@portfolio_sim.route('/watchlist', methods=['GET', 'POST'])
+@login_required
+@rate_limited(methods=['GET'])
+def watchlist():
+    if request.method == 'POST':
+        # add ticker form
+        if 'addTicker' in request.form:
+            ticker = request.form['addTicker'].upper().strip()
+
+            if not is_valid_ticker(ticker):
+                flash(f'Cannot find ticker {ticker}', category='error')
+            elif len(get_watchlist_tickers(current_user.id)) >= WATCHLIST_SIZE:
+                flash(f'Your watchlist is full, remove a stock to add {ticker}', category='error')
+            elif add_to_watchlist(current_user.id, ticker):
+                flash(f'{ticker} added to your watchlist', category='success')
+            else:
+                flash(f'{ticker} is already on your watchlist', category='error')
+        # remove ticker form
+        elif 'removeTicker' in request.form:
+            remove_from_watchlist(current_user.id, request.form['removeTicker'])
+
+        return redirect(url_for('portfolio_sim.watchlist'))
+
+    return render_template("portfolio_sim/watchlist.html",
+                           user=current_user,
+                           watchlist=get_watchlist(current_user.id),
+                           max_size=WATCHLIST_SIZE,
+                           sparkline_width=SPARKLINE_WIDTH,
+                           sparkline_height=SPARKLINE_HEIGHT,
+                           time=get_est_time().strftime('%a, %b %d. %Y %I:%M%p') + ' EST',
+                           active_page='watchlist')
+
+
+@portfolio_sim.route('/stock_history/<ticker>', methods=['GET'])
+@login_required
+@rate_limited()
+def stock_history(ticker: str):
+    period = request.args.get('period', '5y')
+    detailed = request.args.get('detailed') == '1'
+
+    if period not in HISTORY_PERIODS:
+        return jsonify({'error': f'Unknown period {period}'}), 400
+
+    # daily bars only change once a day, so the browser can reuse the payload for a while
+    return compressed_json_response(get_stock_chart(ticker.upper(), period, detailed), max_age=3600)
+
+
+@portfolio_sim.route('/autocomplete', methods=['GET'])
+@login_required
+def autocomplete():
+    prefix = request.args.get('q', '').strip()
+
+    return jsonify(symbol_directory.search(prefix, limit=10))
+
+
 @portfolio_sim.route('/leaderboard', methods=['GET'])
+@read_only
 def leaderboard():
     try:
         top_performers = get_top_performers()
         top_daily_performers = get_top_daily_performers()
         performance_history = get_performance_history()
         update_time = get_update_time()
+        market_overview = get_market_overview()
 
         return render_template("portfolio_sim/leaderboard.html",
                             user=current_user,
@@ -266,7 +406,171 @@ def leaderboard():
                             top_daily_performers=top_daily_performers,
                             performance_history=performance_history,
                             update_time=update_time,
+                            market_overview=market_overview,
+                            most_held=json.dumps(market_overview['most_held']),
+                            sectors=json.dumps(market_overview['sectors']),
                             active_page='leaderboard')
     except:
         flash(f'There is no leaderboard yet', category='error')
-        return redirect(url_for('views.home'))
\ No newline at end of file
+        return redirect(url_for('views.home'))
+
+
+@portfolio_sim.route('/leagues', methods=['GET', 'POST'])
+@login_required
+def leagues():
+    if request.method == 'POST':
+        # create league form
+        if 'createLeague' in request.form:
+            name = request.form['createLeague'].strip()
+
+            try:
+                start_date = datetime.strptime(request.form['startDate'], '%Y-%m-%d').date()
+                starting_funds = round(float(request.form['startingFunds']), 2)
+            except ValueError:
+                flash(f'Please enter a start date and starting funds', category='error')
+                return redirect(url_for('portfolio_sim.leagues'))
+
+            if not name or len(name) > LEAGUE_NAME_LENGTH:
+                flash(f'League names are 1 to {LEAGUE_NAME_LENGTH} characters long', category='error')
+            elif not math.isfinite(starting_funds) or starting_funds <= 0:
+                flash(f'Starting funds must be more than $0', category='error')
+            elif is_league_name_taken(name):
+                flash(f'There is already a league called {name}', category='error')
+            else:
+                league = create_league(name, start_date, starting_funds)
+                join_league(current_user.id, league)
+                set_active_league(league.id)
+                flash(f'{name} created!', category='success')
+
+                return redirect(url_for('portfolio_sim.dashboard'))
+        # join league form
+        elif 'joinLeague' in request.form:
+            league_id = parse_league_id(request.form['joinLeague'])
+            league = get_league(league_id) if league_id is not None else None
+
+            if league:
+                join_league(current_user.id, league)
+                set_active_league(league.id)
+                flash(f'You joined {league.name}!', category='success')
+
+                return redirect(url_for('portfolio_sim.dashboard'))
+
+            flash(f'Cannot find that league', category='error')
+        # switch game form, empty for the global game
+        elif 'playLeague' in request.form:
+            league_id = parse_league_id(request.form['playLeague'])
+
+            if request.form['playLeague'] and league_id is None:
+                flash(f'Cannot find that league', category='error')
+            else:
+                set_active_league(league_id)
+
+                return redirect(url_for('portfolio_sim.dashboard'))
+
+        return redirect(url_for('portfolio_sim.leagues'))
+
+    active_portfolio = get_active_portfolio(current_user.id)
+
+    return render_template("portfolio_sim/leagues.html",
+                           user=current_user,
+                           leagues=get_leagues(),
+                           joined={p.league_id for p in current_user.portfolios},
+                           active_league_id=active_portfolio.league_id if active_portfolio else None,
+                           today=get_est_time().date(),
+                           starting_funds=STARTING_FUNDS,
+                           active_page='leagues')
+
+
+@portfolio_sim.route('/leagues/<int:league_id>', methods=['GET'])
+@read_only
+def league_leaderboard(league_id: int):
+    league = get_league(league_id)
+
+    if not league:
+        flash(f'Cannot find that league', category='error')
+        return redirect(url_for('portfolio_sim.leaderboard'))
+
+    return render_template("portfolio_sim/league.html",
+                           user=current_user,
+                           league=league,
+                           performers=get_league_performers(league_id),
+                           time=get_est_time().strftime('%a, %b %d. %Y %I:%M%p') + ' EST',
+                           active_page='leagues')
+
+
+# commands
+@portfolio_sim.cli.command('load-symbols')
+@click.argument('csv_path')
+def load_symbols_command(csv_path):
+    '''Loads the ticker symbol directory from CSV_PATH (ticker, name, exchange, sector)'''
+    count = load_symbols_csv(csv_path)
+
+    click.echo(f'{count} symbols loaded')
+
+
+@portfolio_sim.cli.command('export-snapshot')
+@click.argument('export_dir')
+@click.option('--format', 'file_format', type=click.Choice(FORMATS), default='parquet', help='File format of the partitions')
+@click.option('--chunk-size', default=EXPORT_CHUNK_SIZE, help='Rows read per query')
+def export_snapshot_command(export_dir, file_format, chunk_size):
+    '''Exports history and transactions incrementally, and portfolios, securities, quotes and holdings in full, to date partitioned files in EXPORT_DIR'''
+    try:
+        counts = export_snapshot(export_dir, file_format, chunk_size)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+    click.echo(', '.join(f'{count} {name}' for name, count in counts.items()) + ' rows exported')
+
+
+@portfolio_sim.cli.command('load-snapshot')
+@click.argument('export_dir')
+@click.argument('sqlite_path')
+def load_snapshot_command(export_dir, sqlite_path):
+    '''Rebuilds the portfolios, securities, quotes, holdings, transactions and history of the SQLite database SQLITE_PATH from the snapshot in EXPORT_DIR'''
+    try:
+        counts = load_snapshot(export_dir, sqlite_path)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+    click.echo(', '.join(f'{count} {name}' for name, count in counts.items()) + ' rows loaded')
+
+
+@portfolio_sim.cli.command('maintain-history')
+def maintain_history_command():
+    '''Creates upcoming history partitions and drops the ones past HISTORY_RETENTION_MONTHS'''
+    from .scheduler_functions import maintain_history
+
+    result = maintain_history()
+
+    click.echo(f"created: {', '.join(result['created']) or 'none'}, dropped: {', '.join(result['dropped']) or 'none'}")
+
+
+@portfolio_sim.cli.command('checkpoint-ledger')
+def checkpoint_ledger_command():
+    '''Saves ledger checkpoints for the transactions added since the last checkpoints'''
+    click.echo(f'{save_checkpoints()} checkpoints saved')
+
+
+@portfolio_sim.cli.command('verify-ledger')
+def verify_ledger_command():
+    '''Checks that the holdings and cash of every portfolio agree with its transactions'''
+    mismatches = verify_ledger()
+
+    for m in mismatches:
+        click.echo(f"portfolio {m['portfolio_id']} {m['field']}: stored {m['stored']}, ledger {m['ledger']}")
+
+    if mismatches:
+        raise click.ClickException(f'{len(mismatches)} mismatches found')
+
+    click.echo('Holdings and cash agree with the ledger')
+
+
+@portfolio_sim.cli.command('rebuild-aggregates')
+def rebuild_aggregates_command():
+    '''Rebuilds the market wide ticker and sector aggregates from the holdings and lists what had drifted'''
+    mismatches = rebuild_aggregates()
+
+    for m in mismatches:
+        click.echo(f"{m['aggregate']} {m['field']}: stored {m['stored']}, rebuilt {m['rebuilt']}")
+
+    click.echo(f'Aggregates rebuilt, {len(mismatches)} mismatches found')
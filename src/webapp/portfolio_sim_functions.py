@@ -1,22 +1,47 @@
+from __future__ import annotations
+
 import json
-from datetime import datetime
-import pytz
-import pandas as pd
-import yfinance as yf
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import func
 
 from . import db
-from .data_models import Portfolio, Holdings, Transactions, History
+from .lazy import lazy_import
+from .data_models import Portfolio, Holdings, Transactions, Security, Quote
+from .symbol_directory import symbol_directory
+from .market_calendar import MARKET_TIMEZONE, is_market_open, get_last_close, get_session_ticks, to_market_times, format_market_times, to_epoch_seconds
+from .fx import convert, convert_amount, get_missing_rates
+from .single_flight import single_flight
+from .fan_out import FanOut
+from .aggregates import apply_trade
+from .chart_payload import encode_chart, dumps
+from .history_store import add_records, get_records, get_last_records
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+yf = lazy_import('yfinance')
 
 STARTING_FUNDS = 10000.00
+# how long static company data is trusted before it is fetched again
+SECURITY_TTL = timedelta(days=7)
+# how long a quote is reused while the market is open
+QUOTE_TTL = timedelta(minutes=1)
+# seconds the async stock pages wait for each upstream call before rendering without it
+UPSTREAM_TIMEOUTS = {
+    'security': 4,
+    'quote': 3,
+    'history': 4,
+    'news': 2
+}
+
+# latest quote of each ticker, keyed by ticker
+quote_cache = {}
 
 def get_est_time() -> datetime:
     '''Gets the current time in EST
         returns:
             datetime - current time in EST
     '''
-    est = pytz.timezone('US/Eastern')
-
-    return datetime.now(est)
+    return datetime.now(MARKET_TIMEZONE)
 
 
 def utc_to_est(utc_time: datetime) -> datetime:
@@ -26,69 +51,344 @@ def utc_to_est(utc_time: datetime) -> datetime:
         returns:
             datetime - EST time
     '''
-    est = pytz.timezone('US/Eastern')
+    return utc_time.astimezone(MARKET_TIMEZONE)
 
-    return utc_time.astimezone(est)
 
-
-def create_portfolio(user_id: int) -> None:
+def create_portfolio(user_id: int, league=None) -> Portfolio:
     '''Create a portfolio for a user
         args:
             user_id: int - database id of the user
+            league: League - league the portfolio plays in, the global game if None
+        returns:
+            Portfolio - new portfolio
     '''
+    starting_funds = league.starting_funds if league else STARTING_FUNDS
+
     portfolio = Portfolio(user_id=user_id, 
-                          available_cash=STARTING_FUNDS,
+                          league_id=league.id if league else None,
+                          available_cash=starting_funds,
                           creation_date=datetime.today().date(), 
-                          updated_value=STARTING_FUNDS, 
+                          updated_value=starting_funds, 
                           updated_time=get_est_time(), 
-                          last_close_value=STARTING_FUNDS)
+                          last_close_value=starting_funds,
+                          base_currency=league.base_currency if league else 'USD')
 
     db.session.add(portfolio)
     db.session.commit()
 
-    history = History(portfolio_id=portfolio.id, 
-                      record_time=get_est_time(), 
-                      portfolio_value=STARTING_FUNDS)
-    
-    db.session.add(history)
+    add_records([{'portfolio_id': portfolio.id,
+                  'record_time': get_est_time(),
+                  'portfolio_value': starting_funds}])
     db.session.commit()
 
+    return portfolio
+
+
+def get_portfolio(user_id: int, league_id=None) -> Portfolio:
+    '''Gets a user's portfolio in a league
+        args:
+            user_id: int - database id of the user
+            league_id: int - database id of the league, the global game if None
+        returns:
+            Portfolio - the portfolio, None if the user doesn't play in the league
+    '''
+    return Portfolio.query.filter_by(user_id=user_id, league_id=league_id).first()
+
+
+def get_starting_funds(portfolio: Portfolio) -> float:
+    '''Gets the cash a portfolio started with, its league's or the global game's
+    '''
+    return portfolio.league.starting_funds if portfolio.league else STARTING_FUNDS
+
+
+def get_portfolio_start(portfolio: Portfolio) -> date:
+    '''Gets the date a portfolio started playing, league portfolios wait for the league to start
+    '''
+    if portfolio.league:
+        return max(portfolio.creation_date, portfolio.league.start_date)
+
+    return portfolio.creation_date
+
+
+def can_trade(portfolio: Portfolio) -> bool:
+    '''Checks that a portfolio's game has started
+        args:
+            portfolio: Portfolio - portfolio trading
+        returns:
+            bool - True if the portfolio can buy and sell
+    '''
+    return portfolio.league is None or portfolio.league.start_date <= get_est_time().date()
+
+
+def is_valid_ticker(ticker: str) -> bool:
+    '''Checks that a ticker can be traded.
+    Uses the local symbol directory, only asks yfinance when no directory has been loaded
+        args:
+            ticker: str - stock ticker
+        returns:
+            bool - True if the ticker exists
+    '''
+    if len(symbol_directory) > 0:
+        return ticker in symbol_directory
+
+    try:
+        return 'currentPrice' in fetch_stock_info(ticker)
+    except:
+        return False
+
+
+def is_stale(updated_time: datetime, ttl: timedelta) -> bool:
+    '''Checks if a cached record is older than its time to live
+        args:
+            updated_time: datetime - time the record was cached, naive times are UTC
+            ttl: timedelta - time to live of the record
+        returns:
+            bool - True if the record should be refreshed
+    '''
+    if updated_time.tzinfo is None:
+        updated_time = updated_time.replace(tzinfo=timezone.utc)
+
+    return datetime.now(timezone.utc) - updated_time > ttl
+
+
+@single_flight
+def fetch_stock_info(ticker: str) -> dict:
+    '''Fetches the full stock information from yfinance
+        args:
+            ticker: str - stock ticker
+        returns:
+            dict - yfinance info of the stock
+    '''
+    return yf.Ticker(ticker).info
+
+
+def refresh_security(ticker: str, stock_info=None) -> Security:
+    '''Fetches the static company data of a stock from yfinance and saves it.
+    Does not commit the session
+        args:
+            ticker: str - stock ticker
+            stock_info: dict - yfinance info already fetched, fetched here if None
+        returns:
+            Security - updated security
+    '''
+    stock_info = stock_info or fetch_stock_info(ticker)
+    security = db.session.get(Security, ticker) or Security(ticker=ticker)
+
+    security.company_name = stock_info.get('longName', 'n/a')
+    security.industry = stock_info.get('industry', 'n/a')
+    security.sector = stock_info.get('sector', 'n/a')
+    security.currency = stock_info.get('currency', 'n/a')
+    security.company_summary = stock_info.get('longBusinessSummary', 'n/a')
+    security.updated_time = datetime.now(timezone.utc)
+
+    db.session.add(security)
+
+    return security
+
+
+def get_security(ticker: str) -> Security:
+    '''Gets the static company data of a stock, only fetching it when not cached or stale
+        args:
+            ticker: str - stock ticker
+        returns:
+            Security - company name, sector, industry, currency and summary
+    '''
+    security = db.session.get(Security, ticker)
+
+    if security is None:
+        security = refresh_security(ticker)
+        db.session.commit()
+    elif is_stale(security.updated_time, SECURITY_TTL):
+        try:
+            refresh_security(ticker)
+            db.session.commit()
+        except:
+            # keep serving the stale copy
+            db.session.rollback()
+
+    return security
+
+
+def is_quote_fresh(fetched_time: datetime) -> bool:
+    '''Checks if a price fetched at some time can still be shown.
+    While the market is closed prices cannot move, so a price fetched after the last close stays fresh
+        args:
+            fetched_time: datetime - time the price was fetched, naive times are UTC
+        returns:
+            bool - True if the price doesn't have to be fetched again
+    '''
+    if is_market_open():
+        return not is_stale(fetched_time, QUOTE_TTL)
+
+    if fetched_time.tzinfo is None:
+        fetched_time = fetched_time.replace(tzinfo=timezone.utc)
+
+    return fetched_time >= get_last_close()
+
+
+def get_quote(ticker: str) -> dict:
+    '''Gets the volatile price data of a stock.
+    While the market is closed prices cannot move, so a quote fetched after the last close is reused
+        args:
+            ticker: str - stock ticker
+        returns:
+            dict - current, open and previous close prices and 52 week range
+    '''
+    cached = quote_cache.get(ticker)
+
+    if cached and is_quote_fresh(cached['fetched_time']):
+        return cached['quote']
+
+    quote = fetch_quote(ticker)
+
+    quote_cache[ticker] = {
+        'fetched_time': datetime.now(timezone.utc),
+        'quote': quote
+    }
+
+    return quote
+
+
+@single_flight
+def fetch_quote(ticker: str) -> dict:
+    '''Fetches the volatile price data of a stock from yfinance
+        args:
+            ticker: str - stock ticker
+        returns:
+            dict - current, open and previous close prices and 52 week range
+    '''
+    quote = yf.Ticker(ticker).fast_info
+
+    return {
+        'price': quote.last_price,
+        'open': quote.open,
+        'previous_close': quote.previous_close,
+        '52_week_change': quote.year_change,
+        '52_week_high': quote.year_high,
+        '52_week_low': quote.year_low
+    }
+
+
+def needs_refresh(security: Security) -> bool:
+    '''Checks if the static company data of a stock has to be fetched
+    '''
+    return security is None or is_stale(security.updated_time, SECURITY_TTL)
+
+
+def build_stock_info(security: Security, quote: dict) -> dict:
+    '''Combines the static company data and the quote of a stock
+        args:
+            security: Security - company data, None if it could not be fetched
+            quote: dict - price data, None if it could not be fetched
+        returns:
+            dict - stock information, missing values are None
+    '''
+    info = {
+        'sector': security.sector if security else 'n/a',
+        'industry': security.industry if security else 'n/a',
+        'company_summary': security.company_summary if security else 'n/a',
+        # None rather than 'n/a', a position can't be bought in an unknown currency
+        'currency': security.currency if security else None,
+        'company_name': security.company_name if security else 'n/a'
+    }
+
+    if quote is None:
+        return {**info, **{key: None for key in ['price', 'open', 'day_change', '%_day_change', '52_week_returns', '52_week_high', '52_week_low']}}
+
+    price = float(quote['price'] or 0)
+    open_price = float(quote['open'] or 1)
+
+    return {
+        **info,
+        'price': round(price, 2),
+        'open': round(open_price, 2),
+        'day_change': round(price - open_price, 2),
+        '%_day_change': round((price/open_price - 1)*100, 2),
+        '52_week_returns': round(float(quote['52_week_change'] or 0)*100, 2),
+        '52_week_high': round(float(quote['52_week_high'] or 0), 2),
+        '52_week_low': round(float(quote['52_week_low'] or 0), 2)
+    }
+
 
 def get_stock_info(ticker: str) -> dict:
-    '''Gets custom stock information from yfinance
+    '''Gets custom stock information, static data is served from the security cache
         args:
             ticker: str - stock ticker
         returns:
             dict - stock information
     '''
-    stock_info = yf.Ticker(ticker).info
+    return build_stock_info(get_security(ticker), get_quote(ticker))
+
+
+def get_performance_summary(info: dict) -> dict:
+    '''Gets the performance table of a stock page
+        args:
+            info: dict - stock information
+        returns:
+            dict - formatted values by column, n/a when the quote is missing
+    '''
+    def fmt(key, prefix='', suffix=''):
+        return 'n/a' if info[key] is None else f'{prefix}{info[key]}{suffix}'
 
     return {
-        'price': round(float(stock_info.get('currentPrice', 0)), 2),
-        'sector': stock_info.get('sector', 'n/a'),
-        'industry': stock_info.get('industry', 'n/a'),
-        'company_summary': stock_info.get('longBusinessSummary', 'n/a'),
-        'currency': stock_info.get('currency', 'n/a'),
-        'company_name': stock_info.get('longName', 'n/a'),
-        'open': stock_info.get('open', 'n/a'),
-        'day_change': round(float(stock_info.get('currentPrice', 0))-float(stock_info.get('open', 1)), 2),
-        '%_day_change': round((float(stock_info.get('currentPrice', 0))/float(stock_info.get('open', 1)) - 1)*100, 2),
-        '52_week_returns': round(float(stock_info.get('52WeekChange', 0))*100, 2),
-        '52_week_high': round(float(stock_info.get('fiftyTwoWeekHigh', 0)), 2),
-        '52_week_low': round(float(stock_info.get('fiftyTwoWeekLow', 0)), 2)
+        'Current Price': fmt('price', '$'),
+        'Open Price': fmt('open', '$'),
+        'Day Change': fmt('day_change', '$'),
+        'Day Change (%)': fmt('%_day_change', suffix='%'),
+        '52 Week Returns': fmt('52_week_returns', suffix='%'),
+        '52 Week High': fmt('52_week_high', '$'),
+        '52 Week Low': fmt('52_week_low', '$')
     }
 
 
-def get_available_cash(user_id: int) -> float:
-    '''Gets the available cash in a users portfolio. Assumes portfolio exists
+async def load_stock_page(ticker: str, history_period=None, news=False, while_loading=None) -> dict:
+    '''Fetches the upstream data of a stock page concurrently, each call with its own timeout
+    (UPSTREAM_TIMEOUTS). The page waits as long as the slowest call instead of all of them in turn.
+    Database reads and writes stay in the request, only yfinance runs in the threads
         args:
-            user_id: int - database id of the user
+            ticker: str - stock ticker
+            history_period: str - period of the detailed price history to fetch, no history if None
+            news: bool - whether to fetch the news articles
+            while_loading: callable - database work to run while the calls are in flight
         returns:
-            float - available cash
+            dict - info, history (chart payload), news (articles) and the result of while_loading.
+                   history and news are None when they timed out or were not asked for
     '''
-    portfolio = Portfolio.query.filter_by(user_id=user_id).first()
+    security = db.session.get(Security, ticker)
+    calls = {'quote': lambda: get_quote(ticker)}
+
+    if needs_refresh(security):
+        calls['security'] = lambda: fetch_stock_info(ticker)
+    if history_period:
+        calls['history'] = lambda: get_stock_chart(ticker, history_period, True)
+    if news:
+        calls['news'] = lambda: get_ticker_news(ticker)
+
+    fan_out = FanOut(calls, UPSTREAM_TIMEOUTS)
+
+    loaded = while_loading() if while_loading else None
+    results = await fan_out.results()
+
+    if results.get('security'):
+        security = refresh_security(ticker, results['security'])
+        db.session.commit()
+
+    return {
+        'info': build_stock_info(security, results['quote']),
+        'history': results.get('history'),
+        'news': results.get('news'),
+        'loaded': loaded
+    }
 
-    return portfolio.available_cash
+
+def get_available_cash(portfolio_id: int) -> float:
+    '''Gets the available cash in a portfolio
+        args:
+            portfolio_id: int - database id of the portfolio
+        returns:
+            float - available cash
+    '''
+    return db.session.get(Portfolio, portfolio_id).available_cash
 
 
 def record_transaction(portfolio_id: int, ticker: str, status: str, name: str, shares: int, price: float, currency: str) -> None:
@@ -102,6 +402,8 @@ def record_transaction(portfolio_id: int, ticker: str, status: str, name: str, s
             price: float - price per share
             currency: str - currency of the transaction
     '''
+    base_currency = db.session.get(Portfolio, portfolio_id).base_currency
+
     transaction = Transactions(portfolio_id=portfolio_id,
                                transaction_date=get_est_time(), 
                                status=status, 
@@ -110,67 +412,81 @@ def record_transaction(portfolio_id: int, ticker: str, status: str, name: str, s
                                currency=currency, 
                                number_of_shares=shares, 
                                price_per_share=round(price, 2), 
-                               total_value=round(shares*price, 2))
+                               total_value=round(shares*price, 2),
+                               fx_rate=convert_amount(1, currency, base_currency))
 
     db.session.add(transaction)
     db.session.commit()
 
 
-def update_holding(portfolio_id: int, ticker: str, name: str, shares: int, price: float, currency: str, industry="Unknown", sector="Unknown") -> None:
+def update_holding(portfolio_id: int, ticker: str, shares: int, price: float, currency: str) -> None:
     '''Updates a stock holding in a portfolio after a transaction
         If its a sell transaction (shares<0), assumes that the holding exists
         args:
             portfolio_id: int - database id of the portfolio
             ticker: str - stock ticker
-            name: str - stock name
             shares: int - number of shares
             price: float - price per share
             currency: str - currency of the stock
-            industry: str - industry of the company
     '''
     holding = Holdings.query.filter_by(portfolio_id=portfolio_id, ticker=ticker).first()
+    # the position's currency, a new position takes the trade's
+    position_currency = holding.currency if holding else currency
 
     # sell transaction
     if shares < 0:
         if holding.number_of_shares == -1*shares:
             db.session.delete(holding)
+            apply_trade(ticker, shares, position_currency, -1)
         else: 
             holding.number_of_shares += shares
+            apply_trade(ticker, shares, position_currency, 0)
     # buy transaction
     else:
         # holding already exists in portfolio
         if holding:
             holding.average_price = round((holding.average_price*holding.number_of_shares + price*shares) / (holding.number_of_shares + shares), 2)
             holding.number_of_shares += shares
-            holding.updated_price = round(price, 2)
+            apply_trade(ticker, shares, position_currency, 0)
             
         # holding is new to portfolio
         else:
+            # make sure the company data and a price are cached
+            get_security(ticker)
+
+            if db.session.get(Quote, ticker) is None:
+                db.session.add(Quote(ticker=ticker,
+                                     last_price=round(price, 2),
+                                     open_price=round(price, 2),
+                                     previous_close=round(price, 2),
+                                     updated_time=get_est_time()))
+
             holding = Holdings(portfolio_id=portfolio_id, 
-                               company_name=name, 
                                ticker=ticker, 
                                number_of_shares=shares, 
                                average_price=round(price, 2), 
-                               updated_price=round(price, 2),
-                               currency=currency, 
-                               opening_price=round(price, 2),
-                               industry=industry,
-                               sector=sector)
+                               currency=currency)
 
             db.session.add(holding)
+            apply_trade(ticker, shares, position_currency, 1)
     
+    # the market wide aggregates commit with the holding
     db.session.commit()
 
 
-def update_portfolio_cash(portfolio_id: int, transaction_cost: float) -> None:
+def update_portfolio_cash(portfolio_id: int, transaction_cost: float, currency=None) -> None:
     '''Updates the available cash for a portfolio 
     (subtracts the transaction cost from the available cash)
         args:
             portfolio_id: int - database id of the portfolio
             transaction_cost: float - total value of the transaction
+            currency: str - currency of the transaction, defaults to the portfolio's base currency
     '''
     portfolio = Portfolio.query.filter_by(id=portfolio_id).first()
 
+    if currency:
+        transaction_cost = convert_amount(transaction_cost, currency, portfolio.base_currency)
+
     portfolio.available_cash = round(portfolio.available_cash - transaction_cost, 2)
 
     db.session.commit()
@@ -184,10 +500,11 @@ def get_portfolio_transactions(portfolio_id: int) -> str:
             str - json string of transaction history of a portfolio
     '''
     transactions = Transactions.query.filter_by(portfolio_id=portfolio_id).all()
+    dates = format_market_times([t.transaction_date for t in transactions], '%H:%M:%S %m-%d-%Y')
 
     transaction_history = []
 
-    for transaction in transactions:
+    for transaction, date in zip(transactions, dates):
         transaction_history.append({
             'Ticker': transaction.ticker,
             'Company Name': transaction.company_name,
@@ -196,7 +513,7 @@ def get_portfolio_transactions(portfolio_id: int) -> str:
             'Share Price': transaction.price_per_share,
             'Total Value': transaction.total_value,
             'Currency': transaction.currency,
-            'Date (EST)': utc_to_est(transaction.transaction_date).strftime('%H:%M:%S %m-%d-%Y')
+            'Date (EST)': date
         })
 
     return json.dumps(transaction_history)
@@ -208,9 +525,17 @@ def get_portfolio_holdings(portfolio_id: int) -> str:
         returns:
             str - json string of all holdings in a portfolio
     '''
-    holdings = Holdings.query.filter_by(portfolio_id=portfolio_id).all()
-
-    df = pd.DataFrame([h.__dict__ for h in holdings])
+    holdings = db.session.query(Holdings.ticker,
+                                Holdings.number_of_shares,
+                                Holdings.average_price,
+                                Holdings.currency,
+                                Quote.last_price.label('updated_price'),
+                                Quote.open_price.label('opening_price'))\
+                         .join(Quote, Quote.ticker == Holdings.ticker)\
+                         .filter(Holdings.portfolio_id == portfolio_id)\
+                         .all()
+
+    df = pd.DataFrame([h._asdict() for h in holdings])
 
     df['Day Change'] = round((df['updated_price'] - df['opening_price']), 2)
     df['Total Day Change'] = round((df['Day Change'] * df['number_of_shares']), 2)
@@ -220,8 +545,12 @@ def get_portfolio_holdings(portfolio_id: int) -> str:
     df['Change (%)'] = round((df['Change'] / df['average_price']) * 100, 2)
     df['Market Value'] = round((df['updated_price'] * df['number_of_shares']), 2)
 
+    base_currency = db.session.get(Portfolio, portfolio_id).base_currency
+    base_value = f'Market Value ({base_currency})'
+    df[base_value] = convert(df['Market Value'], df['currency'], base_currency, skip_unknown=True).round(2)
+
     # rearrange and rename columns
-    df = df[['ticker', 'number_of_shares', 'average_price', 'updated_price', 'Day Change', 'Day Change (%)', 'Total Change', 'Change (%)', 'Market Value', 'currency']]
+    df = df[['ticker', 'number_of_shares', 'average_price', 'updated_price', 'Day Change', 'Day Change (%)', 'Total Change', 'Change (%)', 'Market Value', 'currency', base_value]]
     df = df.rename(columns={'ticker': 'Ticker',
                             'number_of_shares': 'Shares Owned',
                             'average_price': 'Average Price',
@@ -231,21 +560,89 @@ def get_portfolio_holdings(portfolio_id: int) -> str:
     return df.to_json(orient='records')
 
 
+def to_utc(time: datetime) -> datetime:
+    '''Makes a database time timezone aware
+        args:
+            time: datetime - time read from the database, naive times are UTC
+        returns:
+            datetime - UTC time
+    '''
+    if time.tzinfo is None:
+        return time.replace(tzinfo=timezone.utc)
+
+    return time.astimezone(timezone.utc)
+
+
+def get_history_grid(times: np.ndarray, end=None) -> np.ndarray:
+    '''Gets the times a dense history would have been recorded at:
+    every scheduler tick since the first record plus the records themselves
+        args:
+            times: np.ndarray - sorted record times in epoch seconds
+            end: datetime - last grid time, defaults to now
+        returns:
+            np.ndarray - sorted grid times in epoch seconds
+    '''
+    if not len(times):
+        return np.zeros(0)
+
+    start = datetime.fromtimestamp(times[0], timezone.utc)
+    ticks = to_epoch_seconds(get_session_ticks(start, end or get_est_time()))
+
+    return np.union1d(times, ticks)
+
+
+def fill_history(times: np.ndarray, values: list, grid: np.ndarray) -> list:
+    '''Rebuilds a step series from history records.
+    History is only recorded when a value changes, so each grid time takes the last recorded value
+        args:
+            times: np.ndarray - sorted record times in epoch seconds
+            values: list - recorded values
+            grid: np.ndarray - sorted times to fill in epoch seconds
+        returns:
+            list - value at each grid time, None before the first record
+    '''
+    positions = np.searchsorted(times, grid, side='right') - 1
+
+    return [values[p] if p >= 0 else None for p in positions]
+
+
+def get_history_series(portfolio_id: int, start=None, end=None) -> pd.Series:
+    '''Gets the dense history of a portfolio, already converted to market time.
+    A time range only reads the history partitions of those months
+        args:
+            portfolio_id: int - database id of the portfolio
+            start: datetime - first time of the series, naive times are UTC
+            end: datetime - last time of the series, naive times are UTC
+        returns:
+            pd.Series - portfolio value indexed by US/Eastern time
+    '''
+    history = get_records([portfolio_id], start, end)
+    times = to_epoch_seconds([h.record_time for h in history])
+    values = [h.portfolio_value for h in history]
+
+    # the value at the start of the range is the last one recorded before it
+    previous = get_last_records([portfolio_id], before=start).get(portfolio_id) if start else None
+
+    if previous is not None:
+        times = np.concatenate([to_epoch_seconds([start]), times])
+        values = [previous.portfolio_value] + values
+
+    grid = get_history_grid(times, end)
+    values = fill_history(times, values, grid)
+
+    return pd.Series(values, index=to_market_times(pd.to_datetime(grid, unit='s', utc=True)), dtype=float)
+
+
 def get_portfolio_history(portfolio_id: int) -> str:
-    '''Gets the history of a portfolio and parses data into a json string
+    '''Gets the history of a portfolio as a compact chart payload
         args:
             portfolio_id: int - database id of the portfolio
         returns:
             str - json string of the history of a portfolio
     '''
-    history = History.query.filter_by(portfolio_id=portfolio_id).all()
-
-    portfolio_history = {
-        'date': [utc_to_est(h.record_time).strftime('%Y-%m-%d %H:%M') for h in history],
-        'value': [h.portfolio_value for h in history]
-    }
+    history = get_history_series(portfolio_id)
 
-    return json.dumps(portfolio_history)
+    return dumps(encode_chart(to_epoch_seconds(history.index), {'value': history.to_numpy()}))
 
 
 def get_holding(portfolio_id: int, ticker: str) -> dict:
@@ -260,12 +657,12 @@ def get_holding(portfolio_id: int, ticker: str) -> dict:
 
     return {
         'ticker': holding.ticker,
-        'name': holding.company_name,
+        'name': holding.security.company_name,
         'shares': holding.number_of_shares,
         'average_price': holding.average_price,
-        'updated_price': holding.updated_price,
+        'updated_price': holding.quote.last_price,
         'currency': holding.currency,
-        'open': holding.opening_price
+        'open': holding.quote.open_price
     }
 
 
@@ -276,7 +673,7 @@ def get_current_price(ticker: str) -> float:
         returns:
             float - current price of the stock
     '''
-    return yf.Ticker(ticker).info.get('currentPrice', 'n/a')
+    return get_quote(ticker)['price']
 
 
 def calculate_holding_value(average_price: float, current_price: float, shares: int, open: float) -> dict:
@@ -303,54 +700,66 @@ def calculate_holding_value(average_price: float, current_price: float, shares:
     }
 
 
-def get_stock_history(ticker: str, period='5y', detailed=False) -> str:
-    '''Gets the historical price of a stock
+@single_flight
+def get_stock_chart(ticker: str, period='5y', detailed=False) -> dict:
+    '''Gets the historical daily prices of a stock as a compact chart payload
         args:
             ticker: str - stock ticker
             period: str - time period for the historical data
             detailed: bool - whether to included detailed data: open, high, low, close
         returns:
-            str - json string of the historical price of a stock
+            dict - chart payload of the historical price of a stock
     '''
     stock = yf.Ticker(ticker).history(period=period).dropna()
+    # daily bars are labelled by their market date, stored as midnight UTC
+    dates = stock.index.tz_localize(None).normalize() if stock.index.tz is not None else stock.index.normalize()
+    times = (dates - pd.Timestamp('1970-01-01')) // pd.Timedelta(seconds=1)
 
     if detailed:
-        history = {
-            'date': [d.strftime('%Y-%m-%d') for d in stock.index],
-            'close': [p for p in round(stock['Close'], 2)],
-            'open': [p for p in round(stock['Open'], 2)],
-            'high': [p for p in round(stock['High'], 2)],
-            'low': [p for p in round(stock['Low'], 2)]
-        }
+        series = {column.lower(): stock[column].to_numpy() for column in ['Close', 'Open', 'High', 'Low']}
     else:
-        history = {
-            'date': [d.strftime('%Y-%m-%d') for d in stock.index],
-            'price': [p for p in round(stock['Close'], 2)]
-        }
+        series = {'price': stock['Close'].to_numpy()}
 
-    return json.dumps(history)
+    return encode_chart(times.to_numpy(), series, unit=86400, tz='UTC')
 
 
-def get_top_performers() -> str:
-    '''Gets the top performing portfolios ordered
+def get_stock_history(ticker: str, period='5y', detailed=False) -> str:
+    '''Gets the historical price of a stock
+        args:
+            ticker: str - stock ticker
+            period: str - time period for the historical data
+            detailed: bool - whether to included detailed data: open, high, low, close
         returns:
-            str - json string of top performing portfolios
+            str - json string of the historical price of a stock
     '''
-    portfolios = Portfolio.query.all()
-    ranked_portfolios = sorted(portfolios, key=lambda p: p.updated_value, reverse=True)
+    return dumps(get_stock_chart(ticker, period, detailed))
+
 
+def rank_performers(ranked_portfolios: list, ranked_values=None) -> list:
+    '''Ranks portfolios already ordered by value, a portfolio tied with the one above it is ranked '-'
+        args:
+            ranked_portfolios: list - portfolios, highest value first
+            ranked_values: list - values the portfolios were ordered on, their updated values if None
+        returns:
+            list - rank, value and performance of each portfolio
+    '''
     top_performers = []
     count = 0
     prev = None
+    today = get_est_time().date()
 
-    for portfolio in ranked_portfolios:
+    if ranked_values is None:
+        ranked_values = [p.updated_value for p in ranked_portfolios]
+
+    for portfolio, ranked_value in zip(ranked_portfolios, ranked_values):
         count += 1
         updated_val = portfolio.updated_value
-        portfolio_change =  round((updated_val/STARTING_FUNDS - 1) * 100, 2)
-        portfolio_age = (get_est_time().date() - portfolio.creation_date).days
+        portfolio_change =  round((updated_val/get_starting_funds(portfolio) - 1) * 100, 2)
+        # a league that hasn't started yet has age 0
+        portfolio_age = max((today - get_portfolio_start(portfolio)).days, 0)
 
         rank = count
-        if updated_val == prev:
+        if ranked_value == prev:
             rank = '-'
         
         if portfolio_age == 0:
@@ -367,18 +776,31 @@ def get_top_performers() -> str:
             'Daily Change (%)': daily_change
         })
 
-        prev = updated_val
+        prev = ranked_value
 
+    return top_performers
 
-    return json.dumps(top_performers)
+
+def get_top_performers() -> str:
+    '''Gets the top performing portfolios of the global game ordered
+        returns:
+            str - json string of top performing portfolios
+    '''
+    portfolios = Portfolio.query.filter_by(league_id=None).all()
+    # rank on a common currency
+    usd_values = convert([p.updated_value for p in portfolios], [p.base_currency for p in portfolios], 'USD')
+    ranked = sorted(zip(usd_values, portfolios), key=lambda v: v[0], reverse=True)
+
+    # ties are equal values in USD too
+    return json.dumps(rank_performers([p for _, p in ranked], [v for v, _ in ranked]))
 
 
 def get_top_daily_performers() -> str:
-    '''Gets the top daily performers ordered
+    '''Gets the top daily performers of the global game ordered
         returns:
             str - json string of top daily performers
     '''
-    portfolios = Portfolio.query.all()
+    portfolios = Portfolio.query.filter_by(league_id=None).all()
     ranked_portfolios = sorted(portfolios, key=lambda p: (p.updated_value / p.last_close_value), reverse=True)
 
     top_performers = []
@@ -410,21 +832,31 @@ def get_top_daily_performers() -> str:
 
 
 def get_performance_history() -> str:
-    '''Gets the performance history of all portfolios
+    '''Gets the performance history of the global game's portfolios on a shared time grid as a compact chart payload
         returns:
-            str - json string of the performance history of all portfolios
+            str - json string of the performance history of the portfolios
     '''
-    portfolios = Portfolio.query.all()
-    history = []
+    portfolios = Portfolio.query.filter_by(league_id=None).all()
+    history = {}
+
+    for record in get_records([p.id for p in portfolios]):
+        history.setdefault(record.portfolio_id, []).append(record)
+
+    records = {}
 
     for portfolio in portfolios:
-        history.append({
-            'x': [utc_to_est(h.record_time).strftime('%Y-%m-%d %H:%M') for h in portfolio.history],
-            'y': [h.portfolio_value for h in portfolio.history],
-            'name': portfolio.user.username
-        })
+        portfolio_history = history.get(portfolio.id, [])
+        records[portfolio.id] = (to_epoch_seconds([h.record_time for h in portfolio_history]), [h.portfolio_value for h in portfolio_history])
 
-    return json.dumps(history)
+    all_times = np.unique(np.concatenate([times for times, _ in records.values()] or [np.zeros(0)]))
+    grid = get_history_grid(all_times)
+    series = {}
+
+    for portfolio in portfolios:
+        times, values = records[portfolio.id]
+        series[portfolio.user.username] = fill_history(times, values, grid)
+
+    return dumps(encode_chart(grid, series))
 
 
 def get_update_time() -> str:
@@ -432,9 +864,11 @@ def get_update_time() -> str:
         returns:
             str - last update time
     '''
-    return utc_to_est(Portfolio.query.first().updated_time).strftime('%a, %b %d. %Y %I:%M%p') + ' EST'
+    # idle portfolios are not revalued, so use the latest update
+    return utc_to_est(db.session.query(func.max(Portfolio.updated_time)).filter(Portfolio.league_id.is_(None)).scalar()).strftime('%a, %b %d. %Y %I:%M%p') + ' EST'
 
 
+@single_flight
 def get_ticker_news(ticker: str) -> list:
     '''Gets the related news articles for a stock
         args:
@@ -454,6 +888,34 @@ def get_ticker_news(ticker: str) -> list:
     return articles
 
 
+def get_holding_values(portfolio_id: int) -> pd.DataFrame:
+    '''Gets the market value of each holding in a portfolio in the portfolio's base currency,
+    holdings in a currency without an exchange rate are left out
+        args:
+            portfolio_id: int - database id of the portfolio
+        returns:
+            pd.DataFrame - ticker, sector and converted market value of each holding
+    '''
+    holdings = db.session.query(Holdings.ticker,
+                                Security.sector,
+                                Holdings.number_of_shares,
+                                Holdings.currency,
+                                Quote.last_price,
+                                Portfolio.base_currency)\
+                         .join(Security, Security.ticker == Holdings.ticker)\
+                         .join(Quote, Quote.ticker == Holdings.ticker)\
+                         .join(Portfolio, Portfolio.id == Holdings.portfolio_id)\
+                         .filter(Holdings.portfolio_id == portfolio_id)\
+                         .all()
+
+    df = pd.DataFrame(holdings, columns=['ticker', 'sector', 'shares', 'currency', 'price', 'base_currency'])
+    df['sector'] = df['sector'].fillna('Unknown')
+    df['value'] = convert(df['shares'] * df['price'], df['currency'], df['base_currency'], skip_unknown=True)
+
+    # holdings in a currency without a rate are left out of the breakdowns
+    return df.dropna(subset=['value'])
+
+
 def get_sector_breakdown(portfolio_id: int) -> str:
     '''Gets the industry breakdown of a portfolio
         args:
@@ -461,19 +923,11 @@ def get_sector_breakdown(portfolio_id: int) -> str:
         returns:
             str - json string of the industry breakdown of a portfolio
     '''
-    holdings = Holdings.query.filter_by(portfolio_id=portfolio_id).all()
-    sector_breakdown = {}
-
-    for holding in holdings:
-        sector = holding.sector
-        if sector == None:
-            sector = 'Unknown'
-
-        sector_breakdown[sector] = sector_breakdown.get(sector, 0) + holding.updated_price * holding.number_of_shares
+    sector_breakdown = get_holding_values(portfolio_id).groupby('sector', sort=False)['value'].sum()
 
     return json.dumps({
-        'labels': list(sector_breakdown.keys()),
-        'values': list(sector_breakdown.values())
+        'labels': list(sector_breakdown.index),
+        'values': list(sector_breakdown.values)
     })
 
 
@@ -484,13 +938,9 @@ def get_holdings_breakdown(portfolio_id: str) -> str:
         returns:
             str - json string of the holdings breakdown of a portfolio
     '''
-    holdings = Holdings.query.filter_by(portfolio_id=portfolio_id).all()
-    holding_breakdown = {}
-
-    for holding in holdings:
-        holding_breakdown[holding.ticker] = holding_breakdown.get(holding.ticker, 0) + holding.updated_price * holding.number_of_shares
+    holding_breakdown = get_holding_values(portfolio_id).groupby('ticker', sort=False)['value'].sum()
 
     return json.dumps({
-        'labels': list(holding_breakdown.keys()),
-        'values': list(holding_breakdown.values())
-    })
\ No newline at end of file
+        'labels': list(holding_breakdown.index),
+        'values': list(holding_breakdown.values)
+    })
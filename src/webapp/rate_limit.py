@@ -0,0 +1,170 @@
+import inspect
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, request, make_response
+from flask_login import current_user
+from sqlalchemy import case, update
+
+from . import db
+from .data_models import RateLimitBucket
+from .database import get_upsert
+
+# most buckets a worker keeps in memory, one per client IP and signed in user
+MEMORY_BUCKET_LIMIT = 10000
+
+
+def take_token(tokens: float, updated: float, now: float, capacity: float, refill_rate: float) -> tuple:
+    '''Refills a token bucket for the time elapsed and tries to take one token
+        args:
+            tokens: float - tokens left at the last update
+            updated: float - time of the last update (seconds)
+            now: float - current time (seconds)
+            capacity: float - maximum number of tokens
+            refill_rate: float - tokens added per second
+        returns:
+            tuple - (allowed, tokens left)
+    '''
+    tokens = min(capacity, tokens + (now - updated) * refill_rate)
+
+    if tokens >= 1:
+        return True, tokens - 1
+
+    return False, tokens
+
+
+class MemoryBucketStore:
+    '''Token buckets kept in the worker's memory, least recently used first
+    '''
+
+    def __init__(self, limit=MEMORY_BUCKET_LIMIT):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.limit = limit
+
+    def take(self, key: str, capacity: float, refill_rate: float) -> bool:
+        now = time.monotonic()
+
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (capacity, now))
+            allowed, tokens = take_token(tokens, updated, now, capacity, refill_rate)
+            self.buckets[key] = (tokens, now)
+
+            if len(self.buckets) > self.limit:
+                self.evict(now, capacity, refill_rate)
+
+        return allowed
+
+    def evict(self, now: float, capacity: float, refill_rate: float) -> None:
+        '''Drops the buckets that refilled, a full bucket is the same as a missing one.
+        If that isn't enough the least recently used buckets are dropped too, down to 90% of the
+        limit so the next new keys don't sweep again
+        '''
+        for key, (tokens, updated) in list(self.buckets.items()):
+            if tokens + (now - updated) * refill_rate >= capacity:
+                del self.buckets[key]
+
+        for key in list(self.buckets)[:max(len(self.buckets) - int(self.limit * 0.9), 0)]:
+            del self.buckets[key]
+
+
+class DatabaseBucketStore:
+    '''Token buckets kept in the database, shared by all workers.
+    Runs in its own transaction so it doesn't commit the request's session
+    '''
+
+    def take(self, key: str, capacity: float, refill_rate: float) -> bool:
+        now = time.time()
+        table = RateLimitBucket.__table__
+        refilled = table.c.tokens + (now - table.c.updated) * refill_rate
+        tokens = case((refilled > capacity, capacity), else_=refilled)
+
+        with db.engine.begin() as connection:
+            # concurrent first requests of a key both try to create its bucket, one of them does
+            connection.execute(get_upsert(table).values(key=key, tokens=capacity, updated=now).on_conflict_do_nothing(index_elements=['key']))
+
+            # refills and takes a token in one UPDATE, it locks the row so concurrent requests
+            # take their tokens one after the other. No row is updated when the bucket is empty
+            taken = connection.execute(update(table).where(table.c.key == key, tokens >= 1)
+                                                    .values(tokens=tokens - 1, updated=now))
+
+        return taken.rowcount == 1
+
+
+memory_store = MemoryBucketStore()
+database_store = DatabaseBucketStore()
+
+
+def get_store():
+    '''Gets the bucket store selected by the RATE_LIMIT_BACKEND config
+    '''
+    if current_app.config.get('RATE_LIMIT_BACKEND') == 'database':
+        return database_store
+
+    return memory_store
+
+
+def is_allowed() -> bool:
+    '''Takes a token from the current user's and the client IP's buckets
+        returns:
+            bool - True if both buckets had a token
+    '''
+    capacity = current_app.config['RATE_LIMIT_CAPACITY']
+    refill_rate = current_app.config['RATE_LIMIT_PER_MINUTE'] / 60
+    store = get_store()
+
+    keys = [f'ip:{request.remote_addr}']
+
+    if current_user.is_authenticated:
+        keys.append(f'user:{current_user.id}')
+
+    # take from every bucket so a user can't dodge the limit by switching IPs
+    return all([store.take(key, capacity, refill_rate) for key in keys])
+
+
+def get_limited_response(methods=None):
+    '''Takes a token for the request
+        args:
+            methods: list - only limit these request methods, all methods if None
+        returns:
+            Response - 429 response if the request is over the limit, None otherwise
+    '''
+    if (methods is None or request.method in methods) and not is_allowed():
+        retry_after = int(60 / current_app.config['RATE_LIMIT_PER_MINUTE']) + 1
+
+        return make_response('Too many requests, please wait a moment and try again.', 429, {'Retry-After': str(retry_after)})
+
+    return None
+
+
+def rate_limited(methods=None):
+    '''Decorator limiting how often a view that calls yfinance can be requested, works on async views too
+        args:
+            methods: list - only limit these request methods, all methods if None
+    '''
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                limited = get_limited_response(methods)
+
+                if limited is not None:
+                    return limited
+
+                return await view(*args, **kwargs)
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            limited = get_limited_response(methods)
+
+            if limited is not None:
+                return limited
+
+            return view(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
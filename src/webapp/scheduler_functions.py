@@ -1,39 +1,113 @@
-import yfinance as yf
+from datetime import timedelta
+from flask import current_app
 
 from . import db
-from .data_models import Holdings, Portfolio, History
-from .portfolio_sim_functions import get_est_time
-
-def update_prices() -> None:
-    '''Updates the prices of all holdings in the database
-    Also updates the open price of the stock for the day if not already done
-    this is intended to run once an hour
+from .data_models import Holdings, Portfolio, Security, Quote, Transactions
+from .portfolio_sim_functions import get_est_time, get_quote, refresh_security, is_stale
+from .fx import convert, refresh_rates
+from .history_store import add_records, get_last_records, ensure_partitions, drop_partitions, add_months, month_start
+from .lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+def get_held_quotes() -> list:
+    '''Gets the quotes of every ticker held in a portfolio
+        returns:
+            list - quotes of held tickers
     '''
-    holdings = Holdings.query.all()
-    updated_prices = {}
+    held_tickers = db.session.query(Holdings.ticker).distinct()
+
+    return Quote.query.filter(Quote.ticker.in_(held_tickers)).all()
 
-    for holding in holdings:
-        ticker = holding.ticker
 
-        if ticker not in updated_prices:
-            updated_prices[ticker] = yf.Ticker(ticker).info.get('currentPrice', holding.updated_price)
+def update_prices() -> set:
+    '''Updates the last price of every held ticker in the database
+    One quote is written per ticker whose price moved, regardless of how many portfolios hold it
+    this is intended to run every 30 minutes while the market is open
+        returns:
+            set - tickers whose price changed
+    '''
+    changed_tickers = set()
 
-        holding.updated_price = updated_prices[ticker]
+    for quote in get_held_quotes():
+        try:
+            price = get_quote(quote.ticker)['price'] or quote.last_price
+        except:
+            price = quote.last_price
+
+        if quote.last_price != price:
+            quote.last_price = price
+            quote.updated_time = get_est_time()
+            changed_tickers.add(quote.ticker)
 
     db.session.commit()
 
+    return changed_tickers
+
 
-def update_portfolio_value() -> None:
-    '''Updates the total value of all portfolios in the database
+def refresh_fx_rates() -> set:
+    '''Refreshes the exchange rates of every currency held or used as a base currency in one batch
+        returns:
+            set - currencies whose rate changed
     '''
-    portfolios = Portfolio.query.all()
+    held_currencies = {c for c, in db.session.query(Holdings.currency).distinct()}
+    base_currencies = {c for c, in db.session.query(Portfolio.base_currency).distinct()}
+
+    try:
+        return refresh_rates(held_currencies | base_currencies)
+    except:
+        # keep valuing with the last saved rates
+        db.session.rollback()
+        return set()
+
+
+def update_portfolio_value(tickers=None, currencies=None) -> None:
+    '''Updates the total value of portfolios in the database, in each portfolio's base currency.
+    Portfolios that traded since they were last valued are always revalued, trades move
+    cash at the trade price and a portfolio that sold everything holds no moved ticker
+        args:
+            tickers: set - only revalue portfolios holding these tickers
+            currencies: set - also revalue portfolios holding or based in these currencies
+                all portfolios are revalued if both are None
+    '''
+    if tickers is None and currencies is None:
+        portfolios = Portfolio.query.all()
+    else:
+        tickers, currencies = tickers or set(), currencies or set()
+        traded = Portfolio.transactions.any(Transactions.transaction_date > Portfolio.updated_time)
+        portfolios = Portfolio.query.outerjoin(Holdings)\
+                                    .filter(Holdings.ticker.in_(tickers) | Holdings.currency.in_(currencies) | Portfolio.base_currency.in_(currencies) | traded)\
+                                    .distinct()\
+                                    .all()
+
+    if not portfolios:
+        return
+
+    # market value of every holding, converted to its portfolio's base currency at once
+    rows = db.session.query(Holdings.portfolio_id, Holdings.number_of_shares, Holdings.currency, Quote.last_price, Portfolio.base_currency)\
+                     .join(Quote, Quote.ticker == Holdings.ticker)\
+                     .join(Portfolio, Portfolio.id == Holdings.portfolio_id)\
+                     .filter(Holdings.portfolio_id.in_([p.id for p in portfolios]))\
+                     .all()
+    market_values = {}
+    unvalued = set()
+
+    if rows:
+        df = pd.DataFrame(rows, columns=['portfolio_id', 'shares', 'currency', 'price', 'base_currency'])
+        df['value'] = convert(df['shares'] * df['price'], df['currency'], df['base_currency'], skip_unknown=True)
+        market_values = df.groupby('portfolio_id')['value'].sum().to_dict()
+        # a holding in a currency without a rate can't be valued, its portfolio keeps its last value
+        unvalued = set(df.loc[df['value'].isna(), 'portfolio_id'])
+
+    if unvalued:
+        current_app.logger.warning('Portfolios %s keep their last value, they hold a currency without an exchange rate',
+                                   ', '.join(str(i) for i in sorted(unvalued)))
 
     for portfolio in portfolios:
-        holdings = portfolio.holdings
-        updated_value = portfolio.available_cash
+        if portfolio.id in unvalued:
+            continue
 
-        for holding in holdings:
-            updated_value += holding.updated_price * holding.number_of_shares
+        updated_value = portfolio.available_cash + market_values.get(portfolio.id, 0)
 
         portfolio.updated_value = round(updated_value, 2)
         portfolio.updated_time = get_est_time()
@@ -42,31 +116,56 @@ def update_portfolio_value() -> None:
 
 
 def save_history() -> None:
-    '''Saves the value of all portfolios in the database under the history table
+    '''Saves the value of portfolios in the database under the history table
+    A portfolio is only recorded when its value changed since its last record,
+    or when the last record is older than the HISTORY_HEARTBEAT_HOURS config
     '''
+    heartbeat = timedelta(hours=current_app.config.get('HISTORY_HEARTBEAT_HOURS', 24))
     portfolios = Portfolio.query.all()
 
+    last_records = get_last_records([p.id for p in portfolios])
+    records = []
+
     for portfolio in portfolios:
-        history = History(portfolio_id=portfolio.id, record_time=get_est_time(), portfolio_value=portfolio.updated_value)
+        last_record = last_records.get(portfolio.id)
 
-        db.session.add(history)
+        if last_record and last_record.portfolio_value == portfolio.updated_value and not is_stale(last_record.record_time, heartbeat):
+            continue
 
+        records.append({'portfolio_id': portfolio.id, 'record_time': get_est_time(), 'portfolio_value': portfolio.updated_value})
+
+    add_records(records)
     db.session.commit()
 
 
-def update_opening_prices() -> None:
-    '''Updates the opening price of all holdings in the database
+def maintain_history() -> dict:
+    '''Creates the history partitions of this month and the next one, and drops the partitions
+    older than the HISTORY_RETENTION_MONTHS config (0 keeps all history)
+        returns:
+            dict - names of the created and dropped partitions
     '''
-    holdings = Holdings.query.all()
-    open_prices = {}
+    created = ensure_partitions()
+    dropped = []
+    retention = current_app.config.get('HISTORY_RETENTION_MONTHS', 0)
 
-    for holding in holdings:
-        ticker = holding.ticker
+    if retention:
+        dropped = drop_partitions(add_months(month_start(get_est_time()), -retention))
 
-        if ticker not in open_prices:
-            open_prices[ticker] = yf.Ticker(ticker).info.get('open', holding.opening_price)
-        
-        holding.opening_price = open_prices[ticker]
+    return {'created': created, 'dropped': dropped}
+
+
+def update_opening_prices() -> None:
+    '''Updates the opening and previous close price of every held ticker in the database
+    '''
+    for quote in get_held_quotes():
+        try:
+            latest = get_quote(quote.ticker)
+        except:
+            continue
+
+        quote.open_price = latest['open'] or quote.open_price
+        quote.previous_close = latest['previous_close'] or quote.previous_close
+        quote.updated_time = get_est_time()
 
     db.session.commit()
 
@@ -82,3 +181,16 @@ def update_last_close_value() -> None:
     db.session.commit()
 
 
+def refresh_securities() -> None:
+    '''Refreshes the static company data of all cached securities
+    '''
+    securities = Security.query.all()
+
+    for security in securities:
+        try:
+            refresh_security(security.ticker)
+        except:
+            # keep the old data until the next refresh
+            pass
+
+    db.session.commit()
@@ -0,0 +1,74 @@
+import threading
+from functools import wraps
+
+
+class Call:
+    '''An upstream call in progress, shared by every request waiting on it
+    '''
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    '''Coalesces concurrent calls with the same key so only one of them runs.
+    The other callers wait for it and get the same result (or exception)
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        '''Runs func once for all concurrent callers using the same key
+            args:
+                key: hashable - identifies the call
+                func: callable - function to run
+            returns:
+                result of func
+        '''
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = self.calls[key] = Call()
+
+        if not leader:
+            call.done.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+            call.done.set()
+
+        return call.result
+
+
+upstream_calls = SingleFlight()
+
+
+def single_flight(func):
+    '''Decorator sharing one in-flight call between concurrent callers with the same arguments.
+    Only use it on functions that don't touch the database session, results are shared across threads
+    '''
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (func.__module__, func.__name__, args, tuple(sorted(kwargs.items())))
+
+        return upstream_calls.do(key, func, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,350 @@
+import importlib.util
+import json
+import os
+import shutil
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, inspect, text
+
+from . import db
+from .data_models import History, Transactions, Holdings, Portfolio, Security, Quote
+from .database import read_replica
+from .history_store import get_records_after, PARTITION_PATTERN
+from .market_calendar import format_market_times
+from .lazy import lazy_import
+
+# optional dependency
+pa = lazy_import('pyarrow')
+pq = lazy_import('pyarrow.parquet')
+feather = lazy_import('pyarrow.feather')
+
+WATERMARK_FILE = 'watermark.json'
+EXPORT_CHUNK_SIZE = 50000
+# rows newer than this are exported again on the next export, a row with a lower id can still
+# be committed after them by a concurrent transaction
+EXPORT_LAG = timedelta(minutes=10)
+# file formats, also used as the file extension
+FORMATS = ('parquet', 'arrow')
+
+# append-only tables exported incrementally, with the column their date partition comes from
+LOG_TABLES = {
+    'history': (History, 'record_time'),
+    'transactions': (Transactions, 'transaction_date')
+}
+# tables updated in place, a full copy is exported each time. In load order, referenced tables first
+FULL_TABLES = {
+    'security': Security,
+    'quote': Quote,
+    'portfolio': Portfolio,
+    'holdings': Holdings
+}
+
+
+def require_pyarrow() -> None:
+    '''Raises an error when the optional pyarrow dependency is missing
+    '''
+    if importlib.util.find_spec('pyarrow') is None:
+        raise RuntimeError('Snapshots need pyarrow, install it with "pip install pyarrow"')
+
+
+def get_columns(model) -> list:
+    '''Gets the column names of a model's table
+    '''
+    return [c.name for c in model.__table__.columns]
+
+
+def read_watermark(export_dir: str) -> dict:
+    '''Reads the export position of each table
+        args:
+            export_dir: str - snapshot directory
+        returns:
+            dict - table name to the id every row up to is exported (last_id)
+                and the ids exported above it (exported_ids)
+    '''
+    path = os.path.join(export_dir, WATERMARK_FILE)
+
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as f:
+        watermark = json.load(f)
+
+    # earlier exports only saved the last id
+    return {name: {'last_id': w, 'exported_ids': []} if isinstance(w, int) else w for name, w in watermark.items()}
+
+
+def write_watermark(export_dir: str, watermark: dict) -> None:
+    '''Saves the watermark once all files of an export are written, so a failed export is retried in full
+        args:
+            export_dir: str - snapshot directory
+            watermark: dict - export position by table name
+    '''
+    path = os.path.join(export_dir, WATERMARK_FILE)
+
+    with open(path + '.tmp', 'w') as f:
+        json.dump(watermark, f, indent=2)
+
+    os.replace(path + '.tmp', path)
+
+
+def to_utc(time: datetime) -> datetime:
+    '''Makes a time UTC aware, naive database times are UTC
+    '''
+    return time if time.tzinfo else time.replace(tzinfo=timezone.utc)
+
+
+def to_table(rows: list, columns: list):
+    '''Builds an arrow table from query rows, times are stored as UTC
+        args:
+            rows: list - query rows
+            columns: list - column names
+        returns:
+            pa.Table - rows as columns
+    '''
+    arrays = {}
+
+    for name in columns:
+        values = [getattr(r, name) for r in rows]
+
+        if isinstance(next((v for v in values if v is not None), None), datetime):
+            # naive database times are UTC
+            values = [to_utc(v) if v else None for v in values]
+            arrays[name] = pa.array(values, type=pa.timestamp('us', tz='UTC'))
+        else:
+            arrays[name] = pa.array(values)
+
+    return pa.table(arrays)
+
+
+def write_table(table, path: str, file_format: str) -> None:
+    '''Writes an arrow table as parquet or arrow IPC
+    '''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    if file_format == 'parquet':
+        pq.write_table(table, path)
+    else:
+        feather.write_feather(table, path)
+
+
+def write_partitions(table, partition_dates: list, table_dir: str, name: str, file_format: str) -> int:
+    '''Splits a chunk by date and writes one file per date partition
+        args:
+            table: pa.Table - rows of the chunk
+            partition_dates: list - partition date of each row
+            table_dir: str - directory of the table
+            name: str - file name, without the extension
+            file_format: str - parquet or arrow
+        returns:
+            int - number of files written
+    '''
+    rows_by_date = {}
+
+    for i, day in enumerate(partition_dates):
+        rows_by_date.setdefault(day, []).append(i)
+
+    for day, indexes in rows_by_date.items():
+        path = os.path.join(table_dir, f'date={day}', f'{name}.{file_format}')
+        write_table(table.take(indexes), path, file_format)
+
+    return len(rows_by_date)
+
+
+def export_log_table(name: str, export_dir: str, position: dict, file_format: str, chunk_size: int) -> tuple:
+    '''Streams the rows of an append-only table added since the watermark, in id order and in chunks.
+    Ids are not committed in order, so the rows of the last EXPORT_LAG are read again on the next export
+    and only the ones not exported yet are written
+        args:
+            name: str - table name in LOG_TABLES
+            export_dir: str - snapshot directory
+            position: dict - last_id every row up to is exported and exported_ids above it
+            file_format: str - parquet or arrow
+            chunk_size: int - rows read per query
+        returns:
+            tuple - (rows exported, new position)
+    '''
+    model, time_column = LOG_TABLES[name]
+    columns = get_columns(model)
+    settled = datetime.now(timezone.utc) - EXPORT_LAG
+    last_id = position['last_id']
+    exported_ids = set(position['exported_ids'])
+    cursor = last_id
+    exported = 0
+
+    while True:
+        # keyset pagination keeps every chunk an index range scan
+        if model is History:
+            rows = get_records_after(cursor, chunk_size)
+        else:
+            rows = model.query.with_entities(*[getattr(model, c) for c in columns])\
+                              .filter(model.id > cursor)\
+                              .order_by(model.id)\
+                              .limit(chunk_size)\
+                              .all()
+
+        if not rows:
+            break
+
+        cursor = rows[-1].id
+        new_rows = [r for r in rows if r.id not in exported_ids]
+
+        if new_rows:
+            dates = format_market_times([getattr(r, time_column) for r in new_rows], '%Y-%m-%d')
+            write_partitions(to_table(new_rows, columns), dates, os.path.join(export_dir, name),
+                             f'part-{new_rows[0].id}-{new_rows[-1].id}', file_format)
+
+            exported += len(new_rows)
+            exported_ids.update(r.id for r in new_rows)
+
+        # rows older than the lag are settled, no lower id can be committed after them
+        last_id = max([last_id] + [r.id for r in rows if to_utc(getattr(r, time_column)) < settled])
+        db.session.expunge_all()
+
+    return exported, {'last_id': last_id, 'exported_ids': sorted(i for i in exported_ids if i > last_id)}
+
+
+def get_primary_key(model):
+    '''Gets the single primary key column of a model, used for keyset pagination
+    '''
+    return getattr(model, model.__table__.primary_key.columns.values()[0].name)
+
+
+def export_full_table(name: str, export_dir: str, file_format: str, chunk_size: int) -> int:
+    '''Writes a full snapshot of a table updated in place, which can't be exported incrementally
+        args:
+            name: str - table name in FULL_TABLES
+            export_dir: str - snapshot directory
+            file_format: str - parquet or arrow
+            chunk_size: int - rows read per query
+        returns:
+            int - rows exported
+    '''
+    model = FULL_TABLES[name]
+    columns = get_columns(model)
+    key = get_primary_key(model)
+    day = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    table_dir = os.path.join(export_dir, name)
+    last_key = None
+    exported = 0
+    part = 0
+
+    # replace an earlier snapshot taken the same day
+    shutil.rmtree(os.path.join(table_dir, f'date={day}'), ignore_errors=True)
+
+    while True:
+        query = model.query.with_entities(*[getattr(model, c) for c in columns])
+
+        if last_key is not None:
+            query = query.filter(key > last_key)
+
+        rows = query.order_by(key).limit(chunk_size).all()
+
+        if not rows:
+            break
+
+        last_key = getattr(rows[-1], key.key)
+        part += 1
+        write_partitions(to_table(rows, columns), [day] * len(rows), table_dir, f'part-{part:05d}', file_format)
+
+        exported += len(rows)
+
+    return exported
+
+
+def export_snapshot(export_dir: str, file_format='parquet', chunk_size=EXPORT_CHUNK_SIZE) -> dict:
+    '''Exports history and transactions added since the last export and a snapshot of the portfolios,
+    securities, quotes and holdings into date partitioned files. Reads go to the read replica when one is configured
+        args:
+            export_dir: str - snapshot directory
+            file_format: str - parquet or arrow
+            chunk_size: int - rows read per query
+        returns:
+            dict - rows exported by table name
+    '''
+    require_pyarrow()
+
+    if file_format not in FORMATS:
+        raise ValueError(f'Unknown snapshot format {file_format}')
+
+    os.makedirs(export_dir, exist_ok=True)
+    watermark = read_watermark(export_dir)
+    counts = {}
+
+    with read_replica():
+        for name in LOG_TABLES:
+            position = watermark.get(name, {'last_id': 0, 'exported_ids': []})
+            counts[name], watermark[name] = export_log_table(name, export_dir, position, file_format, chunk_size)
+
+        for name in FULL_TABLES:
+            counts[name] = export_full_table(name, export_dir, file_format, chunk_size)
+
+    write_watermark(export_dir, watermark)
+
+    return counts
+
+
+def read_partitions(table_dir: str, latest_only=False) -> list:
+    '''Lists the files of a table, oldest partition first
+        args:
+            table_dir: str - directory of the table
+            latest_only: bool - only list the files of the newest partition
+        returns:
+            list - file paths
+    '''
+    if not os.path.isdir(table_dir):
+        return []
+
+    partitions = sorted(p for p in os.listdir(table_dir) if p.startswith('date='))
+
+    if latest_only:
+        partitions = partitions[-1:]
+
+    return [os.path.join(table_dir, p, f) for p in partitions for f in sorted(os.listdir(os.path.join(table_dir, p)))]
+
+
+def read_file(path: str):
+    '''Reads a parquet or arrow IPC file
+    '''
+    if path.endswith('.parquet'):
+        return pq.read_table(path)
+
+    return feather.read_table(path)
+
+
+def load_snapshot(export_dir: str, sqlite_path: str, chunk_size=EXPORT_CHUNK_SIZE) -> dict:
+    '''Rebuilds the portfolio, security, quote, holdings, transactions and history tables of a SQLite
+    database from a snapshot. Existing rows of those tables are replaced
+        args:
+            export_dir: str - snapshot directory
+            sqlite_path: str - path of the SQLite database
+            chunk_size: int - rows inserted per statement
+        returns:
+            dict - rows loaded by table name
+    '''
+    require_pyarrow()
+
+    engine = create_engine(f'sqlite:///{os.path.abspath(sqlite_path)}')
+    models = {**FULL_TABLES, 'transactions': Transactions, 'history': History}
+    counts = {}
+
+    with engine.begin() as connection:
+        # the loaded history goes in the unsharded table, drop the old shards
+        for name in inspect(connection).get_table_names():
+            if PARTITION_PATTERN.match(name):
+                connection.execute(text(f'DROP TABLE {name}'))
+
+        for name, model in models.items():
+            table = model.__table__
+            table.create(connection, checkfirst=True)
+            connection.execute(table.delete())
+            counts[name] = 0
+
+            for path in read_partitions(os.path.join(export_dir, name), latest_only=name in FULL_TABLES):
+                for batch in read_file(path).to_batches(max_chunksize=chunk_size):
+                    rows = batch.to_pylist()
+                    connection.execute(table.insert(), rows)
+                    counts[name] += len(rows)
+
+    engine.dispose()
+
+    return counts
@@ -1,23 +1,42 @@
 // on page load
 document.addEventListener('DOMContentLoaded', () => {
     let dataContainer = document.getElementById('data-container')
-    let historyData = JSON.parse(dataContainer.getAttribute('data-history'))
     let plotDivId = 'historyPlot'
 
-    renderHistoryPlot(historyData, plotDivId)
+    // the server leaves the history out when it took too long, fetch it instead
+    if (dataContainer.hasAttribute('data-history')) {
+        renderHistoryPlot(decodeChart(JSON.parse(dataContainer.getAttribute('data-history'))), plotDivId)
+    } else {
+        loadHistory(dataContainer.getAttribute('data-history-url'), plotDivId)
+    }
 })
 
+
+/**
+ * loads the compressed price history payload and plots it
+ * @param {String} url - stock history endpoint
+ * @param {String} plotDivId - id of the plot container
+ */
+let loadHistory = (url, plotDivId) => {
+    fetch(url)
+        .then(response => response.json())
+        .then(payload => renderHistoryPlot(decodeChart(payload), plotDivId))
+        .catch(() => {
+            document.getElementById(plotDivId).innerHTML = '<h3 class="text-center my-5">Price history is not available right now</h3>'
+        })
+}
+
 /**
  * creates interactive plot of stock price history
- * @param {JSON} data - portfolio history  
+ * @param {Object} data - decoded stock history
  */
 let renderHistoryPlot = (data, plotDivId) => {
     let plotData = {
-        x: data['date'],
-        close: data['close'],
-        high: data['high'],
-        low: data['low'],
-        open: data['open'],
+        x: data.x,
+        close: data.series['close'],
+        high: data.series['high'],
+        low: data.series['low'],
+        open: data.series['open'],
 
         // cutomise colors
         increasing: {line: {color: 'green'}},
@@ -4,7 +4,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     let transactionData = JSON.parse(dataContainer.getAttribute('data-transactions'))
     let holdingsData = JSON.parse(dataContainer.getAttribute('data-holdings'))
-    let historyData = JSON.parse(dataContainer.getAttribute('data-history'))
+    let historyData = decodeChart(JSON.parse(dataContainer.getAttribute('data-history')))
     let holdingsPieData = JSON.parse(dataContainer.getAttribute('data-holdings-pie'))
     let sectorPieData = JSON.parse(dataContainer.getAttribute('data-sector-pie'))
 
@@ -24,7 +24,7 @@ document.addEventListener('DOMContentLoaded', () => {
         renderTable(transactionData, 'transactionsTable')
     }
 
-    if (historyData['date'].length > 1) {
+    if (historyData.x.length > 1) {
         renderHistoryPlot(historyData, historyPlotDiv)
     } else {
         document.getElementById('historyPlot').innerHTML = '<h3 class="text-center my-5">No history available yet!</h3>'
@@ -43,11 +43,11 @@ let openPopup = (popupId) => {
 
 /**
  * creates interactive plot of portfolio performance history
- * @param {JSON} data - portfolio history  
+ * @param {Object} data - decoded portfolio history
  */
 let renderHistoryPlot = (data, historyPlotDiv) => {
-    let dates = data['date']
-    let values = data['value']
+    let dates = data.x
+    let values = data.series['value']
 
     let indexes = dates.map((date, index) => index)
 
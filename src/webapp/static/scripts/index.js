@@ -23,4 +23,96 @@ let flashMessage = (message, type='danger') => {
     setTimeout(() => {
         alert.remove()
     }, 3000)
-}
\ No newline at end of file
+}
+
+// ticker autocomplete for inputs marked with data-autocomplete
+document.addEventListener('DOMContentLoaded', () => {
+    document.querySelectorAll('input[data-autocomplete]').forEach(input => {
+        let datalist = document.createElement('datalist')
+        datalist.id = `${input.id}Suggestions`
+        input.setAttribute('list', datalist.id)
+        input.setAttribute('autocomplete', 'off')
+        input.after(datalist)
+
+        input.addEventListener('input', () => {
+            let prefix = input.value.trim()
+
+            if (prefix.length == 0) {
+                datalist.innerHTML = ''
+                return
+            }
+
+            fetch(`${input.getAttribute('data-autocomplete')}?q=${encodeURIComponent(prefix)}`)
+                .then(response => response.json())
+                .then(symbols => {
+                    datalist.innerHTML = ''
+
+                    symbols.forEach(symbol => {
+                        let option = document.createElement('option')
+                        option.value = symbol['ticker']
+                        option.text = `${symbol['name']} (${symbol['exchange'] || 'n/a'})`
+                        datalist.append(option)
+                    })
+                })
+        })
+    })
+})
+
+// label formatters by timezone, building one is slow
+let timeFormatters = {}
+
+/**
+ * formats epoch seconds as "YYYY-MM-DD" or "YYYY-MM-DD HH:MM" in a timezone
+ * @param {Number} seconds - epoch seconds
+ * @param {String} tz - IANA timezone name
+ * @param {Boolean} withTime - whether to include the time of day
+ */
+let formatTime = (seconds, tz, withTime) => {
+    if (!(tz in timeFormatters)) {
+        timeFormatters[tz] = new Intl.DateTimeFormat('en-CA', {
+            timeZone: tz,
+            year: 'numeric', month: '2-digit', day: '2-digit',
+            hour: '2-digit', minute: '2-digit', hourCycle: 'h23'
+        })
+    }
+
+    let parts = {}
+    timeFormatters[tz].formatToParts(new Date(seconds * 1000)).forEach(part => parts[part.type] = part.value)
+
+    let date = `${parts.year}-${parts.month}-${parts.day}`
+
+    return withTime ? `${date} ${parts.hour}:${parts.minute}` : date
+}
+
+/**
+ * decodes a compact chart payload (see chart_payload.py)
+ * @param {JSON} payload - base time, delta-encoded time offsets and fixed-precision value series
+ * @returns {Object} - x labels, series values by name and the series names in order
+ */
+let decodeChart = (payload) => {
+    let x = []
+    let offset = 0
+
+    payload['t'].forEach(delta => {
+        offset += delta
+        x.push(formatTime(payload['t0'] + offset * payload['unit'], payload['tz'], payload['unit'] < 86400))
+    })
+
+    let series = {}
+    let names = []
+
+    payload['series'].forEach(s => {
+        let values = new Array(s['skip']).fill(null)
+        let value = 0
+
+        s['d'].forEach(delta => {
+            value += delta
+            values.push(value / payload['scale'])
+        })
+
+        series[s['name']] = values
+        names.push(s['name'])
+    })
+
+    return {x: x, series: series, names: names}
+}
@@ -4,12 +4,14 @@ document.addEventListener('DOMContentLoaded', () => {
 
     let topPerformersData = JSON.parse(dataContainer.getAttribute('data-top-performers'))
     let dailyPerformersData = JSON.parse(dataContainer.getAttribute('data-daily-performers'))
-    let historyData = JSON.parse(dataContainer.getAttribute('data-history'))
+    let historyData = decodeChart(JSON.parse(dataContainer.getAttribute('data-history')))
 
     renderTable(topPerformersData, 'topPerformersTable')
     renderTable(dailyPerformersData, 'dailyPerformersTable')
+    renderTable(JSON.parse(dataContainer.getAttribute('data-most-held')), 'mostHeldTable')
+    renderTable(JSON.parse(dataContainer.getAttribute('data-sectors')), 'sectorsTable')
 
-    if (historyData[0]['x'].length > 1) {
+    if (historyData.x.length > 1) {
         renderHistoryPlot(historyData)       
     } else {
         document.getElementById('historyPlot').innerHTML = '<h3 class="text-center my-5">No history available yet!</h3>'
@@ -48,15 +50,17 @@ let renderTable = (data, tableId) => {
 
 /**
  * creates interactive plot of portfolio performance history
- * @param {JSON} data - portfolio history  
+ * @param {Object} data - decoded performance history of all portfolios
  */
 let renderHistoryPlot = (data) => {
-    dates = data[0]['x']
+    let dates = data.x
     let indexes = dates.map((date, index) => index)
 
-    for (let i = 0; i < data.length; i++) {
-        data[i]['x'] = indexes[i]
-    }
+    let traces = data.names.map(name => ({
+        x: indexes,
+        y: data.series[name],
+        name: name
+    }))
 
     let layout = {
         title: {
@@ -114,7 +118,7 @@ let renderHistoryPlot = (data) => {
         }
     }
 
-    Plotly.newPlot('historyPlot', data, layout).then(() => {
+    Plotly.newPlot('historyPlot', traces, layout).then(() => {
         window.onresize = function() {
             Plotly.Plots.resize('historyPlot')
           }
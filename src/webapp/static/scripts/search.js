@@ -1,19 +1,57 @@
 // on page load
 document.addEventListener('DOMContentLoaded', () => {
     let dataContainer = document.getElementById('data-container')
-    let historyData = JSON.parse(dataContainer.getAttribute('data-history'))
     let plotDivId = 'historyPlot'
 
-    renderHistoryPlot(historyData, plotDivId)
+    loadHistory(dataContainer.getAttribute('data-history-url'), plotDivId)
+    loadNews('newsFragment')
 })
 
+
+/**
+ * loads the compressed price history payload and plots it
+ * @param {String} url - stock history endpoint
+ * @param {String} plotDivId - id of the plot container
+ */
+let loadHistory = (url, plotDivId) => {
+    fetch(url)
+        .then(response => response.json())
+        .then(payload => renderHistoryPlot(decodeChart(payload), plotDivId))
+        .catch(() => {
+            document.getElementById(plotDivId).innerHTML = '<h3 class="text-center my-5">Price history is not available right now</h3>'
+        })
+}
+
+
+/**
+ * loads the news list when it was not cached on the server
+ * @param {String} fragmentId - id of the news container
+ */
+let loadNews = (fragmentId) => {
+    let fragment = document.getElementById(fragmentId)
+
+    if (fragment.getAttribute('data-loaded') == 'true') {
+        return
+    }
+
+    fetch(fragment.getAttribute('data-url'))
+        .then(response => response.text())
+        .then(html => {
+            fragment.innerHTML = html
+            fragment.setAttribute('data-loaded', 'true')
+        })
+        .catch(() => {
+            fragment.innerHTML = '<p class="text-muted">News is not available right now</p>'
+        })
+}
+
 /**
  * creates interactive plot of stock price history
- * @param {JSON} data - portfolio history  
+ * @param {Object} data - decoded stock history
  */
 let renderHistoryPlot = (data, plotDivId) => {
-    let x = data['date']
-    let y = data['price']
+    let x = data.x
+    let y = data.series['price']
 
     let plotData = {
         x: x,
@@ -0,0 +1,161 @@
+import csv
+import hashlib
+import time
+from bisect import bisect_left
+from datetime import datetime, timezone
+
+from . import db
+from .data_models import Symbol, SymbolVersion
+
+# seconds between checks that the symbol table still matches the index, another process may have reloaded it
+SYMBOL_CHECK_INTERVAL = 300
+# id of the single symbol version row
+SYMBOL_VERSION_ID = 1
+
+
+class SymbolDirectory:
+    '''In-memory prefix index over the symbol table.
+    Tickers and lowercase company names are kept in sorted arrays so lookups and
+    prefix searches are binary searches with no database or network access
+    '''
+
+    def __init__(self):
+        self.loaded = False
+        self.checked = None
+        self.version = None
+        self.symbols = {}
+        self.tickers = []
+        self.names = []
+
+    def load(self) -> None:
+        '''Builds the index from the symbol table
+        '''
+        self.version = get_symbol_version()
+        rows = db.session.query(Symbol.ticker, Symbol.name, Symbol.exchange, Symbol.sector).all()
+
+        self.symbols = {
+            row.ticker: {
+                'ticker': row.ticker,
+                'name': row.name,
+                'exchange': row.exchange,
+                'sector': row.sector
+            } for row in rows
+        }
+        self.tickers = sorted(self.symbols)
+        self.names = sorted((row.name.lower(), row.ticker) for row in rows)
+        self.loaded = True
+        self.checked = time.monotonic()
+
+    def ensure_loaded(self) -> None:
+        '''Loads the index on first use, and reloads it when `load-symbols` wrote a new checksum.
+        The checksum is checked every SYMBOL_CHECK_INTERVAL seconds, so every worker picks up
+        a new symbol file without a restart, even one with as many rows as the last
+        '''
+        if not self.loaded:
+            self.load()
+        elif time.monotonic() - self.checked > SYMBOL_CHECK_INTERVAL:
+            self.checked = time.monotonic()
+
+            if get_symbol_version() != self.version:
+                self.load()
+
+    def __len__(self) -> int:
+        self.ensure_loaded()
+
+        return len(self.tickers)
+
+    def __contains__(self, ticker: str) -> bool:
+        self.ensure_loaded()
+
+        return ticker in self.symbols
+
+    def get(self, ticker: str) -> dict:
+        '''Gets a symbol from the directory
+            args:
+                ticker: str - stock ticker
+            returns:
+                dict - ticker, name, exchange and sector, None if not listed
+        '''
+        self.ensure_loaded()
+
+        return self.symbols.get(ticker)
+
+    def search(self, prefix: str, limit=10) -> list:
+        '''Finds symbols whose ticker or company name starts with a prefix.
+        Ticker matches are listed before name matches
+            args:
+                prefix: str - start of a ticker or company name
+                limit: int - maximum number of results
+            returns:
+                list - matching symbols
+        '''
+        self.ensure_loaded()
+
+        if not prefix:
+            return []
+
+        matches = []
+
+        ticker_prefix = prefix.upper()
+        i = bisect_left(self.tickers, ticker_prefix)
+
+        while i < len(self.tickers) and len(matches) < limit and self.tickers[i].startswith(ticker_prefix):
+            matches.append(self.tickers[i])
+            i += 1
+
+        name_prefix = prefix.lower()
+        i = bisect_left(self.names, (name_prefix, ''))
+
+        while i < len(self.names) and len(matches) < limit and self.names[i][0].startswith(name_prefix):
+            if self.names[i][1] not in matches:
+                matches.append(self.names[i][1])
+            i += 1
+
+        return [self.symbols[t] for t in matches]
+
+
+def get_symbol_version() -> str:
+    '''Gets the checksum of the symbol table written by load_symbols_csv
+        returns:
+            str - checksum, None if symbols were never loaded
+    '''
+    return db.session.query(SymbolVersion.checksum).filter_by(id=SYMBOL_VERSION_ID).scalar()
+
+
+symbol_directory = SymbolDirectory()
+
+
+def load_symbols_csv(path: str) -> int:
+    '''Replaces the symbol table with the contents of a CSV file.
+    The file needs a header row with ticker and name columns, exchange and sector are optional
+        args:
+            path: str - path to the CSV file
+        returns:
+            int - number of symbols loaded
+    '''
+    symbols = {}
+
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            row = {k.strip().lower(): (v or '').strip() for k, v in row.items() if k}
+            ticker = row.get('ticker', '').upper()
+
+            if ticker and row.get('name'):
+                symbols[ticker] = Symbol(ticker=ticker,
+                                         name=row['name'],
+                                         exchange=row.get('exchange') or None,
+                                         sector=row.get('sector') or None)
+
+    rows = '\n'.join(f'{ticker}|{symbol.name}|{symbol.exchange or ""}|{symbol.sector or ""}' for ticker, symbol in sorted(symbols.items()))
+    version = db.session.get(SymbolVersion, SYMBOL_VERSION_ID) or SymbolVersion(id=SYMBOL_VERSION_ID)
+    version.checksum = hashlib.sha256(rows.encode()).hexdigest()
+    version.loaded_time = datetime.now(timezone.utc)
+
+    Symbol.query.delete()
+    db.session.add_all(symbols.values())
+    db.session.add(version)
+    db.session.commit()
+
+    symbol_directory.load()
+
+    return len(symbols)
@@ -0,0 +1,311 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import func, insert
+
+from . import db
+from .data_models import WatchlistItem, PriceBar, Security
+from .lazy import lazy_import
+from .market_calendar import MARKET_TIMEZONE, is_market_open, get_last_close
+from .portfolio_sim_functions import quote_cache, is_stale, to_utc, QUOTE_TTL
+from .single_flight import single_flight
+from .symbol_directory import symbol_directory
+
+pd = lazy_import('pandas')
+yf = lazy_import('yfinance')
+
+# most tickers a user can watch
+WATCHLIST_SIZE = 300
+# daily bars drawn in each sparkline
+SPARKLINE_BARS = 30
+# period downloaded for the bars, enough trading days for a full sparkline
+BAR_PERIOD = '3mo'
+# size of the sparkline svg
+SPARKLINE_WIDTH = 120
+SPARKLINE_HEIGHT = 30
+
+# current price of watched tickers during a session, from the batched price download
+live_prices = {}
+
+
+def get_watchlist_tickers(user_id: int) -> list:
+    '''Gets the tickers on a user's watchlist, in the order they were added
+        args:
+            user_id: int - database id of the user
+        returns:
+            list - tickers
+    '''
+    return db.session.execute(db.select(WatchlistItem.ticker)
+                              .filter_by(user_id=user_id)
+                              .order_by(WatchlistItem.id)).scalars().all()
+
+
+def add_to_watchlist(user_id: int, ticker: str) -> bool:
+    '''Adds a ticker to a user's watchlist
+        args:
+            user_id: int - database id of the user
+            ticker: str - stock ticker
+        returns:
+            bool - False if it was already on the watchlist
+    '''
+    if WatchlistItem.query.filter_by(user_id=user_id, ticker=ticker).first():
+        return False
+
+    db.session.add(WatchlistItem(user_id=user_id, ticker=ticker, added_time=datetime.now(timezone.utc)))
+    db.session.commit()
+
+    return True
+
+
+def remove_from_watchlist(user_id: int, ticker: str) -> None:
+    '''Removes a ticker from a user's watchlist
+        args:
+            user_id: int - database id of the user
+            ticker: str - stock ticker
+    '''
+    WatchlistItem.query.filter_by(user_id=user_id, ticker=ticker).delete()
+    db.session.commit()
+
+
+def get_ticker_frame(data, ticker: str):
+    '''Gets the rows of one ticker from a batched yfinance download
+        returns:
+            pd.DataFrame - rows with a close price, None if the ticker failed
+    '''
+    if isinstance(data.columns, pd.MultiIndex):
+        if ticker not in data.columns.get_level_values(0):
+            return None
+
+        data = data[ticker]
+
+    frame = data.dropna(subset=['Close'])
+
+    return None if frame.empty else frame
+
+
+@single_flight
+def fetch_bars(tickers: tuple) -> dict:
+    '''Fetches the recent daily bars of many tickers with one batched yfinance download.
+    Only the bars of finished sessions are kept, today's bar is still moving during a session
+        args:
+            tickers: tuple - stock tickers
+        returns:
+            dict - ticker to list of (date, open, close), tickers that failed are left out
+    '''
+    data = yf.download(list(tickers), period=BAR_PERIOD, interval='1d', group_by='ticker', progress=False, threads=True)
+    last_session = get_last_close().astimezone(MARKET_TIMEZONE).date()
+    bars = {}
+
+    for ticker in tickers:
+        frame = get_ticker_frame(data, ticker)
+
+        if frame is not None:
+            bars[ticker] = [(day.date(), float(open_price), float(close_price))
+                            for day, open_price, close_price in zip(frame.index, frame['Open'], frame['Close'])
+                            if day.date() <= last_session]
+
+    return {ticker: ticker_bars for ticker, ticker_bars in bars.items() if ticker_bars}
+
+
+@single_flight
+def fetch_prices(tickers: tuple) -> dict:
+    '''Fetches the current price of many tickers with one batched yfinance download of today's bar
+        args:
+            tickers: tuple - stock tickers
+        returns:
+            dict - ticker to current price, tickers that failed are left out
+    '''
+    data = yf.download(list(tickers), period='1d', interval='1d', group_by='ticker', progress=False, threads=True)
+    prices = {}
+
+    for ticker in tickers:
+        frame = get_ticker_frame(data, ticker)
+
+        if frame is not None:
+            prices[ticker] = float(frame['Close'].iloc[-1])
+
+    return prices
+
+
+def save_bars(bars: dict) -> None:
+    '''Replaces the stored bars of the fetched tickers
+        args:
+            bars: dict - ticker to list of (date, open, close)
+    '''
+    if not bars:
+        return
+
+    fetched_time = datetime.now(timezone.utc)
+
+    PriceBar.query.filter(PriceBar.ticker.in_(bars)).delete(synchronize_session=False)
+    db.session.execute(insert(PriceBar), [{'ticker': ticker,
+                                           'bar_date': day,
+                                           'open_price': open_price,
+                                           'close_price': close_price,
+                                           'fetched_time': fetched_time}
+                                          for ticker, ticker_bars in bars.items()
+                                          for day, open_price, close_price in ticker_bars[-(SPARKLINE_BARS + 1):]])
+    db.session.commit()
+
+
+def refresh_bars(tickers: list) -> list:
+    '''Downloads the bars of the tickers that are missing the last finished session, all of them in one batch.
+    Bars are downloaded once per trading day, a ticker that was downloaded since the last close
+    without getting its bar (halted, or yfinance is late) waits for the next close
+        args:
+            tickers: list - stock tickers
+        returns:
+            list - tickers that were downloaded
+    '''
+    last_close = get_last_close()
+    last_session = last_close.astimezone(MARKET_TIMEZONE).date()
+    stored = {row.ticker: row for row in db.session.query(PriceBar.ticker,
+                                                          func.max(PriceBar.bar_date).label('bar_date'),
+                                                          func.max(PriceBar.fetched_time).label('fetched_time'))
+                                                   .filter(PriceBar.ticker.in_(tickers))
+                                                   .group_by(PriceBar.ticker)
+                                                   .all()}
+    stale = sorted(t for t in tickers if t not in stored
+                   or (stored[t].bar_date < last_session and to_utc(stored[t].fetched_time) < last_close))
+
+    if not stale:
+        return []
+
+    try:
+        save_bars(fetch_bars(tuple(stale)))
+    except:
+        # show the stored bars
+        db.session.rollback()
+
+    return stale
+
+
+def get_live_price(ticker: str) -> float:
+    '''Gets the current price of a ticker during a session, from the quote cache of the stock pages
+    or the batched price download, whichever is newer
+        args:
+            ticker: str - stock ticker
+        returns:
+            float - current price, None if neither is fresh
+    '''
+    prices = []
+    live = live_prices.get(ticker)
+    cached = quote_cache.get(ticker)
+
+    if live:
+        prices.append((live['fetched_time'], live['price']))
+
+    if cached and cached['quote']['price']:
+        prices.append((cached['fetched_time'], float(cached['quote']['price'])))
+
+    prices = [(fetched_time, price) for fetched_time, price in prices if not is_stale(fetched_time, QUOTE_TTL)]
+
+    return max(prices)[1] if prices else None
+
+
+def refresh_prices(tickers: list) -> list:
+    '''Downloads the current price of the tickers without a fresh one, all of them in one batch.
+    Prices only move during a session, outside of it the bars have the last close
+        args:
+            tickers: list - stock tickers
+        returns:
+            list - tickers that were downloaded
+    '''
+    if not is_market_open():
+        return []
+
+    stale = sorted(t for t in tickers if get_live_price(t) is None)
+
+    if not stale:
+        return []
+
+    try:
+        prices = fetch_prices(tuple(stale))
+    except:
+        # show the last close
+        return stale
+
+    fetched_time = datetime.now(timezone.utc)
+
+    for ticker, price in prices.items():
+        live_prices[ticker] = {'fetched_time': fetched_time, 'price': price}
+
+    return stale
+
+
+def get_sparkline(closes: list) -> str:
+    '''Gets the points of an svg polyline drawing the closes
+        args:
+            closes: list - close prices, oldest first
+        returns:
+            str - "x,y" points
+    '''
+    low, high = min(closes), max(closes)
+    span = (high - low) or 1
+    step = SPARKLINE_WIDTH / max(len(closes) - 1, 1)
+
+    return ' '.join(f'{i * step:.1f},{SPARKLINE_HEIGHT - (close - low) / span * SPARKLINE_HEIGHT:.1f}' for i, close in enumerate(closes))
+
+
+def get_company_names(tickers: list) -> dict:
+    '''Gets the company names of tickers from the symbol directory, or the security cache
+    '''
+    symbols = {t: symbol_directory.get(t) for t in tickers}
+    names = {t: symbol['name'] for t, symbol in symbols.items() if symbol}
+    missing = [t for t in tickers if t not in names]
+
+    if missing:
+        names.update(db.session.query(Security.ticker, Security.company_name).filter(Security.ticker.in_(missing)).all())
+
+    return names
+
+
+def get_watchlist(user_id: int) -> list:
+    '''Gets the quotes and sparklines of a user's watchlist.
+    Closes come from the stored daily bars, refreshed once per trading day. During a session
+    the current prices come from the quote cache or one batched price download, so a watchlist
+    costs at most one upstream call per minute however long it is
+        args:
+            user_id: int - database id of the user
+        returns:
+            list - ticker, name, price, change, change (%) and sparkline of each watched ticker
+    '''
+    tickers = get_watchlist_tickers(user_id)
+
+    if not tickers:
+        return []
+
+    refresh_bars(tickers)
+    refresh_prices(tickers)
+
+    bars = {}
+
+    for bar in PriceBar.query.filter(PriceBar.ticker.in_(tickers)).order_by(PriceBar.ticker, PriceBar.bar_date):
+        bars.setdefault(bar.ticker, []).append(bar)
+
+    names = get_company_names(tickers)
+    market_open = is_market_open()
+    watchlist = []
+
+    for ticker in tickers:
+        closes = [b.close_price for b in bars.get(ticker, [])]
+        live_price = get_live_price(ticker) if market_open else None
+
+        if live_price is not None:
+            # today's change is against the last finished session
+            closes.append(live_price)
+
+        closes = closes[-(SPARKLINE_BARS + 1):]
+        price = closes[-1] if closes else None
+        previous_close = closes[-2] if len(closes) > 1 else None
+        change = round(price - previous_close, 2) if price is not None and previous_close else None
+
+        watchlist.append({
+            'ticker': ticker,
+            'name': names.get(ticker, 'n/a'),
+            'price': None if price is None else round(price, 2),
+            'change': change,
+            'percent_change': round(change / previous_close * 100, 2) if change is not None else None,
+            'sparkline': get_sparkline(closes[-SPARKLINE_BARS:]) if len(closes) > 1 else None
+        })
+
+    return watchlist
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+# fixed local rate table (value of one unit in USD), the tests never fetch rates
+os.environ['FX_STATIC_RATES'] = 'CAD:0.75,EUR:1.10'
+os.environ['SCHEDULER_AUTOSTART'] = 'false'
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    os.environ['DB_PASSWORD'] = 'sqlite:///' + str(tmp_path_factory.mktemp('db') / 'test.sqlite')
+
+    from webapp import create_app
+
+    return create_app()
+
+
+@pytest.fixture
+def session(app):
+    from webapp import db
+    from webapp.fx import rate_matrix
+
+    with app.app_context():
+        db.create_all()
+        # rebuild the rate matrix from the static rates
+        rate_matrix['loaded_time'] = None
+
+        yield db.session
+
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,33 @@
+import os
+
+from webapp.blog_functions import sync_posts
+
+
+def write_post(path, body: str, mtime: int) -> None:
+    path.write_text(f'---\ntitle: Post\nupdated: 2024-03-01\n---\n{body}\n')
+    os.utime(path, (mtime, mtime))
+
+
+def test_same_day_edit_is_served(app, session, tmp_path):
+    post = tmp_path / 'post.md'
+    client = app.test_client()
+
+    write_post(post, 'first version', 1700000000)
+    sync_posts(str(tmp_path))
+
+    first = client.get('/blog/post')
+    assert b'first version' in first.data
+
+    # same front-matter, so the update date doesn't change
+    write_post(post, 'second version', 1700000600)
+    sync_posts(str(tmp_path))
+
+    response = client.get('/blog/post', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert b'second version' in response.data
+
+    response = client.get('/blog/post', headers={'If-Modified-Since': first.headers['Last-Modified']})
+    assert response.status_code == 200
+
+    response = client.get('/blog/post', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
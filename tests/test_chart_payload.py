@@ -0,0 +1,25 @@
+import numpy as np
+
+from webapp.chart_payload import encode_values
+
+
+def decode_values(encoded: dict, precision=2) -> list:
+    return [None] * encoded['skip'] + (np.cumsum(encoded['d']) / 10**precision).tolist()
+
+
+def test_leading_gaps_are_counted():
+    encoded = encode_values([None, np.nan, 1.5, 2.25])
+
+    assert encoded == {'skip': 2, 'd': [150, 75]}
+    assert decode_values(encoded) == [None, None, 1.5, 2.25]
+
+
+def test_interior_gaps_repeat_the_previous_value():
+    encoded = encode_values([1.5, None, np.nan, 2.0, None])
+
+    assert decode_values(encoded) == [1.5, 1.5, 1.5, 2.0, 2.0]
+
+
+def test_empty_series():
+    assert encode_values([]) == {'skip': 0, 'd': []}
+    assert encode_values([None, None]) == {'skip': 2, 'd': []}
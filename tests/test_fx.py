@@ -0,0 +1,126 @@
+import json
+from datetime import date, datetime, timezone
+
+import numpy as np
+import pytest
+
+from webapp.data_models import User, Portfolio, Security, Quote, Holdings
+from webapp.fx import convert, convert_amount, UnknownCurrencyError
+from webapp.portfolio_sim_functions import get_top_performers, get_portfolio_holdings, get_holdings_breakdown
+from webapp.scheduler_functions import update_portfolio_value
+
+
+def add_user(session, username: str) -> User:
+    user = User(email=f'{username}@test.com', password='x', username=username, creation_date=date.today())
+    session.add(user)
+    session.flush()
+
+    return user
+
+
+def add_portfolio(session, username: str, base_currency: str, cash: float, value=None) -> Portfolio:
+    portfolio = Portfolio(user_id=add_user(session, username).id,
+                          available_cash=cash,
+                          creation_date=date.today(),
+                          updated_value=cash if value is None else value,
+                          updated_time=datetime.now(timezone.utc),
+                          last_close_value=cash,
+                          base_currency=base_currency)
+    session.add(portfolio)
+    session.flush()
+
+    return portfolio
+
+
+def add_stock(session, ticker: str, currency: str, price: float) -> None:
+    now = datetime.now(timezone.utc)
+
+    session.add(Security(ticker=ticker, company_name=ticker, industry='Software', sector='Technology',
+                         currency=currency, company_summary='', updated_time=now))
+    session.add(Quote(ticker=ticker, last_price=price, open_price=price, previous_close=price, updated_time=now))
+
+
+def add_holding(session, portfolio: Portfolio, ticker: str, shares: int, currency: str) -> None:
+    session.add(Holdings(portfolio_id=portfolio.id, ticker=ticker, number_of_shares=shares, average_price=1.0, currency=currency))
+
+
+def test_convert_amount(session):
+    assert convert_amount(100, 'CAD', 'USD') == pytest.approx(75)
+    assert convert_amount(75, 'USD', 'CAD') == pytest.approx(100)
+    assert convert_amount(100, 'EUR', 'CAD') == pytest.approx(110 / 0.75)
+    assert convert_amount(100, 'USD', 'USD') == 100
+
+
+def test_convert_mixed_currencies(session):
+    converted = convert([100, 100, 100], ['USD', 'CAD', 'EUR'], 'USD')
+    assert converted == pytest.approx([100, 75, 110])
+
+    converted = convert([100, 100], ['CAD', 'USD'], ['USD', 'EUR'])
+    assert converted == pytest.approx([75, 100 / 1.10])
+
+
+@pytest.mark.parametrize('currency', ['GBp', 'n/a', 'JPY'])
+def test_unknown_currency_raises(session, currency):
+    with pytest.raises(UnknownCurrencyError):
+        convert_amount(100, currency, 'USD')
+
+
+def test_mixed_currency_portfolio_value(session):
+    add_stock(session, 'AAPL', 'USD', 150.0)
+    add_stock(session, 'SHOP.TO', 'CAD', 80.0)
+
+    usd_portfolio = add_portfolio(session, 'usd', 'USD', 1000.0)
+    cad_portfolio = add_portfolio(session, 'cad', 'CAD', 1000.0)
+
+    for portfolio in [usd_portfolio, cad_portfolio]:
+        add_holding(session, portfolio, 'AAPL', 2, 'USD')
+        add_holding(session, portfolio, 'SHOP.TO', 10, 'CAD')
+
+    session.commit()
+
+    update_portfolio_value()
+
+    # 2 * 150 USD + 10 * 80 CAD
+    assert session.get(Portfolio, usd_portfolio.id).updated_value == pytest.approx(1000 + 300 + 800 * 0.75)
+    assert session.get(Portfolio, cad_portfolio.id).updated_value == pytest.approx(1000 + 300 / 0.75 + 800)
+
+
+def test_leaderboard_ranks_on_usd_value(session):
+    # 12000 CAD is 9000 USD, less than the USD portfolio despite the bigger number
+    add_portfolio(session, 'canadian', 'CAD', 12000.0)
+    add_portfolio(session, 'american', 'USD', 10000.0)
+    add_portfolio(session, 'european', 'EUR', 10000.0)
+    session.commit()
+
+    performers = json.loads(get_top_performers())
+
+    assert [p['Username'] for p in performers] == ['european', 'american', 'canadian']
+    assert [p['Rank'] for p in performers] == [1, 2, 3]
+
+
+def test_unknown_currency_holding_keeps_its_portfolio_value(session):
+    add_stock(session, 'AAPL', 'USD', 150.0)
+    add_stock(session, 'VOD.L', 'GBp', 70.0)
+
+    good_portfolio = add_portfolio(session, 'good', 'USD', 1000.0)
+    bad_portfolio = add_portfolio(session, 'bad', 'USD', 1000.0, value=1234.0)
+
+    add_holding(session, good_portfolio, 'AAPL', 2, 'USD')
+    add_holding(session, bad_portfolio, 'AAPL', 2, 'USD')
+    add_holding(session, bad_portfolio, 'VOD.L', 10, 'GBp')
+    session.commit()
+
+    update_portfolio_value()
+
+    assert session.get(Portfolio, good_portfolio.id).updated_value == pytest.approx(1300)
+    # the GBp holding can't be valued, the portfolio keeps its last value
+    assert session.get(Portfolio, bad_portfolio.id).updated_value == pytest.approx(1234)
+
+    converted = convert([100, 100, 100], ['USD', 'GBp', 'CAD'], 'USD', skip_unknown=True)
+    assert converted[[0, 2]] == pytest.approx([100, 75])
+    assert np.isnan(converted[1])
+
+    # the holdings page shows the holding without a converted value
+    holdings = json.loads(get_portfolio_holdings(bad_portfolio.id))
+    assert [h['Market Value (USD)'] for h in holdings] == [300, None]
+    assert json.loads(get_holdings_breakdown(bad_portfolio.id))['labels'] == ['AAPL']
@@ -0,0 +1,43 @@
+from datetime import date, datetime, timezone
+
+from webapp.data_models import User, Portfolio
+from webapp.history_store import add_records, get_partitions, get_records, drop_partitions
+
+
+def add_portfolio(session) -> Portfolio:
+    user = User(email='history@test.com', password='x', username='history', creation_date=date.today())
+    session.add(user)
+    session.flush()
+
+    portfolio = Portfolio(user_id=user.id,
+                          available_cash=1000.0,
+                          creation_date=date.today(),
+                          updated_value=1000.0,
+                          updated_time=datetime.now(timezone.utc),
+                          last_close_value=1000.0)
+    session.add(portfolio)
+    session.flush()
+
+    return portfolio
+
+
+def test_add_records_leaves_the_commit_to_the_caller(session):
+    record_time = datetime(2031, 5, 4, 15, 0)
+
+    try:
+        portfolio = add_portfolio(session)
+        add_records([{'portfolio_id': portfolio.id, 'record_time': record_time, 'portfolio_value': 1000.0}])
+        session.rollback()
+
+        # the new month's shard went with the rolled back rows
+        assert session.get(Portfolio, portfolio.id) is None
+        assert 'history_2031_05' not in [name for _, name in get_partitions()]
+
+        portfolio = add_portfolio(session)
+        add_records([{'portfolio_id': portfolio.id, 'record_time': record_time, 'portfolio_value': 1000.0}])
+        session.commit()
+
+        assert [r.portfolio_value for r in get_records([portfolio.id])] == [1000.0]
+    finally:
+        session.rollback()
+        drop_partitions(date(2100, 1, 1))
@@ -0,0 +1,36 @@
+import pytest
+
+from webapp.data_models import League
+
+
+@pytest.fixture
+def client(app, session):
+    client = app.test_client()
+    client.post('/sign_up', data={'email': 'league@test.com', 'username': 'league',
+                                  'password1': 'secret1', 'password2': 'secret1'})
+
+    return client
+
+
+@pytest.mark.parametrize('league_id', ['abc', '', '-1', '99'])
+def test_join_bad_league_id(client, league_id):
+    response = client.post('/leagues', data={'joinLeague': league_id}, follow_redirects=True)
+
+    assert response.status_code == 200
+    assert b'Cannot find that league' in response.data
+
+
+def test_play_bad_league_id(client):
+    response = client.post('/leagues', data={'playLeague': 'abc'}, follow_redirects=True)
+
+    assert response.status_code == 200
+    assert b'Cannot find that league' in response.data
+
+
+@pytest.mark.parametrize('starting_funds', ['nan', 'inf', '-inf', '0', 'abc'])
+def test_create_league_bad_starting_funds(client, session, starting_funds):
+    response = client.post('/leagues', data={'createLeague': 'Friends', 'startDate': '2024-03-01',
+                                             'startingFunds': starting_funds}, follow_redirects=True)
+
+    assert response.status_code == 200
+    assert League.query.count() == 0
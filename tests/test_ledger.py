@@ -0,0 +1,61 @@
+from datetime import date, datetime, timezone
+
+from webapp.data_models import User, Portfolio, Transactions
+from webapp.ledger import verify_ledger, reconstruct_portfolio
+
+
+def add_portfolio(session, username: str, cash: float) -> Portfolio:
+    user = User(email=f'{username}@test.com', password='x', username=username, creation_date=date.today())
+    session.add(user)
+    session.flush()
+
+    portfolio = Portfolio(user_id=user.id,
+                          available_cash=cash,
+                          creation_date=date.today(),
+                          updated_value=cash,
+                          updated_time=datetime.now(timezone.utc),
+                          last_close_value=cash)
+    session.add(portfolio)
+    session.flush()
+
+    return portfolio
+
+
+def add_transaction(session, portfolio: Portfolio, status: str, ticker: str, shares: int, price: float) -> Transactions:
+    transaction = Transactions(portfolio_id=portfolio.id,
+                               transaction_date=datetime.now(timezone.utc),
+                               status=status,
+                               company_name=ticker,
+                               ticker=ticker,
+                               currency='USD',
+                               number_of_shares=shares,
+                               price_per_share=price,
+                               total_value=shares * price,
+                               fx_rate=1.0)
+    session.add(transaction)
+    session.flush()
+
+    return transaction
+
+
+def test_sell_of_unknown_ticker_is_reported(session):
+    # sold shares bought before the ledger recorded transactions
+    legacy = add_portfolio(session, 'legacy', 10500.0)
+    sell = add_transaction(session, legacy, 'sell', 'AAPL', 5, 100.0)
+    # an unrelated portfolio with a cash mismatch is still checked
+    drifted = add_portfolio(session, 'drifted', 9000.0)
+    add_transaction(session, drifted, 'buy', 'MSFT', 10, 50.0)
+    session.commit()
+
+    mismatches = verify_ledger()
+
+    assert {'portfolio_id': legacy.id,
+            'field': f'transaction {sell.id}',
+            'stored': 'sell of 5 AAPL',
+            'ledger': '0 held'} in mismatches
+    assert [m['field'] for m in mismatches if m['portfolio_id'] == drifted.id] == ['available_cash', 'holding MSFT']
+
+    ledger = reconstruct_portfolio(legacy.id)
+    assert ledger['cash'] == 10500.0
+    assert ledger['holdings'] == {}
+    assert [a['transaction_id'] for a in ledger['anomalies']] == [sell.id]
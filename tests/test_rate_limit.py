@@ -0,0 +1,26 @@
+from webapp.rate_limit import MemoryBucketStore
+
+
+def test_memory_buckets_are_capped():
+    store = MemoryBucketStore(limit=100)
+
+    for i in range(1000):
+        store.take(f'ip:10.0.{i // 256}.{i % 256}', capacity=5, refill_rate=0)
+
+    assert len(store.buckets) <= 100
+
+
+def test_recent_buckets_survive_eviction():
+    store = MemoryBucketStore(limit=100)
+
+    for _ in range(5):
+        assert store.take('ip:1.1.1.1', capacity=5, refill_rate=0)
+
+    for i in range(150):
+        store.take(f'ip:10.0.0.{i}', capacity=5, refill_rate=0)
+        # the busy client keeps using its bucket, it stays empty
+        assert not store.take('ip:1.1.1.1', capacity=5, refill_rate=0)
+
+
+def test_forwarded_for_is_not_trusted_by_default(app):
+    assert app.config['PROXY_COUNT'] == 0
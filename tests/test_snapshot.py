@@ -0,0 +1,63 @@
+import sqlite3
+from datetime import date, datetime, timezone
+
+import pytest
+
+from webapp.data_models import User, Portfolio, Security, Quote, Transactions
+from webapp.snapshot import export_snapshot, load_snapshot
+
+pytest.importorskip('pyarrow')
+
+
+def add_transaction(session, portfolio_id: int, transaction_id: int) -> None:
+    session.add(Transactions(id=transaction_id,
+                             portfolio_id=portfolio_id,
+                             transaction_date=datetime.now(timezone.utc),
+                             status='buy',
+                             company_name='Apple',
+                             ticker='AAPL',
+                             currency='USD',
+                             number_of_shares=1,
+                             price_per_share=100.0,
+                             total_value=100.0,
+                             fx_rate=1.0))
+
+
+def test_late_commit_is_exported_and_snapshot_loads(session, tmp_path):
+    now = datetime.now(timezone.utc)
+    user = User(email='snap@test.com', password='x', username='snap', creation_date=date.today())
+    session.add(user)
+    session.flush()
+
+    portfolio = Portfolio(user_id=user.id, available_cash=9800.0, creation_date=date.today(),
+                          updated_value=10000.0, updated_time=now, last_close_value=10000.0)
+    session.add(portfolio)
+    session.add(Security(ticker='AAPL', company_name='Apple', industry='Software', sector='Technology',
+                         currency='USD', company_summary='', updated_time=now))
+    session.add(Quote(ticker='AAPL', last_price=100.0, open_price=100.0, previous_close=100.0, updated_time=now))
+    session.flush()
+    portfolio_id = portfolio.id
+
+    add_transaction(session, portfolio_id, 1)
+    add_transaction(session, portfolio_id, 3)
+    session.commit()
+
+    export_dir = str(tmp_path / 'snapshot')
+    assert export_snapshot(export_dir)['transactions'] == 2
+
+    # id 2 was taken before id 3 but its transaction committed after the export
+    add_transaction(session, portfolio_id, 2)
+    session.commit()
+
+    counts = export_snapshot(export_dir)
+    assert counts['transactions'] == 1
+    assert counts['portfolio'] == counts['security'] == counts['quote'] == 1
+
+    sqlite_path = str(tmp_path / 'restored.sqlite')
+    load_snapshot(export_dir, sqlite_path)
+
+    restored = sqlite3.connect(sqlite_path)
+    assert [i for i, in restored.execute('SELECT id FROM transactions ORDER BY id')] == [1, 2, 3]
+    assert restored.execute('SELECT available_cash FROM portfolio').fetchall() == [(9800.0,)]
+    assert restored.execute('SELECT last_price FROM quote').fetchall() == [(100.0,)]
+    restored.close()
@@ -0,0 +1,24 @@
+from webapp import symbol_directory as symbols
+from webapp.symbol_directory import SymbolDirectory, load_symbols_csv
+
+
+def test_worker_reloads_a_same_size_symbol_file(session, tmp_path, monkeypatch):
+    path = tmp_path / 'symbols.csv'
+    path.write_text('ticker,name,sector\nAAPL,Apple Inc.,Technology\nT,AT&T Inc.,Telecom\n')
+    load_symbols_csv(str(path))
+
+    # another worker's index
+    worker = SymbolDirectory()
+    assert worker.get('T')['name'] == 'AT&T Inc.'
+
+    # same number of rows, a ticker renamed and a sector changed
+    path.write_text('ticker,name,sector\nAAPL,Apple Inc.,Hardware\nTSLA,Tesla Inc.,Automotive\n')
+    load_symbols_csv(str(path))
+
+    assert worker.get('T') is not None
+
+    monkeypatch.setattr(symbols, 'SYMBOL_CHECK_INTERVAL', -1)
+
+    assert worker.get('T') is None
+    assert worker.get('TSLA')['name'] == 'Tesla Inc.'
+    assert worker.get('AAPL')['sector'] == 'Hardware'
@@ -0,0 +1,68 @@
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from webapp import watchlist
+from webapp.data_models import User, WatchlistItem
+from webapp.market_calendar import MARKET_TIMEZONE
+
+LAST_CLOSE = MARKET_TIMEZONE.localize(datetime(2024, 3, 1, 16, 0)).astimezone(timezone.utc)
+
+
+@pytest.fixture
+def upstream(session, monkeypatch):
+    calls = {'bars': [], 'prices': []}
+
+    def fetch_bars(tickers):
+        calls['bars'].append(tickers)
+        days = [date(2024, 3, 1) - timedelta(days=i) for i in range(5, -1, -1)]
+
+        return {t: [(day, 10.0 + i, 10.0 + i) for i, day in enumerate(days)] for t in tickers}
+
+    def fetch_prices(tickers):
+        calls['prices'].append(tickers)
+
+        return {t: 20.0 for t in tickers}
+
+    monkeypatch.setattr(watchlist, 'fetch_bars', fetch_bars)
+    monkeypatch.setattr(watchlist, 'fetch_prices', fetch_prices)
+    monkeypatch.setattr(watchlist, 'get_last_close', lambda: LAST_CLOSE)
+    monkeypatch.setattr(watchlist, 'live_prices', {})
+
+    user = User(email='watch@test.com', password='x', username='watch', creation_date=date.today())
+    session.add(user)
+    session.flush()
+
+    for ticker in ['AAPL', 'MSFT']:
+        session.add(WatchlistItem(user_id=user.id, ticker=ticker, added_time=datetime.now(timezone.utc)))
+
+    session.commit()
+
+    return user, calls
+
+
+def test_bars_are_downloaded_once_per_trading_day(upstream, monkeypatch):
+    user, calls = upstream
+    monkeypatch.setattr(watchlist, 'is_market_open', lambda: True)
+
+    first = watchlist.get_watchlist(user.id)
+    second = watchlist.get_watchlist(user.id)
+
+    assert calls['bars'] == [('AAPL', 'MSFT')]
+    # the live price is fresh for the second view
+    assert calls['prices'] == [('AAPL', 'MSFT')]
+    assert first == second
+    # the change is against the last finished session's close
+    assert first[0]['price'] == 20.0
+    assert first[0]['change'] == 5.0
+
+
+def test_closed_market_shows_the_last_session(upstream, monkeypatch):
+    user, calls = upstream
+    monkeypatch.setattr(watchlist, 'is_market_open', lambda: False)
+
+    stock = watchlist.get_watchlist(user.id)[0]
+
+    assert calls['prices'] == []
+    assert stock['price'] == 15.0
+    assert stock['change'] == 1.0